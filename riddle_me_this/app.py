@@ -82,6 +82,12 @@ def register_commands(app):
     """Register Click commands."""
     app.cli.add_command(commands.test)
     app.cli.add_command(commands.lint)
+    app.cli.add_command(commands.benchmark_whisper)
+    app.cli.add_command(commands.transcription_worker)
+    app.cli.add_command(commands.transcription_retry)
+    app.cli.add_command(commands.chunk_index)
+    app.cli.add_command(commands.cache_stats)
+    app.cli.add_command(commands.ingest)
 
 
 def configure_logger(app):
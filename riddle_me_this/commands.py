@@ -5,6 +5,8 @@ from glob import glob
 from subprocess import call
 
 import click
+from flask import current_app
+from flask.cli import with_appcontext
 
 HERE = os.path.abspath(os.path.dirname(__file__))
 PROJECT_ROOT = os.path.join(HERE, os.pardir)
@@ -73,3 +75,219 @@ def lint(fix_imports, check):
         execute_tool("Fixing import order", "isort", *isort_args)
     execute_tool("Formatting style", "black", *black_args)
     execute_tool("Checking code style", "flake8")
+
+
+@click.command("benchmark-whisper")
+@click.argument("audio_file", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "-s",
+    "--size",
+    "sizes",
+    multiple=True,
+    help="Whisper model size to benchmark, may be repeated. Defaults to tiny, base and small.",
+)
+def benchmark_whisper(audio_file, sizes):
+    """Benchmark the real-time factor of the local Whisper models on the CPU."""
+    from riddle_me_this.user.transcription import WHISPER_SIZES
+    from riddle_me_this.user.transcription import benchmark_whisper as run_benchmark
+
+    click.echo(f"{'size':<8}{'int8':<6}{'load s':>8}{'run s':>9}{'RTF':>8}")
+    for result in run_benchmark(audio_file, sizes=sizes or WHISPER_SIZES):
+        click.echo(
+            f"{result['size']:<8}{'yes' if result['quantized'] else 'no':<6}"
+            f"{result['load_seconds']:>8.1f}{result['seconds']:>9.1f}"
+            f"{result['real_time_factor']:>8.3f}"
+        )
+
+
+@click.command("transcription-worker")
+@click.option(
+    "--poll-interval",
+    default=5.0,
+    show_default=True,
+    help="Seconds to wait before polling an empty queue again.",
+)
+@click.option(
+    "--burst", is_flag=True, default=False, help="Exit once the queue is empty."
+)
+@with_appcontext
+def transcription_worker(poll_interval, burst):
+    """Run queued Whisper transcriptions, compacting the chunk index while idle."""
+    from riddle_me_this.user.jobs import run_worker
+    from riddle_me_this.user.services import run_transcription_job
+    from riddle_me_this.user.vector_index import compact_chunk_index
+
+    processed = run_worker(
+        run_transcription_job,
+        poll_interval=poll_interval,
+        burst=burst,
+        on_idle=lambda: compact_chunk_index(
+            current_app.config["VECTOR_INDEX_COMPACT_SEGMENTS"]
+        ),
+    )
+    click.echo(f"Ran {processed} transcription jobs")
+
+
+@click.command("transcription-retry")
+@click.option("--video-id", help="Only retry the jobs of this video.")
+@with_appcontext
+def transcription_retry(video_id):
+    """Queue failed transcription jobs again."""
+    from riddle_me_this.user.jobs import retry_failed_jobs
+
+    click.echo(f"Queued {retry_failed_jobs(video_id)} failed transcription jobs")
+
+
+@click.command("chunk-index")
+@click.option(
+    "--rebuild",
+    is_flag=True,
+    default=False,
+    help="Rebuild the index from every chunk in the database.",
+)
+@with_appcontext
+def chunk_index(rebuild):
+    """Fold newly loaded chunks into the chunk index, retraining it if it has grown."""
+    from riddle_me_this.user.vector_index import (
+        compact_chunk_index,
+        rebuild_chunk_index,
+    )
+
+    index = rebuild_chunk_index() if rebuild else compact_chunk_index()
+    if index is None:
+        click.echo("The chunk index is up to date")
+    else:
+        click.echo(f"The chunk index holds {len(index)} chunks")
+
+
+@click.command("cache-stats")
+@with_appcontext
+def cache_stats():
+    """Show the hit rates and sizes of the answer and audio caches."""
+    from riddle_me_this.user.answer_cache import get_answer_cache
+    from riddle_me_this.user.audio_cache import get_audio_cache
+
+    caches = {"answers": get_answer_cache(), "audio": get_audio_cache()}
+    for name, cache in caches.items():
+        if cache is None:
+            click.echo(f"{name}: disabled")
+            continue
+        stats = ", ".join(
+            f"{key}={value:.1%}" if key.endswith("rate") else f"{key}={value}"
+            for key, value in cache.stats().items()
+        )
+        click.echo(f"{name}: {stats}")
+
+
+@click.command()
+@click.option(
+    "-p",
+    "--playlist",
+    "playlists",
+    multiple=True,
+    help="A playlist ID or link whose videos to ingest, may be repeated.",
+)
+@click.option(
+    "-c",
+    "--channel",
+    "channels",
+    multiple=True,
+    help="A channel ID whose uploads to ingest, may be repeated.",
+)
+@click.option(
+    "-f",
+    "--ids-file",
+    type=click.File("r"),
+    help="A file with one video ID or link per line, or - for stdin.",
+)
+@click.option(
+    "--language", default="en", show_default=True, help="Transcript language."
+)
+@click.option(
+    "--transcribe",
+    type=click.Choice(["queue", "local", "remote", "none"]),
+    default="queue",
+    show_default=True,
+    help="What to do for videos without captions: queue them for the transcription "
+    "workers, run the local or remote Whisper here, or nothing.",
+)
+@click.option(
+    "-w", "--workers", default=4, show_default=True, help="Videos processed at once."
+)
+@click.option(
+    "--youtube-rate",
+    default=5.0,
+    show_default=True,
+    help="YouTube Data API calls per second, 0 for no limit.",
+)
+@click.option(
+    "--captions-rate",
+    default=2.0,
+    show_default=True,
+    help="Caption downloads per second, 0 for no limit.",
+)
+@click.option(
+    "--whisper-rate",
+    default=0.0,
+    show_default=True,
+    help="Whisper transcriptions started per second, 0 for no limit.",
+)
+@with_appcontext
+def ingest(
+    playlists,
+    channels,
+    ids_file,
+    language,
+    transcribe,
+    workers,
+    youtube_rate,
+    captions_rate,
+    whisper_rate,
+):
+    """Load the metadata and transcripts of many videos ahead of time.
+
+    Run it again to resume an interrupted ingestion: stored videos are skipped.
+    Without a signed-in user, the YouTube Data API is called with YOUTUBE_API_KEY.
+    """
+    from riddle_me_this.user import ingest as ingestion
+    from riddle_me_this.user.services import get_youtube_service
+
+    youtube = get_youtube_service()
+    if youtube is None:
+        raise click.ClickException("Set YOUTUBE_API_KEY to call the YouTube Data API.")
+    rates = {
+        "youtube": youtube_rate,
+        "captions": captions_rate,
+        "whisper": whisper_rate,
+    }
+    run = ingestion.Ingestion(
+        language_code=language,
+        transcribe=transcribe,
+        workers=workers,
+        rates=rates,
+        report=lambda done, total, video_id, outcome: click.echo(
+            f"[{done}/{total}] {video_id}: {outcome}"
+        ),
+    )
+
+    video_ids = []
+    if ids_file:
+        video_ids += ingestion.read_video_ids(ids_file)
+    for playlist in playlists:
+        video_ids += ingestion.playlist_video_ids(
+            youtube, ingestion.playlist_id_from(playlist), run.limiters["youtube"]
+        )
+    for channel in channels:
+        video_ids += ingestion.channel_video_ids(
+            youtube, channel, run.limiters["youtube"]
+        )
+    if not video_ids:
+        raise click.UsageError("Give a playlist, a channel or a file of video IDs.")
+
+    summary = run.run(video_ids)
+    click.echo(
+        f"Ingested {summary.pop('videos')} videos in {summary.pop('seconds'):.0f}s "
+        f"({summary.pop('videos_per_minute'):.1f} videos/min)"
+    )
+    for outcome, count in sorted(summary.items()):
+        click.echo(f"  {outcome}: {count}")
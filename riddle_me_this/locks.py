@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""Cross-process single-flight locks.
+
+When several requests need the same expensive result at once, e.g. the transcript
+of a video that was just shared, only the first should compute it while the others
+wait and then read what it stored. The locks are ``flock`` locks on files in the
+LOCK_DIR directory, so they are shared by every worker process on the host. Waiting
+polls with a non-blocking ``flock`` and ``time.sleep``, which gevent patches, so a
+waiting request doesn't block the other greenlets of its worker.
+"""
+import fcntl
+import hashlib
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from flask import current_app
+
+
+class LockTimeout(Exception):
+    """Raised when a single-flight lock isn't acquired in time."""
+
+
+def _lock_path(key):
+    """Return the lock file of a key, creating the lock directory if needed."""
+    directory = current_app.config["LOCK_DIR"]
+    os.makedirs(directory, exist_ok=True)
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+    return os.path.join(directory, f"{digest}.lock")
+
+
+@contextmanager
+def single_flight(key, timeout=None, poll_interval=0.2):
+    """
+    Hold the lock of a key, waiting for any other holder in any process to release it.
+
+    The lock isn't reentrant: code holding it must not ask for the same key again.
+    Callers should check for the result again once they hold the lock, since another
+    caller may have produced it while they waited.
+
+    Args:
+        key (str): What the lock is for, e.g. "transcripts:dQw4w9WgXcQ".
+        timeout (float, optional): The seconds to wait for the lock. Defaults to the
+        SINGLE_FLIGHT_TIMEOUT setting.
+        poll_interval (float, optional): The seconds between attempts. Defaults to 0.2.
+
+    Raises:
+        LockTimeout: If the lock is still held by someone else after `timeout` seconds.
+    """
+    if timeout is None:
+        timeout = current_app.config["SINGLE_FLIGHT_TIMEOUT"]
+    deadline = time.monotonic() + timeout
+    with open(_lock_path(key), "w") as lock_file:
+        waited = False
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    raise LockTimeout(f"Timed out waiting for {key}")
+                waited = True
+                time.sleep(poll_interval)
+        if waited:
+            logging.info(f"Waited for another caller to finish {key}")
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
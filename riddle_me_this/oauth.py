@@ -1,13 +1,21 @@
 """OAuth 2.0 authentication for Google."""
+import hashlib
+import json
 import os
+import time
 
 import dotenv
 import requests
 from flask import current_app, session
 from flask_oauthlib.client import OAuth
 
+from riddle_me_this.locks import single_flight
+
 dotenv.load_dotenv()
 
+# Shared by every refresh in the process, so the connection to the token endpoint is reused
+_token_session = requests.Session()
+
 
 def init_oauth():
     """
@@ -42,7 +50,7 @@ def init_oauth():
         base_url="https://www.googleapis.com/oauth2/v1/",
         request_token_url=None,
         access_token_method="POST",
-        access_token_url="https://accounts.google.com/o/oauth2/token",
+        access_token_url=current_app.config["GOOGLE_TOKEN_URL"],
         authorize_url="https://accounts.google.com/o/oauth2/auth",
     )
     return google
@@ -60,8 +68,8 @@ def refresh_access_token(refresh_token):
     refresh_token -- str -- the refresh token used to obtain a new access token.
 
     Returns:
-    tuple -- a tuple of two strings representing the new
-    access token and the new refresh token.
+    tuple -- the new access token, the new refresh token and the
+    number of seconds the access token is valid for, or three Nones.
     """
     payload = {
         "client_id": os.getenv("CLIENT_ID"),
@@ -69,24 +77,118 @@ def refresh_access_token(refresh_token):
         "grant_type": "refresh_token",
         "refresh_token": refresh_token,
     }
-    response = requests.post("https://accounts.google.com/o/oauth2/token", data=payload)
+    response = _token_session.post(
+        current_app.config["GOOGLE_TOKEN_URL"], data=payload, timeout=30
+    )
     response_data = response.json()
 
     if response.status_code == 200:
         new_access_token = response_data.get("access_token")
         new_refresh_token = response_data.get("refresh_token", refresh_token)
-        return new_access_token, new_refresh_token
+        expires_in = response_data.get("expires_in", 3600)
+        return new_access_token, new_refresh_token, expires_in
     else:
-        return None, None
+        return None, None, None
+
+
+def store_google_token(access_token, refresh_token, expires_in):
+    """
+    Stores Google tokens in the session along with when the access token expires.
+
+    Args:
+    access_token -- str -- the access token.
+    refresh_token -- str -- the refresh token.
+    expires_in -- int -- the number of seconds the access token is valid for.
+    """
+    session["google_token"] = (access_token, "")
+    session["google_refresh_token"] = refresh_token
+    session["google_token_expires_at"] = time.time() + expires_in
+
+
+def _token_path(digest):
+    """Return the file holding a user's refreshed access token, next to the refresh lock."""
+    directory = current_app.config["LOCK_DIR"]
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"google_token_{digest[:32]}.json")
+
+
+def _read_token(path, margin):
+    """Return the token stored in a file, unless it is missing or about to expire."""
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return entry if entry["expires_at"] > time.time() + margin else None
+
+
+def _write_token(path, entry):
+    """Atomically write a token to a file only the app's user can read."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with os.fdopen(
+        os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w"
+    ) as f:
+        json.dump(entry, f)
+    os.replace(tmp_path, path)
+
+
+def _remove_expired_tokens(directory):
+    """Remove the token files whose access token has expired."""
+    for name in os.listdir(directory):
+        if name.startswith("google_token_") and name.endswith(".json"):
+            path = os.path.join(directory, name)
+            if not _read_token(path, margin=0):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+
+def _shared_refresh(refresh_token):
+    """
+    Refreshes an access token at most once across concurrent requests of the same user.
+
+    The new access token and its expiry time are kept in a file in LOCK_DIR until the
+    token expires, so the requests of every worker process on the host whose session
+    still holds the old token reuse it instead of refreshing again. The refresh token
+    is never written to the file: only the caller that refreshed gets a new one, and
+    the others keep theirs, which stays valid.
+
+    Args:
+    refresh_token -- str -- the refresh token of the user.
+
+    Returns:
+    tuple -- the access token, refresh token and expiry time, or None if the refresh failed.
+    """
+    digest = hashlib.sha256(refresh_token.encode("utf-8")).hexdigest()
+    path = _token_path(digest)
+    margin = current_app.config["GOOGLE_TOKEN_REFRESH_MARGIN"]
+
+    entry = _read_token(path, margin)
+    if entry:
+        return entry["access_token"], refresh_token, entry["expires_at"]
+    with single_flight(f"google_token:{digest}"):
+        entry = _read_token(path, margin)
+        if entry:
+            return entry["access_token"], refresh_token, entry["expires_at"]
+        access_token, new_refresh_token, expires_in = refresh_access_token(
+            refresh_token
+        )
+        if not (access_token and new_refresh_token):
+            return None
+        expires_at = time.time() + expires_in
+        _write_token(path, {"access_token": access_token, "expires_at": expires_at})
+    _remove_expired_tokens(os.path.dirname(path))
+    return access_token, new_refresh_token, expires_at
 
 
 def get_google_token(token=None):
     """
     Retrieves the Google access token from the current session.
 
-    If the token has expired, this function attempts
-    to refresh it with the refresh token. If the refresh token is also invalid,
-    both tokens are removed from the
+    The access token is reused until shortly before it expires. Then this function
+    refreshes it with the refresh token, once for all the concurrent requests of the
+    user. If the refresh token is also invalid, both tokens are removed from the
     session and None is returned.
 
     Args:
@@ -101,15 +203,18 @@ def get_google_token(token=None):
     google_token = session.get("google_token")
     google_refresh_token = session.get("google_refresh_token")
 
-    if google_token and google_refresh_token:
-        access_token, refresh_token = refresh_access_token(google_refresh_token)
-        if access_token and refresh_token:
-            session["google_token"] = (access_token, "")
-            session["google_refresh_token"] = refresh_token
-            return access_token, ""
-        else:
-            session.pop("google_token", None)
-            session.pop("google_refresh_token", None)
-            return None, None
+    if not (google_token and google_refresh_token):
+        return None, None
+    expires_at = session.get("google_token_expires_at", 0)
+    if expires_at > time.time() + current_app.config["GOOGLE_TOKEN_REFRESH_MARGIN"]:
+        return google_token[0], ""
+    refreshed = _shared_refresh(google_refresh_token)
+    if refreshed:
+        access_token, refresh_token, expires_at = refreshed
+        store_google_token(access_token, refresh_token, expires_at - time.time())
+        return access_token, ""
     else:
+        session.pop("google_token", None)
+        session.pop("google_refresh_token", None)
+        session.pop("google_token_expires_at", None)
         return None, None
@@ -9,13 +9,12 @@ from flask import (
     redirect,
     render_template,
     request,
-    session,
     url_for,
 )
 from flask_login import current_user, login_required, login_user, logout_user
 
 from riddle_me_this.extensions import login_manager
-from riddle_me_this.oauth import get_google_token, init_oauth
+from riddle_me_this.oauth import get_google_token, init_oauth, store_google_token
 from riddle_me_this.public.forms import LoginForm
 from riddle_me_this.user.models import User
 from riddle_me_this.utils import flash_errors
@@ -144,8 +143,9 @@ def authorized():
         )
     # It would probably be better to store the tokens in the database
     # rather than in the session.
-    session["google_token"] = (resp["access_token"], "")
-    session["google_refresh_token"] = resp.get("refresh_token")
+    store_google_token(
+        resp["access_token"], resp.get("refresh_token"), resp.get("expires_in", 0)
+    )
     me = google.get("userinfo")
 
     # Check if the user exists, create one if not
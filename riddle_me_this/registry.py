@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""Process-wide registry for the heavy NLP and speech models.
+
+Each model is loaded at most once per worker process and then shared by every
+request. Under gunicorn's gevent worker ``threading`` is monkey-patched, so the
+locks below also serialize concurrent greenlets asking for the same model.
+"""
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+
+
+def resident_memory():
+    """
+    Return the resident set size of the current process in bytes.
+
+    Returns:
+        int: The resident memory of the process.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss is the peak, not the current RSS, but it's the best we have
+        # outside of Linux. It is reported in bytes on macOS and KiB elsewhere.
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == "darwin" else rss * 1024
+
+
+class ModelRegistry:
+    """
+    A thread and greenlet safe cache of loaded models.
+
+    Attributes:
+        models (dict): The loaded models, keyed by name.
+        model_stats (dict): Load time, resident memory and hit count per model.
+    """
+
+    def __init__(self):
+        """Initialize an empty ModelRegistry."""
+        self.models = {}
+        self.model_stats = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def _key_lock(self, name):
+        """Return the lock guarding the model with the given name."""
+        with self._lock:
+            return self._key_locks.setdefault(name, threading.Lock())
+
+    def get(self, name, loader):
+        """
+        Return the model with the given name, loading it on first use.
+
+        Only one caller runs the loader for a given name; any others asking for
+        the same model at the same time wait for it and receive the same instance.
+
+        Args:
+            name (str): The registry key of the model, e.g. "spacy:en_core_web_md".
+            loader (callable): A function without arguments that loads the model.
+
+        Returns:
+            object: The shared model instance.
+        """
+        if name in self.models:
+            self.model_stats[name]["hits"] += 1
+            return self.models[name]
+
+        with self._key_lock(name):
+            if name in self.models:
+                self.model_stats[name]["hits"] += 1
+                return self.models[name]
+
+            rss_before = resident_memory()
+            start = time.perf_counter()
+            model = loader()
+            load_seconds = time.perf_counter() - start
+            rss_bytes = max(resident_memory() - rss_before, 0)
+
+            self.model_stats[name] = {
+                "load_seconds": load_seconds,
+                "rss_bytes": rss_bytes,
+                "loaded_at": time.time(),
+                "hits": 0,
+            }
+            self.models[name] = model
+            logging.info(
+                f"Loaded model {name} in {load_seconds:.2f}s "
+                f"(+{rss_bytes / 2 ** 20:.1f} MiB resident)"
+            )
+        return model
+
+    def stats(self):
+        """
+        Return the load statistics of every loaded model.
+
+        Returns:
+            dict: A copy of the statistics, keyed by model name.
+        """
+        return {name: dict(stats) for name, stats in self.model_stats.items()}
+
+    def unload(self, name):
+        """
+        Drop a model from the registry so that the next get() reloads it.
+
+        Args:
+            name (str): The registry key of the model.
+        """
+        with self._key_lock(name):
+            self.models.pop(name, None)
+            self.model_stats.pop(name, None)
+
+    def clear(self):
+        """Drop every model from the registry."""
+        for name in list(self.models):
+            self.unload(name)
+
+
+model_registry = ModelRegistry()
@@ -21,3 +21,37 @@ DEBUG_TB_ENABLED = DEBUG
 DEBUG_TB_INTERCEPT_REDIRECTS = False
 CACHE_TYPE = "SimpleCache"  # Can be "MemcachedCache", "RedisCache", etc.
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+ANSWER_CACHE_MAX_ENTRIES = env.int("ANSWER_CACHE_MAX_ENTRIES", default=10000)
+ANSWER_CACHE_TTL = env.int("ANSWER_CACHE_TTL", default=7 * 24 * 3600)
+SEMANTIC_CACHE_THRESHOLD = env.float("SEMANTIC_CACHE_THRESHOLD", default=0.9)
+SEMANTIC_CACHE_MIN_TERM_OVERLAP = env.float(
+    "SEMANTIC_CACHE_MIN_TERM_OVERLAP", default=0.0
+)
+VECTOR_INDEX_PATH = env.str("VECTOR_INDEX_PATH", default="instance/chunk_index.npz")
+VECTOR_INDEX_COMPACT_SEGMENTS = env.int("VECTOR_INDEX_COMPACT_SEGMENTS", default=100)
+QA_BATCH_MAX_QUESTIONS = env.int("QA_BATCH_MAX_QUESTIONS", default=50)
+QA_BATCH_CONCURRENCY = env.int("QA_BATCH_CONCURRENCY", default=4)
+WHISPER_MODEL_SIZE = env.str("WHISPER_MODEL_SIZE", default="tiny")
+WHISPER_QUANTIZE = env.bool("WHISPER_QUANTIZE", default=False)
+TRANSCRIPTION_MAX_ATTEMPTS = env.int("TRANSCRIPTION_MAX_ATTEMPTS", default=3)
+TRANSCRIPTION_RETRY_DELAY = env.int("TRANSCRIPTION_RETRY_DELAY", default=30)
+TRANSCRIPTION_JOB_TIMEOUT = env.int("TRANSCRIPTION_JOB_TIMEOUT", default=3600)
+TRANSCRIPTION_WORKERS = env.int("TRANSCRIPTION_WORKERS", default=1)
+WHISPER_WORKERS = env.int("WHISPER_WORKERS", default=0)
+WHISPER_SEGMENT_SECONDS = env.int("WHISPER_SEGMENT_SECONDS", default=300)
+WHISPER_VAD = env.bool("WHISPER_VAD", default=False)
+LOCK_DIR = env.str("LOCK_DIR", default="instance/locks")
+SINGLE_FLIGHT_TIMEOUT = env.int("SINGLE_FLIGHT_TIMEOUT", default=900)
+AUDIO_CACHE_DIR = env.str("AUDIO_CACHE_DIR", default="instance/audio_cache")
+AUDIO_CACHE_MAX_BYTES = env.int("AUDIO_CACHE_MAX_BYTES", default=5 * 2**30)
+WHISPER_API_BASE = env.str("WHISPER_API_BASE", default="https://api.openai.com/v1")
+WHISPER_API_MAX_BYTES = env.int("WHISPER_API_MAX_BYTES", default=24 * 2**20)
+WHISPER_API_CONCURRENCY = env.int("WHISPER_API_CONCURRENCY", default=4)
+GOOGLE_TOKEN_URL = env.str(
+    "GOOGLE_TOKEN_URL", default="https://accounts.google.com/o/oauth2/token"
+)
+GOOGLE_TOKEN_REFRESH_MARGIN = env.int("GOOGLE_TOKEN_REFRESH_MARGIN", default=300)
+DISCOVERY_CACHE_DIR = env.str("DISCOVERY_CACHE_DIR", default="instance/discovery")
+TRANSCRIPT_EAGER_LANGUAGES = env.bool("TRANSCRIPT_EAGER_LANGUAGES", default=False)
+TRANSCRIPT_FETCH_WORKERS = env.int("TRANSCRIPT_FETCH_WORKERS", default=4)
+YOUTUBE_API_KEY = env.str("YOUTUBE_API_KEY", default=None)
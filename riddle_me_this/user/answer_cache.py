@@ -0,0 +1,289 @@
+"""Database-backed cache of LLM answers, shared by every worker process."""
+import datetime as dt
+import hashlib
+import json
+import re
+
+import numpy as np
+from flask import current_app
+
+from riddle_me_this.database import db
+from riddle_me_this.user.lexical_index import tokenize
+from riddle_me_this.user.models import CachedAnswer, SemanticCacheHit, StatCounter
+from riddle_me_this.user.vector_index import top_k_similar
+
+
+def normalize_question(question):
+    """
+    Normalize a question so that trivially different spellings share a cache entry.
+
+    Args:
+        question (str): The question as the user typed it.
+
+    Returns:
+        str: The lowercased question with collapsed whitespace and no trailing punctuation.
+    """
+    return re.sub(r"\s+", " ", question).strip().rstrip("?!. ").lower()
+
+
+def _sha256(text):
+    """Return the hex SHA-256 digest of a string."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def term_overlap(question, other):
+    """
+    Return the Jaccard overlap of the BM25 content terms of two questions.
+
+    Args:
+        question (str): A question.
+        other (str): Another question.
+
+    Returns:
+        float: The share of their terms the questions have in common, 1.0 if neither has any.
+    """
+    terms, other_terms = set(tokenize(question)), set(tokenize(other))
+    if not terms | other_terms:
+        return 1.0
+    return len(terms & other_terms) / len(terms | other_terms)
+
+
+class AnswerCache:
+    """
+    An LRU cache of answers with a time-to-live and a maximum number of entries.
+
+    Entries are keyed by transcript, normalized question, the context sent to the
+    model and the model parameters, so a change to any of them is a miss. A second
+    tier, get_similar(), matches differently worded questions by their embeddings.
+
+    Attributes:
+        max_entries (int): The number of entries kept before the least recently used are evicted.
+        ttl (int): The number of seconds an entry stays valid.
+        similarity_threshold (float): The cosine similarity a question needs to reuse the
+        answer of a cached one; 0 disables the semantic tier.
+        min_term_overlap (float): The share of content terms a question needs in common
+        with a cached one to reuse its answer; 0 disables the check.
+        name (str): The prefix of the cache's hit and miss counters.
+    """
+
+    def __init__(
+        self,
+        max_entries=10000,
+        ttl=7 * 24 * 3600,
+        similarity_threshold=0.9,
+        min_term_overlap=0.0,
+        name="answer_cache",
+    ):
+        """
+        Initialize an AnswerCache.
+
+        Args:
+            max_entries (int, optional): The maximum number of entries. Defaults to 10000.
+            ttl (int, optional): The lifetime of an entry in seconds. Defaults to one week.
+            similarity_threshold (float, optional): The similarity needed for a semantic
+            hit. Defaults to 0.9.
+            min_term_overlap (float, optional): The Jaccard overlap of content terms needed
+            for a semantic hit. Defaults to 0, no check.
+            name (str, optional): The prefix of the counters. Defaults to "answer_cache".
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.min_term_overlap = min_term_overlap
+        self.name = name
+
+    @staticmethod
+    def make_key(transcript_id, question, context, model_params):
+        """
+        Build the cache key of a question.
+
+        Args:
+            transcript_id (int): The id of the transcript the question is about.
+            question (str): The question.
+            context (str): The context sent to the model.
+            model_params (dict): The model name and generation settings.
+
+        Returns:
+            tuple: The key and the hash of the context.
+        """
+        context_hash = _sha256(context)
+        key = _sha256(
+            json.dumps(
+                [
+                    transcript_id,
+                    normalize_question(question),
+                    context_hash,
+                    model_params,
+                ],
+                sort_keys=True,
+            )
+        )
+        return key, context_hash
+
+    def get(self, transcript_id, question, context, model_params):
+        """
+        Look up a cached answer, refreshing its position in the LRU order.
+
+        Returns:
+            str or None: The cached answer, or None on a miss.
+        """
+        key, _ = self.make_key(transcript_id, question, context, model_params)
+        entry = CachedAnswer.query.filter_by(key=key).first()
+        now = dt.datetime.utcnow()
+        if entry and entry.created_at < now - dt.timedelta(seconds=self.ttl):
+            entry.delete()
+            entry = None
+        if not entry:
+            StatCounter.increment(f"{self.name}.misses")
+            return None
+        entry.update(commit=False, last_used_at=now, hit_count=entry.hit_count + 1)
+        StatCounter.increment(f"{self.name}.hits")
+        return entry.answer
+
+    def get_similar(self, transcript_id, question, question_vector, model_params):
+        """
+        Look up the answer of the most similar cached question about the same transcript.
+
+        Averaged word vectors can score questions about different things, like "who is
+        the speaker" and "who is the host", close to rewordings; with `min_term_overlap`,
+        only cached questions sharing enough BM25 content terms with the question are
+        candidates, at the cost of missing rewordings in other words.
+
+        A hit is recorded in the semantic_cache_hits table with the question it matched,
+        so the quality of reused answers can be audited.
+
+        Args:
+            transcript_id (int): The id of the transcript the question is about.
+            question (str): The question.
+            question_vector (array-like): The embedding of the question.
+            model_params (dict): The model name and generation settings.
+
+        Returns:
+            str or None: The cached answer, or None if no cached question is similar enough.
+        """
+        if not self.similarity_threshold:
+            return None
+        now = dt.datetime.utcnow()
+        entries = CachedAnswer.query.filter(
+            CachedAnswer.transcript_id == transcript_id,
+            CachedAnswer.model_params == json.dumps(model_params, sort_keys=True),
+            CachedAnswer.question_embedding.isnot(None),
+            CachedAnswer.created_at >= now - dt.timedelta(seconds=self.ttl),
+        ).all()
+        if self.min_term_overlap:
+            entries = [
+                entry
+                for entry in entries
+                if term_overlap(question, entry.question) >= self.min_term_overlap
+            ]
+        if entries:
+            indices, scores = top_k_similar(
+                question_vector, np.vstack([e.question_vector for e in entries])
+            )
+            entry, similarity = entries[indices[0][0]], float(scores[0][0])
+            if similarity >= self.similarity_threshold:
+                entry.update(
+                    commit=False, last_used_at=now, hit_count=entry.hit_count + 1
+                )
+                SemanticCacheHit.create(
+                    transcript_id=transcript_id,
+                    question=question,
+                    cached_answer_id=entry.id,
+                    matched_question=entry.question,
+                    similarity=similarity,
+                )
+                StatCounter.increment(f"{self.name}.semantic_hits")
+                return entry.answer
+        StatCounter.increment(f"{self.name}.semantic_misses")
+        return None
+
+    def set(
+        self,
+        transcript_id,
+        question,
+        context,
+        model_params,
+        answer,
+        question_vector=None,
+    ):
+        """Store an answer, then evict expired and least recently used entries."""
+        key, context_hash = self.make_key(
+            transcript_id, question, context, model_params
+        )
+        entry = CachedAnswer.query.filter_by(key=key).first() or CachedAnswer(
+            key=key, transcript_id=transcript_id
+        )
+        now = dt.datetime.utcnow()
+        entry.update(
+            question=question,
+            context_hash=context_hash,
+            model_params=json.dumps(model_params, sort_keys=True),
+            answer=answer,
+            question_vector=question_vector,
+            created_at=now,
+            last_used_at=now,
+        )
+        self.evict()
+
+    def evict(self):
+        """Delete expired entries and the least recently used ones above the size cap."""
+        expired_before = dt.datetime.utcnow() - dt.timedelta(seconds=self.ttl)
+        evicted = CachedAnswer.query.filter(
+            CachedAnswer.created_at < expired_before
+        ).delete(synchronize_session=False)
+        excess = CachedAnswer.query.count() - self.max_entries
+        if excess > 0:
+            oldest = (
+                db.session.query(CachedAnswer.id)
+                .order_by(CachedAnswer.last_used_at)
+                .limit(excess)
+                .subquery()
+            )
+            evicted += CachedAnswer.query.filter(
+                CachedAnswer.id.in_(db.session.query(oldest.c.id))
+            ).delete(synchronize_session=False)
+        db.session.commit()
+        if evicted:
+            StatCounter.increment(f"{self.name}.evictions", evicted)
+
+    def stats(self):
+        """
+        Return the cache's size and its hit, miss and eviction counts.
+
+        Returns:
+            dict: The statistics of the cache.
+        """
+        counters = StatCounter.values(f"{self.name}.")
+        stats = {
+            kind: counters.get(f"{self.name}.{kind}", 0)
+            for kind in (
+                "hits",
+                "misses",
+                "semantic_hits",
+                "semantic_misses",
+                "evictions",
+            )
+        }
+        stats["size"] = CachedAnswer.query.count()
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        semantic_lookups = stats["semantic_hits"] + stats["semantic_misses"]
+        stats["semantic_hit_rate"] = (
+            stats["semantic_hits"] / semantic_lookups if semantic_lookups else 0.0
+        )
+        return stats
+
+
+def get_answer_cache():
+    """
+    Return an AnswerCache configured from the app settings.
+
+    Returns:
+        AnswerCache: The answer cache.
+    """
+    return AnswerCache(
+        max_entries=current_app.config["ANSWER_CACHE_MAX_ENTRIES"],
+        ttl=current_app.config["ANSWER_CACHE_TTL"],
+        similarity_threshold=current_app.config["SEMANTIC_CACHE_THRESHOLD"],
+        min_term_overlap=current_app.config["SEMANTIC_CACHE_MIN_TERM_OVERLAP"],
+    )
@@ -0,0 +1,164 @@
+"""Disk cache of downloaded audio, shared by every worker process on the host."""
+import glob
+import hashlib
+import os
+import shutil
+import time
+
+from flask import current_app
+
+from riddle_me_this.locks import single_flight
+from riddle_me_this.user.models import StatCounter
+
+
+class AudioCache:
+    """
+    A byte-bounded LRU cache of audio files keyed by video and download format.
+
+    Each file is stored under the hash of its key with its original extension, and its
+    modification time records when it was last used. Files used within the last
+    `grace_seconds` are never evicted, so a file isn't deleted while it is being read.
+
+    Attributes:
+        directory (str): The directory holding the cached files.
+        max_bytes (int): The total size kept before the least recently used files are evicted.
+        grace_seconds (int): How long a file is protected from eviction after its last use.
+        name (str): The prefix of the cache's hit and miss counters.
+    """
+
+    def __init__(self, directory, max_bytes, grace_seconds=600, name="audio_cache"):
+        """
+        Initialize an AudioCache.
+
+        Args:
+            directory (str): The directory holding the cached files.
+            max_bytes (int): The maximum total size of the files.
+            grace_seconds (int, optional): The eviction grace period. Defaults to 600.
+            name (str, optional): The prefix of the counters. Defaults to "audio_cache".
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.grace_seconds = grace_seconds
+        self.name = name
+
+    @staticmethod
+    def make_key(video_id, audio_format):
+        """
+        Build the cache key of a video's audio in a format.
+
+        Args:
+            video_id (str): The ID of the YouTube video.
+            audio_format (str): The yt-dlp format selector the audio was downloaded with.
+
+        Returns:
+            str: The hex SHA-256 digest of the video ID and format.
+        """
+        return hashlib.sha256(f"{video_id}\n{audio_format}".encode("utf-8")).hexdigest()
+
+    def _files(self):
+        """Return the path, size and last use of every cached file."""
+        files = []
+        for path in glob.glob(os.path.join(self.directory, "*", "*")):
+            if path.endswith(".tmp"):
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((path, stat.st_size, stat.st_mtime))
+        return files
+
+    def get(self, video_id, audio_format):
+        """
+        Look up a cached audio file, marking it as recently used.
+
+        Returns:
+            str or None: The path of the cached file, or None on a miss.
+        """
+        key = self.make_key(video_id, audio_format)
+        for path in glob.glob(os.path.join(self.directory, key[:2], f"{key}.*")):
+            if path.endswith(".tmp"):
+                continue
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                continue
+            StatCounter.increment(f"{self.name}.hits")
+            return path
+        StatCounter.increment(f"{self.name}.misses")
+        return None
+
+    def put(self, video_id, audio_format, source):
+        """
+        Move a downloaded audio file into the cache, then evict files over the byte budget.
+
+        Args:
+            video_id (str): The ID of the YouTube video.
+            audio_format (str): The yt-dlp format selector the audio was downloaded with.
+            source (str): The downloaded file. It is moved, not copied.
+
+        Returns:
+            str: The path of the cached file.
+        """
+        key = self.make_key(video_id, audio_format)
+        extension = os.path.splitext(source)[1]
+        os.makedirs(os.path.join(self.directory, key[:2]), exist_ok=True)
+        path = os.path.join(self.directory, key[:2], f"{key}{extension}")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        shutil.move(source, tmp_path)
+        os.replace(tmp_path, path)
+        self.evict()
+        return path
+
+    def evict(self):
+        """Delete the least recently used files until the cache fits its byte budget."""
+        with single_flight(f"{self.name}:evict"):
+            files = sorted(self._files(), key=lambda file: file[2])
+            excess = sum(size for _, size, _ in files) - self.max_bytes
+            protected_after = time.time() - self.grace_seconds
+            evicted = 0
+            for path, size, last_used in files:
+                if excess <= 0 or last_used > protected_after:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                excess -= size
+                evicted += 1
+        if evicted:
+            StatCounter.increment(f"{self.name}.evictions", evicted)
+
+    def stats(self):
+        """
+        Return the cache's size and its hit, miss and eviction counts.
+
+        Returns:
+            dict: The statistics of the cache.
+        """
+        counters = StatCounter.values(f"{self.name}.")
+        stats = {
+            kind: counters.get(f"{self.name}.{kind}", 0)
+            for kind in ("hits", "misses", "evictions")
+        }
+        files = self._files()
+        stats["files"] = len(files)
+        stats["bytes"] = sum(size for _, size, _ in files)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+def get_audio_cache():
+    """
+    Return an AudioCache configured from the app settings.
+
+    Returns:
+        AudioCache or None: The audio cache, or None if AUDIO_CACHE_MAX_BYTES is 0.
+    """
+    if not current_app.config["AUDIO_CACHE_MAX_BYTES"]:
+        return None
+    return AudioCache(
+        current_app.config["AUDIO_CACHE_DIR"],
+        current_app.config["AUDIO_CACHE_MAX_BYTES"],
+    )
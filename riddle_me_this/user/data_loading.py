@@ -1,15 +1,85 @@
 """Loads the data from services.py and stores it in the database."""
 
 import json
+import logging
 import re
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 import pandas as pd
+import tiktoken
 import torch
 from langchain.llms import OpenAI
 
-from riddle_me_this.user.models import Transcript, Video
+from riddle_me_this.database import db
+from riddle_me_this.locks import single_flight
+from riddle_me_this.registry import model_registry
+from riddle_me_this.user.answer_cache import get_answer_cache
+from riddle_me_this.user.lexical_index import bm25_scores, index_chunks
+from riddle_me_this.user.models import ChunkPosting, Transcript, TranscriptChunk, Video
+from riddle_me_this.user.vector_index import (
+    add_chunks_to_index,
+    normalize_rows,
+    remove_chunks_from_index,
+)
 from riddle_me_this.user.visualizations import *  # noqa: F401, F403
 
+TextChunk = namedtuple("TextChunk", ["text", "start_char", "end_char"])
+
+PROMPT_TEMPLATE = "Context: {context}. Answer the following question with this context. If the question cannot be answered with the context given, please say this. Politely refuse to answer a question if the context doesn't answer this at least partially. Question: {phrase}?"  # noqa
+
+
+def iter_chunks(text, chunks_size=2000, overlap=0):
+    """
+    Lazily splits the input text into chunks of at most `chunks_size` words.
+
+    The text is tokenized in a single pass, keeping only the current window of words,
+    so the cost is linear in the length of the text.
+
+    Parameters:
+    -----------
+    text : str
+        The text to be split.
+    chunks_size : int, optional
+        The maximum number of words in each chunk. Default is 2000.
+    overlap : int, optional
+        The number of words each chunk shares with the previous one. Default is 0.
+
+    Yields:
+    -------
+    chunk : TextChunk
+        The words of the chunk joined by single spaces, and the character offsets
+        of the chunk in `text`, so that ``text[chunk.start_char:chunk.end_char]``
+        is the original span.
+    Raises:
+    -------
+    ValueError : If `overlap` is not smaller than `chunks_size`.
+    """
+    if not 0 <= overlap < chunks_size:
+        raise ValueError("overlap must be at least 0 and smaller than chunks_size.")
+
+    window = deque()
+    new_words = 0
+    for word in re.finditer(r"\S+", text):
+        window.append(word)
+        new_words += 1
+        if len(window) == chunks_size:
+            yield _text_chunk(window)
+            for _ in range(chunks_size - overlap):
+                window.popleft()
+            new_words = 0
+    # Skip the tail if it only holds words the last chunk already overlapped
+    if new_words:
+        yield _text_chunk(window)
+
+
+def _text_chunk(words):
+    """Make a TextChunk from a sequence of regex matches of consecutive words."""
+    return TextChunk(
+        " ".join(word.group() for word in words), words[0].start(), words[-1].end()
+    )
+
 
 def split_text(text, chunks_size=2000):
     """
@@ -27,12 +97,70 @@ def split_text(text, chunks_size=2000):
     texts : list of str
         The list of smaller text chunks.
     """
-    texts = []
-    while len(text.split()) > chunks_size:
-        texts.append(" ".join(text.split()[:chunks_size]))
-        text = " ".join(text.split()[chunks_size:])
-    texts.append(text) if text else None  # noqa
-    return texts
+    return [chunk.text for chunk in iter_chunks(text, chunks_size)]
+
+
+def _load_silero_te():
+    """Load the silero_te punctuation model and return its apply_te function."""
+    torch.backends.quantized.engine = "qnnpack"
+    model, example_texts, languages, punct, apply_te = torch.hub.load(
+        repo_or_dir="snakers4/silero-models", model="silero_te", trust_repo=True
+    )
+    return apply_te
+
+
+def _clean_punctuated(text):
+    """Removes the unknown-token markers silero_te leaves in its output."""
+    return text.replace("[UNK]", "").replace("NK]", "")
+
+
+def _punctuate_window(apply_te, window):
+    """Punctuates one window of text without tracking gradients."""
+    with torch.no_grad():
+        return _clean_punctuated(apply_te(window, lan="en")).strip()
+
+
+def add_punctuation_batch(texts, window_words=150, max_workers=4):
+    """
+    Adds punctuation to several strings using the silero_te model.
+
+    Each text is split into windows of at most `window_words` words, the size the model works
+    best on, so memory use doesn't grow with the length of a transcript. The windows of every
+    text are punctuated together on a thread pool sharing the resident model, and then joined
+    back in order. A window that continues a sentence doesn't keep the capital letter the model
+    puts at its start.
+
+    Parameters:
+    -----------
+    texts : list of str
+        The texts to which punctuation needs to be added.
+    window_words : int, optional
+        The maximum number of words per model call. Default is 150.
+    max_workers : int, optional
+        The number of windows punctuated at the same time. Default is 4.
+
+    Returns:
+    --------
+    texts_with_punctuation : list of str
+        The input texts with added punctuation, in the same order.
+    """
+    apply_te = model_registry.get("silero_te", _load_silero_te)
+    windows = [
+        (i, chunk.text)
+        for i, text in enumerate(texts)
+        for chunk in iter_chunks(text, window_words)
+    ]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        punctuated = list(
+            executor.map(lambda window: _punctuate_window(apply_te, window[1]), windows)
+        )
+
+    pieces = [[] for _ in texts]
+    for (i, _), window in zip(windows, punctuated):
+        if pieces[i] and window and not pieces[i][-1].endswith((".", "?", "!")):
+            window = window[0].lower() + window[1:]
+        pieces[i].append(window)
+    return [" ".join(piece for piece in text_pieces if piece) for text_pieces in pieces]
 
 
 def add_punctuation(text):
@@ -49,78 +177,507 @@ def add_punctuation(text):
     text_with_punctuation : str
         The input text with added punctuation.
     """
-    torch.backends.quantized.engine = "qnnpack"
-    model, example_texts, languages, punct, apply_te = torch.hub.load(
-        repo_or_dir="snakers4/silero-models", model="silero_te", trust_repo=True
-    )
-    return apply_te(text, lan="en").replace("[UNK]", "").replace("NK]", "")
+    return add_punctuation_batch([text])[0]
+
+
+def embed_texts(texts, model="en_core_web_md"):
+    """
+    Embeds each text as the average of spaCy's word vectors.
+
+    Only the tokenizer is run, since the other pipeline components don't change the vectors.
+
+    Args:
+    texts -- list -- a list of strings to embed.
+    model -- str -- the spaCy model with word vectors to use. Default is "en_core_web_md".
+
+    Returns:
+    numpy.ndarray -- a float32 matrix with one row per text.
+    """
+    nlp = get_en_core_web_(model=model)  # noqa
+    vectors = [doc.vector for doc in nlp.pipe(texts, disable=nlp.pipe_names)]
+    if not vectors:
+        return np.zeros((0, nlp.vocab.vectors_length), dtype=np.float32)
+    return np.vstack(vectors).astype(np.float32)
+
+
+def chunk_matrix(chunks):
+    """
+    Stacks the embeddings of stored chunks into a normalized matrix.
+
+    The chunks may come from any number of transcripts; row i of the matrix belongs to chunks[i].
+
+    Args:
+    chunks -- list -- a list of TranscriptChunk objects.
+
+    Returns:
+    numpy.ndarray -- a float32 matrix with one unit-length row per chunk.
+    """
+    return normalize_rows(np.vstack([chunk.vector for chunk in chunks]))
 
 
 def get_cosine_similarity(phrase, chunks):
     """
     Calculates the cosine similarity between a phrase and each chunk of text in a list of chunks.
 
-    This function uses spaCy's medium-sized English model with word embeddings to create
-    spaCy documents for each phrase and chunk,
-    and then calculates the cosine similarity between them.
+    This function uses spaCy's medium-sized English model with word embeddings to embed
+    the phrase and, unless they are already embedded, the chunks,
+    and then calculates the cosine similarity between them with one matrix-vector product.
 
     Args:
     phrase -- str -- the phrase to compare to each chunk.
-    chunks -- list -- a list of strings representing the chunks of text to compare to the phrase.
+    chunks -- list or numpy.ndarray -- a list of strings representing the chunks of text to compare
+    to the phrase, or a matrix of their precomputed embeddings.
 
     Returns:
     list -- a list of floats representing the cosine similarity between the phrase and each chunk.
     """
-    # Load the medium-sized English model with word embeddings
-    nlp = download_en_core_web_(model="en_core_web_md")  # noqa
+    phrase_vector = normalize_rows(embed_texts([phrase]))[0]
+    chunk_vectors = chunks if isinstance(chunks, np.ndarray) else embed_texts(chunks)
+    return (normalize_rows(chunk_vectors) @ phrase_vector).tolist()
+
+
+def get_transcript_chunks(transcript):
+    """
+    Returns the stored chunks of a transcript, computing and storing them on first use.
+
+    Chunks stored before chunks had character offsets are replaced once, and removed
+    from the chunk index.
+
+    Args:
+    transcript -- Transcript -- the transcript to get the chunks of.
+
+    Returns:
+    list -- the TranscriptChunk objects of the transcript, in transcript order.
+    """
+    chunks = _stored_chunks(transcript)
+    if chunks and chunks[0].start_char is not None:
+        return chunks
+    with single_flight(f"chunks:{transcript.id}"):
+        # Another worker may have chunked the transcript while this one waited
+        chunks = _stored_chunks(transcript)
+        if chunks and chunks[0].start_char is None:
+            chunk_ids = [chunk.id for chunk in chunks]
+            ChunkPosting.query.filter(ChunkPosting.chunk_id.in_(chunk_ids)).delete(
+                synchronize_session=False
+            )
+            for chunk in chunks:
+                db.session.delete(chunk)
+            db.session.commit()
+            try:
+                remove_chunks_from_index(chunk_ids)
+            except Exception as e:  # noqa
+                logging.error(e)
+            chunks = []
+        return chunks or load_transcript_chunks(transcript)
+
+
+def _stored_chunks(transcript):
+    """Query the stored chunks of a transcript, in transcript order."""
+    return (
+        TranscriptChunk.query.filter_by(transcript_id=transcript.id)
+        .order_by(TranscriptChunk.chunk_index)
+        .all()
+    )
+
+
+def _index_transcript_chunks(transcript):
+    """Add the chunks of a transcript stored before the inverted index to it, once."""
+    with single_flight(f"chunks:{transcript.id}"):
+        # Another worker may have indexed the chunks while this one waited
+        unindexed = (
+            TranscriptChunk.query.filter_by(transcript_id=transcript.id, n_terms=None)
+            .populate_existing()
+            .all()
+        )
+        if unindexed:
+            index_chunks(unindexed)
+
+
+def _min_max_scale(scores):
+    """Scale scores to [0, 1], mapping constant scores to 0."""
+    scores = np.asarray(scores, dtype=np.float32)
+    span = scores.max() - scores.min() if len(scores) else 0
+    return (scores - scores.min()) / span if span > 0 else np.zeros_like(scores)
+
+
+def rank_chunks_batch(transcript, phrases, alpha=0.5, phrase_vectors=None, top_k=None):
+    """
+    Ranks the chunks of a transcript by a mix of vector and BM25 similarity to each of several phrases.
 
-    # Create a spaCy document for the phrase
-    phrase_doc = nlp(phrase)
+    The chunks are loaded and stacked into a matrix once, and every phrase is scored against it with
+    a single matrix product. Both scores are min-max scaled over the transcript's chunks before
+    mixing, so `alpha` weighs the two rankings rather than their raw magnitudes.
 
-    # Calculate the cosine similarity between the phrase and each chunk
-    similarities = []
+    Args:
+    transcript -- Transcript -- the transcript whose chunks to rank.
+    phrases -- list -- the questions or prompts to rank the chunks against.
+    alpha -- float -- the weight of the vector score, between 0 and 1; the BM25 score gets
+    the rest. Default is 0.5.
+    phrase_vectors -- numpy.ndarray -- the embeddings of the phrases, one per row, if already computed.
+    top_k -- int -- the number of best chunks to return per phrase, selected with argpartition so
+    only they are sorted. Default is every chunk.
+
+    Returns:
+    list -- for each phrase, a tuple of the TranscriptChunk objects and their mixed scores,
+    from most to least relevant.
+    """
+    text_chunks = get_transcript_chunks(transcript)
+    if any(chunk.n_terms is None for chunk in text_chunks):
+        _index_transcript_chunks(transcript)
+
+    if phrase_vectors is None:
+        phrase_vectors = embed_texts(phrases)
+    vector_scores = chunk_matrix(text_chunks) @ normalize_rows(phrase_vectors).T
+    chunk_ids = [chunk.id for chunk in text_chunks]
+
+    rankings = []
+    for i, phrase in enumerate(phrases):
+        lexical = bm25_scores(phrase, chunk_ids)
+        lexical_scores = [lexical.get(chunk_id, 0.0) for chunk_id in chunk_ids]
+        scores = alpha * _min_max_scale(vector_scores[:, i]) + (
+            1 - alpha
+        ) * _min_max_scale(lexical_scores)
+        order = _top_k_order(scores, top_k)
+        rankings.append(([text_chunks[j] for j in order], scores[order].tolist()))
+    return rankings
+
+
+def _top_k_order(scores, top_k=None):
+    """Return the indices of the top_k highest scores, highest first, ties in index order."""
+    if top_k is None or top_k >= len(scores):
+        return np.argsort(-scores, kind="stable")
+    candidates = np.sort(np.argpartition(-scores, top_k - 1)[:top_k])
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def rank_chunks(transcript, phrase, alpha=0.5, phrase_vector=None, top_k=None):
+    """
+    Ranks the chunks of a transcript by a mix of vector and BM25 similarity to a phrase.
+
+    See rank_chunks_batch.
+
+    Args:
+    transcript -- Transcript -- the transcript whose chunks to rank.
+    phrase -- str -- the question or prompt to rank the chunks against.
+    alpha -- float -- the weight of the vector score, between 0 and 1; the BM25 score gets
+    the rest. Default is 0.5.
+    phrase_vector -- numpy.ndarray -- the embedding of the phrase, if already computed.
+    top_k -- int -- the number of best chunks to return. Default is every chunk.
+
+    Returns:
+    tuple -- the TranscriptChunk objects and their mixed scores, from most to least relevant.
+    """
+    phrase_vectors = None if phrase_vector is None else np.atleast_2d(phrase_vector)
+    return rank_chunks_batch(transcript, [phrase], alpha, phrase_vectors, top_k)[0]
+
+
+def get_token_encoding(model_name):
+    """
+    Returns the process-wide tiktoken encoding of an OpenAI model.
+
+    Args:
+    model_name -- str -- the name of the model, e.g. "text-davinci-003".
+
+    Returns:
+    tiktoken.Encoding -- the encoding, falling back to cl100k_base for unknown models.
+    """
+
+    def load():
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+
+    return model_registry.get(f"tiktoken:{model_name}", load)
+
+
+def _uncovered(span, spans):
+    """Returns the parts of a (start, end) span that none of the given spans cover."""
+    parts = [span]
+    for start, end in spans:
+        parts = [
+            part
+            for part_start, part_end in parts
+            for part in (
+                (part_start, min(part_end, start)),
+                (max(part_start, end), part_end),
+            )
+            if part[0] < part[1]
+        ]
+    return parts
+
+
+def pack_context(transcript, chunks, token_budget, encoding, separator="\n...\n"):
+    """
+    Packs the most relevant chunks of a transcript into a context of at most `token_budget` tokens.
+
+    Chunks are taken in the given order, most relevant first. Text that an already packed chunk
+    covers is only counted once, and chunks that no longer fit are skipped in favour of later,
+    shorter ones. If not even the first chunk fits, it is truncated to the budget.
+    The packed passages are returned in transcript order.
+
+    Args:
+    transcript -- Transcript -- the transcript the chunks belong to.
+    chunks -- list -- the TranscriptChunk objects to pack, most relevant first.
+    token_budget -- int -- the maximum number of tokens in the context.
+    encoding -- tiktoken.Encoding -- the tokenizer of the model the context is for.
+    separator -- str -- the text put between passages that aren't adjacent. Default is an
+    ellipsis on a line of its own.
+
+    Returns:
+    str -- the packed context.
+    """
+    text = transcript.text or ""
+    separator_tokens = len(encoding.encode(separator))
+    spans = []
+    used = 0
     for chunk in chunks:
-        chunk_doc = nlp(chunk)
-        similarity = phrase_doc.similarity(chunk_doc)
-        similarities.append(similarity)
+        span = (chunk.start_char, chunk.end_char)
+        new_parts = _uncovered(span, spans)
+        cost = sum(
+            len(encoding.encode(text[start:end])) + separator_tokens
+            for start, end in new_parts
+        )
+        if used + cost <= token_budget:
+            spans.extend(new_parts)
+            used += cost
+        elif not spans:
+            start, end = span
+            return encoding.decode(encoding.encode(text[start:end])[:token_budget])
+
+    passages = []
+    for start, end in sorted(spans):
+        if passages and start <= passages[-1][1]:
+            passages[-1][1] = max(passages[-1][1], end)
+        else:
+            passages.append([start, end])
+    return separator.join(text[start:end].strip() for start, end in passages)
+
+
+def prepare_prompt(
+    transcript,
+    phrase,
+    top_k=8,
+    token_budget=None,
+    phrase_vector=None,
+    ranked_chunks=None,
+):
+    """
+    Builds the LLM prompt for a question about a transcript, unless the answer is already cached.
 
-    return similarities
+    This function ranks the stored chunks of the transcript by a mix of embedding and BM25 similarity to
+    the phrase using the
+    rank_chunks function, and then packs as many of the best chunks as fit into the model's context
+    with the pack_context function. Answers are cached per transcript, question, context and model
+    settings, and a question whose embedding is close enough to a cached question's reuses its answer
+    before any retrieval is done.
 
+    Args:
+    transcript -- Transcript -- the transcript to use as the basis for the response.
+    phrase -- str -- the question or prompt to generate a response to.
+    top_k -- int -- the number of best chunks to consider for the context. Default is 8.
+    token_budget -- int -- the maximum number of prompt tokens. Default is the model's context size
+    minus the tokens reserved for the answer.
+    phrase_vector -- numpy.ndarray -- the embedding of the phrase, if already computed.
+    ranked_chunks -- list -- the chunks of the transcript ranked for the phrase, if already computed.
 
-def get_response(text, phrase):
+    Returns:
+    tuple -- the cached answer or None, the language model, the prompt, and the keyword arguments
+    for AnswerCache.set() apart from the answer. Only the cached answer is set on a cache hit.
+    """
+    llm = OpenAI(temperature=0.9)
+    model_params = {
+        "model_name": llm.model_name,
+        "temperature": llm.temperature,
+        "max_tokens": llm.max_tokens,
+    }
+    answer_cache = get_answer_cache()
+    if phrase_vector is None:
+        phrase_vector = embed_texts([phrase])[0]
+    if cached := answer_cache.get_similar(
+        transcript.id, phrase, phrase_vector, model_params
+    ):
+        return cached, None, None, None
+
+    if ranked_chunks is None:
+        ranked_chunks, _ = rank_chunks(
+            transcript, phrase, phrase_vector=phrase_vector, top_k=top_k
+        )
+    encoding = get_token_encoding(llm.model_name)
+    if token_budget is None:
+        token_budget = llm.modelname_to_contextsize(llm.model_name) - llm.max_tokens
+    context_budget = token_budget - len(
+        encoding.encode(PROMPT_TEMPLATE.format(context="", phrase=phrase))
+    )
+    context = pack_context(transcript, ranked_chunks[:top_k], context_budget, encoding)
+    if cached := answer_cache.get(transcript.id, phrase, context, model_params):
+        return cached, None, None, None
+
+    prompt = PROMPT_TEMPLATE.format(context=context, phrase=phrase)
+    cache_entry = {
+        "transcript_id": transcript.id,
+        "question": phrase,
+        "context": context,
+        "model_params": model_params,
+        "question_vector": phrase_vector,
+    }
+    return None, llm, prompt, cache_entry
+
+
+def get_response(transcript, phrase, top_k=8, token_budget=None):
     """
-    Generates a response to a given phrase based on a given text using OpenAI's GPT-3 language model.
+    Generates a response to a given phrase based on a given transcript using OpenAI's GPT-3 language model.
 
-    This function splits the text into chunks, calculates the cosine similarity between the phrase
-    and each chunk using the
-    get_cosine_similarity function, and then uses the chunk with the highest similarity score as the context for
-    the GPT-3 prompt. The function then generates a response to the given phrase using the context and the GPT-3
-    language model.
+    The prompt is built with the prepare_prompt function, and the response is cached for later questions.
 
     Args:
-    text -- str -- the text to use as the basis for the response.
+    transcript -- Transcript -- the transcript to use as the basis for the response.
     phrase -- str -- the question or prompt to generate a response to.
+    top_k -- int -- the number of best chunks to consider for the context. Default is 8.
+    token_budget -- int -- the maximum number of prompt tokens. Default is the model's context size
+    minus the tokens reserved for the answer.
 
     Returns:
     str -- a string representing the generated response to the given phrase.
     """
-    text_chunks = split_text(text)
-    cosine_similarities = get_cosine_similarity(phrase, text_chunks)
-
-    highest_similarity_index = sorted(
-        range(len(cosine_similarities)),
-        key=lambda i: cosine_similarities[i],
-        reverse=True,
-    )[0]
+    cached, llm, prompt, cache_entry = prepare_prompt(
+        transcript, phrase, top_k, token_budget
+    )
+    if cached is not None:
+        return cached
 
-    llm = OpenAI(temperature=0.9)
-    context = text_chunks[highest_similarity_index]
-    prompt = f"Context: {context}. Answer the following question with this context. If the question cannot be answered with the context given, please say this. Politely refuse to answer a question if the context doesn't answer this at least partially. Question: {phrase}?"  # noqa
     response = llm(prompt)
+    get_answer_cache().set(answer=response, **cache_entry)
 
     return response
 
 
+def get_responses(transcript, phrases, top_k=8, token_budget=None, max_concurrency=4):
+    """
+    Generates responses to several phrases about the same transcript.
+
+    All phrases are embedded in one pass and ranked against the transcript's chunk matrix together
+    with the rank_chunks_batch function. Answers that aren't cached are then requested from the
+    language model concurrently, at most `max_concurrency` at a time.
+
+    Args:
+    transcript -- Transcript -- the transcript to use as the basis for the responses.
+    phrases -- list -- the questions or prompts to generate responses to.
+    top_k -- int -- the number of best chunks to consider for each context. Default is 8.
+    token_budget -- int -- the maximum number of prompt tokens. Default is the model's context size
+    minus the tokens reserved for the answer.
+    max_concurrency -- int -- the maximum number of simultaneous language model calls. Default is 4.
+
+    Returns:
+    list -- the response to each phrase, in the order of the phrases, or None where the language
+    model call failed.
+    """
+    if not phrases:
+        return []
+    phrase_vectors = embed_texts(phrases)
+    rankings = rank_chunks_batch(
+        transcript, phrases, phrase_vectors=phrase_vectors, top_k=top_k
+    )
+
+    responses = [None] * len(phrases)
+    pending = []
+    for i, (phrase, phrase_vector, (ranked_chunks, _)) in enumerate(
+        zip(phrases, phrase_vectors, rankings)
+    ):
+        cached, llm, prompt, cache_entry = prepare_prompt(
+            transcript, phrase, top_k, token_budget, phrase_vector, ranked_chunks
+        )
+        if cached is not None:
+            responses[i] = cached
+        else:
+            pending.append((i, llm, prompt, cache_entry))
+    if not pending:
+        return responses
+
+    answer_cache = get_answer_cache()
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+        futures = [executor.submit(llm, prompt) for _, llm, prompt, _ in pending]
+        for (i, _, _, cache_entry), future in zip(pending, futures):
+            try:
+                responses[i] = future.result()
+            except Exception as e:  # noqa
+                logging.error(e)
+                continue
+            answer_cache.set(answer=responses[i], **cache_entry)
+    return responses
+
+
+def stream_response(transcript, phrase, top_k=8, token_budget=None):
+    """
+    Generates a response like get_response, yielding it piece by piece as the model produces it.
+
+    A cached answer is yielded whole. The complete streamed answer is cached once the model finishes.
+
+    Args:
+    transcript -- Transcript -- the transcript to use as the basis for the response.
+    phrase -- str -- the question or prompt to generate a response to.
+    top_k -- int -- the number of best chunks to consider for the context. Default is 8.
+    token_budget -- int -- the maximum number of prompt tokens. Default is the model's context size
+    minus the tokens reserved for the answer.
+
+    Yields:
+    str -- the next piece of the response.
+    """
+    cached, llm, prompt, cache_entry = prepare_prompt(
+        transcript, phrase, top_k, token_budget
+    )
+    if cached is not None:
+        yield cached
+        return
+
+    pieces = []
+    for piece in llm.stream(prompt):
+        pieces.append(piece)
+        yield piece
+    get_answer_cache().set(answer="".join(pieces), **cache_entry)
+
+
+def load_transcript_chunks(transcript, chunks_size=300, overlap=50):
+    """
+    Splits a transcript into chunks, embeds them and stores them in the database.
+
+    Parameters:
+    -----------
+    transcript : Transcript
+        The transcript to chunk.
+    chunks_size : int, optional
+        The maximum number of words in each chunk. Default is 300.
+    overlap : int, optional
+        The number of words each chunk shares with the previous one. Default is 50.
+
+    Returns:
+    --------
+    chunks : list of TranscriptChunk
+        The stored chunks, in transcript order.
+    """
+    text_chunks = list(iter_chunks(transcript.text or "", chunks_size, overlap))
+    vectors = embed_texts([text_chunk.text for text_chunk in text_chunks])
+    chunks = [
+        TranscriptChunk(
+            transcript_id=transcript.id,
+            chunk_index=index,
+            text=text_chunk.text,
+            start_char=text_chunk.start_char,
+            end_char=text_chunk.end_char,
+            vector=vector,
+        )
+        for index, (text_chunk, vector) in enumerate(zip(text_chunks, vectors))
+    ]
+    db.session.add_all(chunks)
+    db.session.commit()
+    index_chunks(chunks)
+    try:
+        add_chunks_to_index(chunks)
+    except Exception as e:  # noqa
+        logging.error(e)
+    return chunks
+
+
 def load_transcripts(video_id, transcripts):
     """
     Loads the transcripts of a video into the database.
@@ -140,10 +697,14 @@ def load_transcripts(video_id, transcripts):
     df["text"] = df["transcript"].apply(lambda x: " ".join([i["text"] for i in x]))
     df["video_id"] = video_id
     df = df[df["text"].str.strip() != ""]
-    df.loc[df["is_generated"], "text"] = df[df["is_generated"]].apply(
-        lambda row: add_punctuation(re.sub(r"[^a-zA-Z0-9\s]+", "X", row["text"])),
-        axis=1,
-    )
+    generated = df["is_generated"].astype(bool)
+    if generated.any():
+        df.loc[generated, "text"] = add_punctuation_batch(
+            [
+                re.sub(r"[^a-zA-Z0-9\s]+", "X", text)
+                for text in df.loc[generated, "text"]
+            ]
+        )
 
     for index, row in df.iterrows():
         video_id = row["video_id"]
@@ -152,19 +713,22 @@ def load_transcripts(video_id, transcripts):
         language_code = row["language_code"]
         is_generated = row["is_generated"]
 
-        Transcript.create(
+        transcript = Transcript.create(
             video_id=video_id,
             json_string=json.dumps(json_string),
             text=text,
             language_code=language_code,
             is_generated=is_generated,
         )
+        load_transcript_chunks(transcript)
 
 
 def load_video_info(data):
     """
     Loads the video information into the database.
 
+    All the videos of a videos().list response are inserted in one transaction.
+
     Parameters:
     -----------
     data : dict
@@ -172,30 +736,41 @@ def load_video_info(data):
 
     Returns:
     --------
-    None
+    videos : list of Video
+        The stored videos, in the order of the response's items.
     """
-    Video.create(
-        video_id=data["items"][0]["id"],
-        snippet_published_at=pd.to_datetime(data["items"][0]["snippet"]["publishedAt"]),
-        snippet_channel_id=data["items"][0]["snippet"]["channelId"],
-        snippet_title=data["items"][0]["snippet"]["title"],
-        snippet_description=data["items"][0]["snippet"]["description"],
-        snippet_channel_title=data["items"][0]["snippet"]["channelTitle"],
-        snippet_category_id=data["items"][0]["snippet"]["categoryId"],
-        snippet_thumbnails_maxres_url=data["items"][0]["snippet"]["thumbnails"][
-            "maxres"
-        ]["url"],
-        content_details_definition=data["items"][0]["contentDetails"]["definition"],
-        content_details_licensed_content=data["items"][0]["contentDetails"][
-            "licensedContent"
-        ],
-        status_upload_status=data["items"][0]["status"]["uploadStatus"],
-        status_privacy_status=data["items"][0]["status"]["privacyStatus"],
-        status_license=data["items"][0]["status"]["license"],
-        status_public_stats_viewable=data["items"][0]["status"]["publicStatsViewable"],
-        status_made_for_kids=data["items"][0]["status"]["madeForKids"],
-        statistics_view_count=data["items"][0]["statistics"]["viewCount"],
-        statistics_like_count=data["items"][0]["statistics"]["likeCount"],
-        statistics_favorite_count=data["items"][0]["statistics"]["favoriteCount"],
-        statistics_comment_count=data["items"][0]["statistics"]["commentCount"],
-    )
+    videos = []
+    for item in data["items"]:
+        snippet = item["snippet"]
+        statistics = item["statistics"]
+        videos.append(
+            Video(
+                video_id=item["id"],
+                snippet_published_at=pd.to_datetime(snippet["publishedAt"]),
+                snippet_channel_id=snippet["channelId"],
+                snippet_title=snippet["title"],
+                snippet_description=snippet["description"],
+                snippet_channel_title=snippet["channelTitle"],
+                snippet_category_id=snippet["categoryId"],
+                snippet_thumbnails_maxres_url=snippet["thumbnails"]
+                .get("maxres", {})
+                .get("url"),
+                content_details_definition=item["contentDetails"]["definition"],
+                content_details_licensed_content=item["contentDetails"][
+                    "licensedContent"
+                ],
+                status_upload_status=item["status"]["uploadStatus"],
+                status_privacy_status=item["status"]["privacyStatus"],
+                status_license=item["status"]["license"],
+                status_public_stats_viewable=item["status"]["publicStatsViewable"],
+                status_made_for_kids=item["status"]["madeForKids"],
+                # Channels can hide likes and disable comments
+                statistics_view_count=statistics.get("viewCount"),
+                statistics_like_count=statistics.get("likeCount"),
+                statistics_favorite_count=statistics.get("favoriteCount"),
+                statistics_comment_count=statistics.get("commentCount"),
+            )
+        )
+    db.session.add_all(videos)
+    db.session.commit()
+    return videos
@@ -0,0 +1,303 @@
+"""Bulk ingestion of YouTube videos, so their transcripts are ready before anyone asks about them."""
+import collections
+import logging
+import threading
+import time
+import urllib.parse
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from flask import current_app
+
+from riddle_me_this.locks import single_flight
+from riddle_me_this.user import services
+from riddle_me_this.user.data_loading import load_transcripts
+from riddle_me_this.user.jobs import enqueue_transcription
+from riddle_me_this.user.models import Transcript
+
+TRANSCRIBE_MODES = ("queue", "local", "remote", "none")
+SERVICES = ("youtube", "captions", "whisper")
+
+
+class RateLimiter:
+    """
+    Spaces out calls to a service so that they stay under a rate, across threads.
+
+    Attributes:
+        interval (float): The seconds between two calls, 0 for no limit.
+    """
+
+    def __init__(self, rate=None):
+        """
+        Initialize a RateLimiter.
+
+        Args:
+            rate (float, optional): The calls allowed per second. Defaults to no limit.
+        """
+        self.interval = 1 / rate if rate else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Block until the next call is allowed."""
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            at = max(self._next, now)
+            self._next = at + self.interval
+        time.sleep(at - now)
+
+
+def read_video_ids(lines):
+    """
+    Read video IDs or links, one per line, ignoring blank lines and # comments.
+
+    Args:
+        lines (iterable of str): The lines to read.
+
+    Yields:
+        str: The ID of each video.
+
+    Raises:
+        ValueError: If a line is neither a video ID nor a YouTube link.
+    """
+    for line in lines:
+        line = line.split("#")[0].strip()
+        if line:
+            yield line if services.YOUTUBE_VIDEO_ID.match(
+                line
+            ) else services.get_youtube_video_id(line)
+
+
+def playlist_id_from(value):
+    """
+    Return the ID of a playlist given as an ID or a link.
+
+    Args:
+        value (str): A playlist ID, or a link with a list parameter.
+
+    Returns:
+        str: The playlist ID.
+    """
+    query = urllib.parse.parse_qs(urllib.parse.urlparse(value).query)
+    return query.get("list", [value])[0]
+
+
+def playlist_video_ids(youtube, playlist_id, limiter):
+    """
+    List the videos of a playlist, 50 per API call.
+
+    Args:
+        youtube (googleapiclient.discovery.Resource): The YouTube client.
+        playlist_id (str): The ID of the playlist.
+        limiter (RateLimiter): The rate limit of the YouTube Data API.
+
+    Yields:
+        str: The ID of each video, in playlist order.
+    """
+    playlist_items = youtube.playlistItems()
+    request = playlist_items.list(
+        part="contentDetails",
+        playlistId=playlist_id,
+        maxResults=services.YOUTUBE_MAX_RESULTS,
+    )
+    while request is not None:
+        limiter.wait()
+        response = request.execute()
+        for item in response.get("items", []):
+            yield item["contentDetails"]["videoId"]
+        request = playlist_items.list_next(request, response)
+
+
+def channel_video_ids(youtube, channel_id, limiter):
+    """
+    List the videos uploaded by a channel.
+
+    Args:
+        youtube (googleapiclient.discovery.Resource): The YouTube client.
+        channel_id (str): The ID of the channel.
+        limiter (RateLimiter): The rate limit of the YouTube Data API.
+
+    Yields:
+        str: The ID of each video, newest first.
+
+    Raises:
+        ValueError: If there is no channel with this ID.
+    """
+    limiter.wait()
+    response = youtube.channels().list(part="contentDetails", id=channel_id).execute()
+    if not response.get("items"):
+        raise ValueError(f"Channel {channel_id} not found.")
+    uploads = response["items"][0]["contentDetails"]["relatedPlaylists"]["uploads"]
+    yield from playlist_video_ids(youtube, uploads, limiter)
+
+
+class Ingestion:
+    """
+    The ingestion of many videos, keeping count of the outcome of each.
+
+    Metadata is fetched 50 videos per call. As each batch arrives, its videos get their
+    captions or, without any, a Whisper transcript, which load_transcripts chunks, embeds
+    and indexes. All of it runs on a pool of `workers` threads, so the stages of different
+    videos overlap. Every stage skips what is stored, so an interrupted run resumes where
+    it stopped when it is started again.
+
+    Attributes:
+        language_code (str): The language of the transcripts.
+        transcribe (str): What to do for videos without captions, one of TRANSCRIBE_MODES.
+        workers (int): The number of videos processed at once.
+        limiters (dict): The RateLimiter of each of SERVICES.
+        report (callable or None): Called after each video.
+        outcomes (collections.Counter): The number of videos per outcome.
+    """
+
+    def __init__(
+        self, language_code="en", transcribe="queue", workers=4, rates=None, report=None
+    ):
+        """
+        Initialize an Ingestion.
+
+        Args:
+            language_code (str, optional): The language of the transcripts. Defaults to "en".
+            transcribe (str, optional): What to do for videos without captions: "queue" them
+            for the transcription workers, transcribe them here with the "local" or "remote"
+            Whisper, or "none". Defaults to "queue".
+            workers (int, optional): The number of videos processed at once. Defaults to 4.
+            rates (dict, optional): The calls per second allowed to the "youtube", "captions"
+            and "whisper" services. Services left out aren't limited.
+            report (callable, optional): Called with the number of videos done, their total,
+            the video ID and its outcome after each video.
+
+        Raises:
+            ValueError: If `transcribe` isn't one of TRANSCRIBE_MODES.
+        """
+        if transcribe not in TRANSCRIBE_MODES:
+            raise ValueError(
+                f"transcribe must be one of {', '.join(TRANSCRIBE_MODES)}."
+            )
+        self.language_code = language_code
+        self.transcribe = transcribe
+        self.workers = workers
+        self.limiters = {
+            service: RateLimiter((rates or {}).get(service)) for service in SERVICES
+        }
+        self.report = report
+        self.outcomes = collections.Counter()
+        self._total = 0
+
+    def fetch_metadata(self, batch):
+        """
+        Store the metadata of up to 50 videos.
+
+        Returns:
+            list of str: The IDs of the videos YouTube knows.
+        """
+        if len(services.stored_videos(batch)) < len(batch):
+            self.limiters["youtube"].wait()
+        return [video.video_id for video in services.get_videos_info(batch)]
+
+    def fetch_captions(self, video_id):
+        """
+        Store the captions of a video, unless some are already stored.
+
+        Returns:
+            Transcript or None: The transcript in the wanted language, if there is one now.
+        """
+        if not Transcript.query.filter_by(video_id=video_id).first():
+            self.limiters["captions"].wait()
+            try:
+                transcripts = services.get_transcripts(
+                    video_id, language_codes=(self.language_code,)
+                )
+            except Exception as e:  # noqa
+                logging.warning(f"No captions for {video_id}: {e}")
+                transcripts = []
+            if transcripts:
+                load_transcripts(video_id, transcripts)
+        return services.find_transcript(video_id, self.language_code)
+
+    def ingest_video(self, video_id):
+        """
+        Store a transcript of a video, from its captions or Whisper.
+
+        Returns:
+            str: The outcome for the video.
+        """
+        if services.find_transcript(video_id, self.language_code):
+            return "already loaded"
+        with single_flight(f"transcripts:{video_id}"):
+            if services.find_transcript(video_id, self.language_code):
+                return "already loaded"
+            if self.fetch_captions(video_id):
+                return "captions"
+            if self.transcribe == "none":
+                return "no captions"
+            if self.transcribe == "queue":
+                enqueue_transcription(video_id, self.language_code)
+                return "queued"
+        # transcribe_video holds the video's whisper lock
+        self.limiters["whisper"].wait()
+        services.transcribe_video(video_id, local=self.transcribe == "local")
+        return "transcribed"
+
+    def finish(self, video_id, outcome):
+        """Count the outcome of a video and report it."""
+        self.outcomes[outcome] += 1
+        if self.report:
+            self.report(sum(self.outcomes.values()), self._total, video_id, outcome)
+
+    def run(self, video_ids):
+        """
+        Ingest videos, skipping what is already stored.
+
+        Args:
+            video_ids (iterable of str): The IDs of the YouTube videos. Duplicates are ignored.
+
+        Returns:
+            dict: The number of videos per outcome, with the total "videos", the "seconds"
+            taken and the "videos_per_minute".
+        """
+        app = current_app._get_current_object()
+        video_ids = list(dict.fromkeys(video_ids))
+        self._total = len(video_ids)
+        started = time.monotonic()
+
+        def in_app_context(task, *args):
+            with app.app_context():
+                return task(*args)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = {
+                executor.submit(in_app_context, self.fetch_metadata, batch): batch
+                for batch in services.batched(video_ids, services.YOUTUBE_MAX_RESULTS)
+            }
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception:  # noqa
+                        logging.exception(f"Failed to ingest {task}")
+                        result = None
+                    if isinstance(task, str):
+                        self.finish(task, result or "failed")
+                        continue
+                    for video_id in task:
+                        if result is None:
+                            self.finish(video_id, "failed")
+                        elif video_id in result:
+                            future = executor.submit(
+                                in_app_context, self.ingest_video, video_id
+                            )
+                            pending[future] = video_id
+                        else:
+                            self.finish(video_id, "not found")
+
+        seconds = time.monotonic() - started
+        return {
+            **self.outcomes,
+            "videos": len(video_ids),
+            "seconds": seconds,
+            "videos_per_minute": len(video_ids) / seconds * 60 if seconds else 0.0,
+        }
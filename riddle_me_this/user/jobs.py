@@ -0,0 +1,312 @@
+"""Database-backed queue of transcription jobs, shared by the web and worker processes."""
+import datetime as dt
+import logging
+import os
+import socket
+import time
+
+from flask import current_app
+
+from riddle_me_this.database import db
+from riddle_me_this.user.models import TranscriptionJob
+
+
+class TranscriptionPending(Exception):
+    """Raised when a transcript is still being produced by a background job."""
+
+    def __init__(self, job):
+        """
+        Initialize a TranscriptionPending error.
+
+        Args:
+            job (TranscriptionJob): The job producing the transcript.
+        """
+        super().__init__(f"Transcription of {job.video_id} is {job.status}")
+        self.job = job
+
+
+class JobFailed(Exception):
+    """Raised by a job handler when running the job again can't succeed."""
+
+
+def enqueue_transcription(video_id, language_code="en", local=True):
+    """
+    Queue the transcription of a video, unless it is already queued or running.
+
+    A failed job is returned as it is, so that a page refresh doesn't retry it forever;
+    retry_failed_jobs queues it again.
+
+    Args:
+        video_id (str): The ID of the YouTube video.
+        language_code (str, optional): The language the transcript was asked for. Defaults to "en".
+        local (bool, optional): Whether to use the local Whisper model. Defaults to True.
+
+    Returns:
+        TranscriptionJob: The new or existing job.
+    """
+    job = (
+        TranscriptionJob.query.filter_by(video_id=video_id, language_code=language_code)
+        .order_by(TranscriptionJob.id.desc())
+        .first()
+    )
+    if job and job.status != TranscriptionJob.DONE:
+        return job
+    return TranscriptionJob.create(
+        video_id=video_id,
+        language_code=language_code,
+        local=local,
+        max_attempts=current_app.config["TRANSCRIPTION_MAX_ATTEMPTS"],
+    )
+
+
+def active_transcription(video_id, language_code="en"):
+    """
+    Find the queued or running transcription job of a video, if any.
+
+    Args:
+        video_id (str): The ID of the YouTube video.
+        language_code (str, optional): The language the transcript was asked for. Defaults to "en".
+
+    Returns:
+        TranscriptionJob or None: The latest job, if it is queued or running.
+    """
+    return (
+        TranscriptionJob.query.filter(
+            TranscriptionJob.video_id == video_id,
+            TranscriptionJob.language_code == language_code,
+            TranscriptionJob.status.in_(
+                [TranscriptionJob.QUEUED, TranscriptionJob.RUNNING]
+            ),
+        )
+        .order_by(TranscriptionJob.id.desc())
+        .first()
+    )
+
+
+def requeue_stale_jobs():
+    """
+    Requeue running jobs whose worker hasn't finished them within the job timeout.
+
+    Such jobs were most likely lost with a crashed worker. Jobs out of attempts fail instead.
+
+    Returns:
+        int: The number of jobs requeued or failed.
+    """
+    now = dt.datetime.utcnow()
+    timeout = dt.timedelta(seconds=current_app.config["TRANSCRIPTION_JOB_TIMEOUT"])
+    stale = TranscriptionJob.query.filter(
+        TranscriptionJob.status == TranscriptionJob.RUNNING,
+        TranscriptionJob.started_at < now - timeout,
+    )
+    count = stale.filter(
+        TranscriptionJob.attempts < TranscriptionJob.max_attempts
+    ).update(
+        {
+            TranscriptionJob.status: TranscriptionJob.QUEUED,
+            TranscriptionJob.worker: None,
+            TranscriptionJob.available_at: now,
+        },
+        synchronize_session=False,
+    )
+    count += stale.update(
+        {
+            TranscriptionJob.status: TranscriptionJob.FAILED,
+            TranscriptionJob.error: "Timed out",
+            TranscriptionJob.finished_at: now,
+        },
+        synchronize_session=False,
+    )
+    db.session.commit()
+    return count
+
+
+def retry_failed_jobs(video_id=None):
+    """
+    Queue failed jobs again, with all their attempts.
+
+    Args:
+        video_id (str, optional): Only retry the jobs of this video. Defaults to every failed job.
+
+    Returns:
+        int: The number of jobs queued again.
+    """
+    failed = TranscriptionJob.query.filter_by(status=TranscriptionJob.FAILED)
+    if video_id is not None:
+        failed = failed.filter_by(video_id=video_id)
+    count = failed.update(
+        {
+            TranscriptionJob.status: TranscriptionJob.QUEUED,
+            TranscriptionJob.attempts: 0,
+            TranscriptionJob.worker: None,
+            TranscriptionJob.available_at: dt.datetime.utcnow(),
+            TranscriptionJob.finished_at: None,
+        },
+        synchronize_session=False,
+    )
+    db.session.commit()
+    return count
+
+
+def claim_next_job(worker):
+    """
+    Claim the oldest job that is ready to run.
+
+    The claim is a conditional update of the job's status, so two workers never run
+    the same job, on any database and without row locks.
+
+    Args:
+        worker (str): The name of the claiming worker.
+
+    Returns:
+        TranscriptionJob or None: The claimed job, or None if no job is ready.
+    """
+    now = dt.datetime.utcnow()
+    candidates = (
+        db.session.query(TranscriptionJob.id)
+        .filter(
+            TranscriptionJob.status == TranscriptionJob.QUEUED,
+            TranscriptionJob.available_at <= now,
+        )
+        .order_by(TranscriptionJob.available_at, TranscriptionJob.id)
+        .limit(10)
+        .all()
+    )
+    for (job_id,) in candidates:
+        claimed = TranscriptionJob.query.filter_by(
+            id=job_id, status=TranscriptionJob.QUEUED
+        ).update(
+            {
+                TranscriptionJob.status: TranscriptionJob.RUNNING,
+                TranscriptionJob.worker: worker,
+                TranscriptionJob.started_at: now,
+                TranscriptionJob.attempts: TranscriptionJob.attempts + 1,
+            },
+            synchronize_session=False,
+        )
+        db.session.commit()
+        if claimed:
+            return TranscriptionJob.query.get(job_id)
+    return None
+
+
+def _finish_job(job, owner, **values):
+    """
+    Update a running job, unless it was requeued and perhaps claimed by another worker.
+
+    Args:
+        job (TranscriptionJob): The job.
+        owner (str): The name of the worker that claimed it.
+        **values: The columns to update.
+
+    Returns:
+        bool: Whether the worker still owned the job, and so updated it.
+    """
+    updated = TranscriptionJob.query.filter_by(
+        id=job.id, status=TranscriptionJob.RUNNING, worker=owner
+    ).update(values, synchronize_session=False)
+    db.session.commit()
+    if not updated:
+        logging.warning(f"Worker {owner} no longer owns transcription job {job.id}")
+    return bool(updated)
+
+
+def fail_job(job, error, retry=True, worker=None):
+    """
+    Record a failed attempt, retrying the job later with exponential backoff if it has attempts left.
+
+    Args:
+        job (TranscriptionJob): The job that failed.
+        error (str): A description of the error.
+        retry (bool, optional): Whether another attempt could succeed. Defaults to True.
+        worker (str, optional): The worker that ran the job. Defaults to the job's worker.
+    """
+    owner = worker or job.worker
+    now = dt.datetime.utcnow()
+    if retry and job.attempts < job.max_attempts:
+        delay = current_app.config["TRANSCRIPTION_RETRY_DELAY"] * 2 ** (
+            job.attempts - 1
+        )
+        _finish_job(
+            job,
+            owner,
+            status=TranscriptionJob.QUEUED,
+            error=error,
+            worker=None,
+            available_at=now + dt.timedelta(seconds=delay),
+        )
+    else:
+        _finish_job(
+            job, owner, status=TranscriptionJob.FAILED, error=error, finished_at=now
+        )
+
+
+def run_job(job, handler):
+    """
+    Run a claimed job and record its outcome.
+
+    The outcome is only recorded while the worker still owns the job: a job that
+    requeue_stale_jobs gave back to the queue belongs to whoever claims it next.
+
+    Args:
+        job (TranscriptionJob): The claimed job.
+        handler (callable): A function taking the job that produces and stores its transcript.
+        It raises JobFailed when retrying the job can't help.
+
+    Returns:
+        bool: Whether the job succeeded.
+    """
+    worker = job.worker
+    try:
+        handler(job)
+    except JobFailed as e:
+        logging.warning(f"Transcription job {job.id} failed: {e}")
+        db.session.rollback()
+        fail_job(job, str(e), retry=False, worker=worker)
+        return False
+    except Exception as e:  # noqa
+        logging.exception(f"Transcription job {job.id} failed")
+        db.session.rollback()
+        fail_job(job, repr(e), worker=worker)
+        return False
+    _finish_job(
+        job,
+        worker,
+        status=TranscriptionJob.DONE,
+        error=None,
+        finished_at=dt.datetime.utcnow(),
+    )
+    return True
+
+
+def run_worker(handler, poll_interval=5.0, burst=False, on_idle=None):
+    """
+    Run queued jobs one at a time until stopped.
+
+    Args:
+        handler (callable): A function taking a job that produces and stores its transcript.
+        poll_interval (float, optional): The seconds to wait when the queue is empty. Defaults to 5.
+        burst (bool, optional): Whether to return once the queue is empty. Defaults to False.
+        on_idle (callable, optional): Called without arguments whenever the queue is empty,
+        for background maintenance.
+
+    Returns:
+        int: The number of jobs run.
+    """
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    processed = 0
+    while True:
+        requeue_stale_jobs()
+        job = claim_next_job(worker)
+        if job is None:
+            if on_idle is not None:
+                try:
+                    on_idle()
+                except Exception:  # noqa
+                    logging.exception(f"Worker {worker} failed its idle work")
+            if burst:
+                return processed
+            time.sleep(poll_interval)
+            continue
+        logging.info(f"Worker {worker} running transcription job {job.id}")
+        run_job(job, handler)
+        processed += 1
@@ -0,0 +1,118 @@
+"""BM25 inverted index over the chunks of every stored transcript."""
+import math
+import re
+from collections import Counter
+
+from spacy.lang.en.stop_words import STOP_WORDS
+from sqlalchemy import func
+
+from riddle_me_this.database import db
+from riddle_me_this.extensions import cache
+from riddle_me_this.user.models import ChunkPosting, TranscriptChunk
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    """
+    Split text into lowercase index terms, dropping English stop words and single letters.
+
+    Args:
+        text (str): The text to tokenize.
+
+    Returns:
+        list: The terms of the text, in order.
+    """
+    return [
+        term
+        for term in TOKEN_PATTERN.findall(text.lower())
+        if term not in STOP_WORDS and 1 < len(term) <= 64
+    ]
+
+
+def index_chunks(chunks):
+    """
+    Add the postings of the given chunks to the inverted index.
+
+    Args:
+        chunks (list): Stored TranscriptChunk objects that have not been indexed yet.
+    """
+    postings = []
+    for chunk in chunks:
+        terms = tokenize(chunk.text)
+        chunk.n_terms = len(terms)
+        postings.extend(
+            {"term": term, "chunk_id": chunk.id, "term_frequency": frequency}
+            for term, frequency in Counter(terms).items()
+        )
+    db.session.bulk_insert_mappings(ChunkPosting, postings)
+    db.session.commit()
+    cache.delete_memoized(corpus_stats)
+
+
+@cache.memoize(timeout=300)
+def corpus_stats():
+    """
+    Return the number of indexed chunks and their average number of terms.
+
+    Returns:
+        tuple: The chunk count and the average chunk length in terms.
+    """
+    count, average = (
+        db.session.query(
+            func.count(TranscriptChunk.id), func.avg(TranscriptChunk.n_terms)
+        )
+        .filter(TranscriptChunk.n_terms.isnot(None))
+        .one()
+    )
+    return count, float(average or 0)
+
+
+def bm25_scores(query, chunk_ids=None, k1=1.5, b=0.75):
+    """
+    Score chunks against a query with Okapi BM25.
+
+    Only the postings of the query's terms are read, through the index on
+    ``chunk_postings.term``, so the cost depends on how common the terms are rather
+    than on the size of the corpus.
+
+    Args:
+        query (str): The text to score the chunks against.
+        chunk_ids (list, optional): Only score these chunks. Defaults to None, which
+        scores every chunk containing a query term.
+        k1 (float, optional): The term frequency saturation. Defaults to 1.5.
+        b (float, optional): The document length normalization. Defaults to 0.75.
+
+    Returns:
+        dict: The BM25 score of each chunk containing at least one query term, by chunk id.
+    """
+    terms = set(tokenize(query))
+    if not terms:
+        return {}
+    n_chunks, average_length = corpus_stats()
+    document_frequencies = dict(
+        db.session.query(ChunkPosting.term, func.count(ChunkPosting.id))
+        .filter(ChunkPosting.term.in_(terms))
+        .group_by(ChunkPosting.term)
+        .all()
+    )
+    postings = (
+        db.session.query(
+            ChunkPosting.chunk_id,
+            ChunkPosting.term,
+            ChunkPosting.term_frequency,
+            TranscriptChunk.n_terms,
+        )
+        .join(TranscriptChunk, TranscriptChunk.id == ChunkPosting.chunk_id)
+        .filter(ChunkPosting.term.in_(terms))
+    )
+    if chunk_ids is not None:
+        postings = postings.filter(ChunkPosting.chunk_id.in_(chunk_ids))
+
+    scores = Counter()
+    for chunk_id, term, frequency, length in postings:
+        df = document_frequencies[term]
+        idf = math.log(1 + (n_chunks - df + 0.5) / (df + 0.5))
+        norm = 1 - b + b * length / (average_length or 1)
+        scores[chunk_id] += idf * frequency * (k1 + 1) / (frequency + k1 * norm)
+    return dict(scores)
@@ -2,10 +2,19 @@
 """User models."""
 import datetime as dt
 
+import numpy as np
 from flask_login import UserMixin
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.hybrid import hybrid_property
 
-from riddle_me_this.database import Column, PkModel, db, reference_col, relationship
+from riddle_me_this.database import (
+    Column,
+    Model,
+    PkModel,
+    db,
+    reference_col,
+    relationship,
+)
 from riddle_me_this.extensions import bcrypt
 
 
@@ -78,11 +87,65 @@ class Transcript(PkModel):
         return f"<Transcript({self.language_code}-{self.id})>"
 
 
+class TranscriptChunk(PkModel):
+    """A chunk of a transcript with its precomputed embedding."""
+
+    __tablename__ = "transcript_chunks"
+    __table_args__ = (db.UniqueConstraint("transcript_id", "chunk_index"),)
+    transcript_id = reference_col(
+        "transcripts", nullable=False, column_kwargs={"index": True}
+    )
+    transcript = relationship(
+        "Transcript",
+        backref=db.backref(
+            "chunks",
+            order_by="TranscriptChunk.chunk_index",
+            cascade="all, delete-orphan",
+        ),
+    )
+    chunk_index = Column(db.Integer, nullable=False)
+    text = Column(db.Text, nullable=False)
+    start_char = Column(db.Integer, nullable=True)
+    end_char = Column(db.Integer, nullable=True)
+    n_terms = Column(db.Integer, nullable=True)
+    embedding = Column(db.LargeBinary, nullable=True)
+
+    @property
+    def vector(self):
+        """Embedding as a float32 vector."""
+        return np.frombuffer(self.embedding, dtype=np.float32)
+
+    @vector.setter
+    def vector(self, value):
+        """Store the embedding as a compact float32 blob."""
+        self.embedding = np.asarray(value, dtype=np.float32).tobytes()
+
+    def __repr__(self):
+        """Represent instance as a unique string."""
+        return f"<TranscriptChunk({self.transcript_id}-{self.chunk_index})>"
+
+
+class ChunkPosting(PkModel):
+    """An entry of the inverted index: how often a term occurs in a chunk."""
+
+    __tablename__ = "chunk_postings"
+    __table_args__ = (db.UniqueConstraint("term", "chunk_id"),)
+    term = Column(db.String(64), nullable=False, index=True)
+    chunk_id = reference_col(
+        "transcript_chunks", nullable=False, column_kwargs={"index": True}
+    )
+    term_frequency = Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        """Represent instance as a unique string."""
+        return f"<ChunkPosting({self.term!r}-{self.chunk_id})>"
+
+
 class Video(PkModel):
     """A video record."""
 
     __tablename__ = "videos"
-    video_id = Column(db.String, nullable=True)
+    video_id = Column(db.String, nullable=True, unique=True, index=True)
     snippet_published_at = Column(db.DateTime, nullable=True)
     snippet_channel_id = Column(db.String, nullable=True)
     snippet_title = Column(db.String, nullable=True)
@@ -105,3 +168,138 @@ class Video(PkModel):
     def __repr__(self):
         """Represent instance as a unique string."""
         return f"<Video({self.snippet_title!r}-{self.id})>"
+
+
+class CachedAnswer(PkModel):
+    """A cached LLM answer to a question about a transcript."""
+
+    __tablename__ = "cached_answers"
+    key = Column(db.String(64), unique=True, nullable=False, index=True)
+    transcript_id = reference_col(
+        "transcripts", nullable=False, column_kwargs={"index": True}
+    )
+    question = Column(db.Text, nullable=False)
+    question_embedding = Column(db.LargeBinary, nullable=True)
+    context_hash = Column(db.String(64), nullable=False)
+    model_params = Column(db.Text, nullable=False)
+    answer = Column(db.Text, nullable=False)
+    created_at = Column(db.DateTime, nullable=False, default=dt.datetime.utcnow)
+    last_used_at = Column(
+        db.DateTime, nullable=False, default=dt.datetime.utcnow, index=True
+    )
+    hit_count = Column(db.Integer, nullable=False, default=0)
+
+    @property
+    def question_vector(self):
+        """Question embedding as a float32 vector."""
+        return np.frombuffer(self.question_embedding, dtype=np.float32)
+
+    @question_vector.setter
+    def question_vector(self, value):
+        """Store the question embedding as a compact float32 blob."""
+        self.question_embedding = (
+            None if value is None else np.asarray(value, dtype=np.float32).tobytes()
+        )
+
+    def __repr__(self):
+        """Represent instance as a unique string."""
+        return f"<CachedAnswer({self.transcript_id}-{self.question!r})>"
+
+
+class SemanticCacheHit(PkModel):
+    """An answer reused for a question similar to a cached one, kept for auditing."""
+
+    __tablename__ = "semantic_cache_hits"
+    transcript_id = reference_col(
+        "transcripts", nullable=False, column_kwargs={"index": True}
+    )
+    question = Column(db.Text, nullable=False)
+    # Not a foreign key, so that the audit trail outlives evicted answers
+    cached_answer_id = Column(db.Integer, nullable=True)
+    matched_question = Column(db.Text, nullable=False)
+    similarity = Column(db.Float, nullable=False)
+    created_at = Column(db.DateTime, nullable=False, default=dt.datetime.utcnow)
+
+    def __repr__(self):
+        """Represent instance as a unique string."""
+        return f"<SemanticCacheHit({self.question!r}~{self.matched_question!r})>"
+
+
+class TranscriptionJob(PkModel):
+    """A queued Whisper transcription of a video, run by a background worker."""
+
+    __tablename__ = "transcription_jobs"
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    video_id = Column(db.String, nullable=False, index=True)
+    language_code = Column(db.String(10), nullable=False, default="en")
+    local = Column(db.Boolean, nullable=False, default=True)
+    status = Column(db.String(16), nullable=False, default=QUEUED, index=True)
+    attempts = Column(db.Integer, nullable=False, default=0)
+    max_attempts = Column(db.Integer, nullable=False, default=3)
+    error = Column(db.Text, nullable=True)
+    worker = Column(db.String(80), nullable=True)
+    created_at = Column(db.DateTime, nullable=False, default=dt.datetime.utcnow)
+    available_at = Column(
+        db.DateTime, nullable=False, default=dt.datetime.utcnow, index=True
+    )
+    started_at = Column(db.DateTime, nullable=True)
+    finished_at = Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        """Return the job's state as a JSON-serializable dict."""
+        return {
+            "id": self.id,
+            "video_id": self.video_id,
+            "status": self.status,
+            "attempts": self.attempts,
+            "max_attempts": self.max_attempts,
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at and self.started_at.isoformat(),
+            "finished_at": self.finished_at and self.finished_at.isoformat(),
+        }
+
+    def __repr__(self):
+        """Represent instance as a unique string."""
+        return f"<TranscriptionJob({self.video_id}-{self.status})>"
+
+
+class StatCounter(Model):
+    """A named counter shared by every worker, e.g. cache hits."""
+
+    __tablename__ = "stat_counters"
+    name = Column(db.String(80), primary_key=True)
+    value = Column(db.Integer, nullable=False, default=0)
+
+    @classmethod
+    def increment(cls, name, amount=1):
+        """Atomically add to a counter, creating it if needed."""
+        updated = cls.query.filter_by(name=name).update(
+            {cls.value: cls.value + amount}, synchronize_session=False
+        )
+        if not updated:
+            try:
+                db.session.add(cls(name=name, value=amount))
+                db.session.commit()
+                return
+            except IntegrityError:
+                # Another worker created it first
+                db.session.rollback()
+                cls.query.filter_by(name=name).update(
+                    {cls.value: cls.value + amount}, synchronize_session=False
+                )
+        db.session.commit()
+
+    @classmethod
+    def values(cls, prefix=""):
+        """Return the counters whose names start with a prefix."""
+        counters = cls.query.filter(cls.name.startswith(prefix)).all()
+        return {counter.name: counter.value for counter in counters}
+
+    def __repr__(self):
+        """Represent instance as a unique string."""
+        return f"<StatCounter({self.name}={self.value})>"
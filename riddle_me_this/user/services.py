@@ -2,29 +2,55 @@
 """Services for the user app."""
 from __future__ import unicode_literals
 
+import itertools
 import logging
 import os
 import sys
-from io import BytesIO
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 import dotenv
 import openai
-import torch
 import tqdm
 import whisper.transcribe
 import yt_dlp as youtube_dl
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
+from flask import current_app, has_request_context
+from sqlalchemy.exc import IntegrityError
 from youtube_transcript_api import YouTubeTranscriptApi
 
+from riddle_me_this.database import db
+from riddle_me_this.locks import single_flight
 from riddle_me_this.oauth import get_google_token
+from riddle_me_this.user.audio_cache import get_audio_cache
 from riddle_me_this.user.data_loading import *  # noqa: F403
-from riddle_me_this.user.models import Transcript, Video
+from riddle_me_this.user.jobs import (
+    JobFailed,
+    TranscriptionPending,
+    active_transcription,
+    enqueue_transcription,
+)
+from riddle_me_this.user.models import Transcript, TranscriptChunk, Video
+from riddle_me_this.user.transcription import (
+    get_whisper_model,
+    restore_timestamps,
+    skip_non_speech,
+    transcribe_parallel,
+    whisper_device,
+)
+from riddle_me_this.user.vector_index import get_chunk_index
+from riddle_me_this.user.whisper_api import transcribe_audio_file
+from riddle_me_this.user.youtube_client import build_youtube_service
 
 dotenv.load_dotenv()
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
 GOOGLE_APPLICATION_CREDENTIALS = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+# Speech needs far less than the best audio stream: prefer a ~50-70 kbps Opus or AAC one
+AUDIO_FORMAT = "bestaudio[abr<=96]/bestaudio/best"
+YOUTUBE_VIDEO_ID = re.compile(r"^[\w-]{11}$")  # noqa: F405
+# The most IDs a YouTube Data API list call accepts
+YOUTUBE_MAX_RESULTS = 50
+VIDEO_PARTS = "snippet,statistics,contentDetails,status"
 
 logging.basicConfig(
     filename="../../record.log",
@@ -33,15 +59,6 @@ logging.basicConfig(
 )
 
 
-class NamedBytesIO(BytesIO):
-    """An in-memory file-like object that has a name attribute."""
-
-    def __init__(self, data, name):
-        """Initialize the object with the given data and name."""
-        super().__init__(data)
-        self.name = name
-
-
 class _CustomProgressBar(tqdm.tqdm):
     """
     Makes a custom progress bar for the transcribe_whisper function.
@@ -65,17 +82,20 @@ def get_youtube_service():
     """
     Gets the YouTube service object using the access token obtained from the Google API.
 
+    Outside of a request, the YOUTUBE_API_KEY setting is used instead.
+
     Returns:
     --------
     youtube : googleapiclient.discovery.Resource object
         The YouTube service object.
     """
+    if not has_request_context():
+        api_key = current_app.config["YOUTUBE_API_KEY"]
+        return build_youtube_service(api_key=api_key) if api_key else None
     access_token, _ = get_google_token()
     if not access_token:
         return None
-    credentials = Credentials(access_token)
-    youtube = build("youtube", "v3", credentials=credentials)
-    return youtube
+    return build_youtube_service(access_token)
 
 
 def get_youtube_video_id(url):
@@ -105,6 +125,27 @@ def get_youtube_video_id(url):
         raise ValueError("Could not parse YouTube URL.")
 
 
+def batched(items, size):
+    """
+    Splits an iterable into lists of at most `size` items.
+
+    Parameters:
+    -----------
+    items : iterable
+        The items to split.
+    size : int
+        The maximum number of items per list.
+
+    Yields:
+    -------
+    batch : list
+        The next items, in order.
+    """
+    iterator = iter(items)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
 def get_video_info(video_id):
     """
     Gets the video information from YouTube API and stores it in the database.
@@ -121,25 +162,145 @@ def get_video_info(video_id):
     Raises:
     -------
     Exception : If the YouTube service could not be created.
+    ValueError : If YouTube has no video with this ID.
     """
     video_info = Video.query.filter_by(video_id=video_id).first()  # noqa
     if video_info:
         return video_info
-    else:
+    # Another request may store it while this one waits for the lock, which
+    # get_videos_info checks for
+    with single_flight(f"video_info:{video_id}"):
+        videos = get_videos_info([video_id])
+    if not videos:
+        raise ValueError(f"Video {video_id} not found.")
+    return videos[0]
+
+
+def get_videos_info(video_ids):
+    """
+    Gets the information of many videos, fetching the ones not yet stored 50 per API call.
+
+    Parameters:
+    -----------
+    video_ids : list of str
+        The IDs of the YouTube videos. Duplicates are ignored.
+
+    Returns:
+    --------
+    videos : list of Video
+        The stored videos, in the order of `video_ids`. Videos YouTube doesn't know,
+        or that are private, are left out.
+    Raises:
+    -------
+    Exception : If the YouTube service could not be created.
+    """
+    video_ids = list(dict.fromkeys(video_ids))
+    videos = stored_videos(video_ids)
+    missing = [video_id for video_id in video_ids if video_id not in videos]
+    if missing:
         youtube = get_youtube_service()
         if not youtube:
             raise Exception("Failed to create YouTube service.")
+    for batch in batched(missing, YOUTUBE_MAX_RESULTS):
+        response = youtube.videos().list(part=VIDEO_PARTS, id=",".join(batch)).execute()
+        items = response.get("items", [])
+        for attempt in range(2):
+            # Skip any video stored by another request or process during the call
+            stored = stored_videos(batch)
+            videos.update(stored)
+            response["items"] = [item for item in items if item["id"] not in stored]
+            try:
+                loaded = load_video_info(response)  # noqa
+                break
+            except IntegrityError:
+                # video_id is unique: someone stored one of them since the check
+                db.session.rollback()
+                if attempt:
+                    raise
+        videos.update((video.video_id, video) for video in loaded)
+    return [videos[video_id] for video_id in video_ids if video_id in videos]
+
+
+def stored_videos(video_ids, chunk_size=500):
+    """
+    Looks up the videos already in the database.
 
-        video_info = (
-            youtube.videos()
-            .list(part="snippet,statistics,contentDetails,status", id=video_id)
-            .execute()
+    Parameters:
+    -----------
+    video_ids : list of str
+        The IDs of the YouTube videos.
+    chunk_size : int, optional
+        The number of IDs per query, which keeps under SQLite's variable limit. Default is 500.
+
+    Returns:
+    --------
+    videos : dict
+        The stored videos keyed by video ID.
+    """
+    videos = {}
+    for chunk in batched(video_ids, chunk_size):
+        videos.update(
+            (video.video_id, video)
+            for video in Video.query.filter(Video.video_id.in_(chunk))
         )
-        load_video_info(video_info)  # noqa
-        return get_video_info(video_id)
+    return videos
+
+
+def search_transcripts(query, max_videos=10, passages_per_video=3, excerpt_words=60):
+    """
+    Searches the chunks of every stored transcript for the passages closest to a query.
+
+    Args:
+        query (str): The text to search for.
+        max_videos (int): The maximum number of videos to return.
+        passages_per_video (int): The maximum number of passages to return per video.
+        excerpt_words (int): The number of words of each passage to return.
+
+    Returns:
+        results (list of dict): The best-matching videos, most similar first, each with
+        its best score and passages.
+    """
+    chunk_ids, scores = get_chunk_index().search(
+        embed_texts([query])[0], k=max_videos * passages_per_video * 2  # noqa: F405
+    )
+    chunks = {
+        chunk.id: chunk
+        for chunk in TranscriptChunk.query.filter(
+            TranscriptChunk.id.in_(chunk_ids.tolist())
+        ).all()
+    }
+
+    results = {}
+    for chunk_id, score in zip(chunk_ids.tolist(), scores.tolist()):
+        if not (chunk := chunks.get(chunk_id)):
+            continue
+        video_id = chunk.transcript.video_id
+        if video_id not in results:
+            if len(results) == max_videos:
+                continue
+            results[video_id] = {"video_id": video_id, "score": score, "passages": []}
+        passages = results[video_id]["passages"]
+        if len(passages) < passages_per_video:
+            passages.append(
+                {
+                    "transcript_id": chunk.transcript_id,
+                    "chunk_index": chunk.chunk_index,
+                    "start_char": chunk.start_char,
+                    "end_char": chunk.end_char,
+                    "score": score,
+                    "text": " ".join(chunk.text.split()[:excerpt_words]),
+                }
+            )
+
+    videos = Video.query.filter(Video.video_id.in_(list(results))).all()
+    for video in videos:
+        results[video.video_id]["title"] = video.snippet_title
+        results[video.video_id]["channel"] = video.snippet_channel_title
+        results[video.video_id]["thumbnail"] = video.snippet_thumbnails_maxres_url
+    return list(results.values())
 
 
-def get_and_load_transcripts(video_id, language_code="en", local=True):
+def get_and_load_transcripts(video_id, language_code="en", local=True, background=True):
     """
     Searches the database for a transcript with the given video_id and language_code.
 
@@ -147,32 +308,37 @@ def get_and_load_transcripts(video_id, language_code="en", local=True):
         video_id (str): The ID of the YouTube video.
         language_code (str): The language code of the desired transcript.
         local (bool): Whether to use the local transcribe_whisper function or the remote one.
+        background (bool): Whether a Whisper transcription is queued for a worker rather than
+        run in this process.
 
     Returns:
         transcript (Transcript or None): The transcript object if found in the database
     Raises:
     -------
     Exception : If there are no available transcripts for the given video.
+    TranscriptionPending : If the transcript is being made by a background job.
+    LockTimeout : If another request has been loading the video's transcripts for too long.
     """
 
     # Query the database for a transcript with the given video_id and language_code
-    transcript = (
-        Transcript.query.filter_by(
-            video_id=video_id, language_code=language_code, is_generated=False
-        ).first()
-        or Transcript.query.filter_by(  # noqa
-            video_id=video_id, language_code="en-whisper"
-        ).first()
-    )
-    if transcript:
+    if transcript := find_transcript(video_id, language_code):
         return transcript
-    else:
-        auto_transcript = Transcript.query.filter_by(
-            video_id=video_id, language_code=language_code, is_generated=True
-        ).first()
-        if not auto_transcript:
+    # A queued or running job already tried the captions, so don't wait for its lock
+    if background and (job := active_transcription(video_id, language_code)):
+        raise TranscriptionPending(job)
+    # Only one caller at a time fetches the captions of a video; the others wait for it
+    # and then find what it stored
+    with single_flight(f"transcripts:{video_id}"):
+        if transcript := find_transcript(video_id, language_code):
+            return transcript
+        if not Transcript.query.filter_by(video_id=video_id).first():
             try:
-                transcripts = get_transcripts(video_id)
+                transcripts = get_transcripts(
+                    video_id,
+                    language_codes=(language_code,),
+                    eager=current_app.config["TRANSCRIPT_EAGER_LANGUAGES"],
+                    max_workers=current_app.config["TRANSCRIPT_FETCH_WORKERS"],
+                )
             except Exception as e:  # noqa
                 logging.error(e)  # noqa
                 transcripts = [
@@ -184,63 +350,196 @@ def get_and_load_transcripts(video_id, language_code="en", local=True):
                         "is_generated": True,
                     }
                 ]  # noqa
-            load_transcripts(video_id, transcripts)  # noqa
-            return get_and_load_transcripts(video_id)
-        else:
+            if transcripts:
+                load_transcripts(video_id, transcripts)  # noqa
+            if transcript := find_transcript(video_id, language_code):
+                return transcript
+        if background:
+            raise TranscriptionPending(
+                enqueue_transcription(video_id, language_code, local)
+            )
+        transcribe_video(video_id, local=local)
+        return find_transcript(video_id, language_code)
+
+
+def find_transcript(video_id, language_code="en"):
+    """
+    Searches the database for a manual transcript in the given language or a Whisper one.
+
+    Args:
+        video_id (str): The ID of the YouTube video.
+        language_code (str): The language code of the desired transcript.
+
+    Returns:
+        transcript (Transcript or None): The transcript object if found in the database
+    """
+    return (
+        Transcript.query.filter_by(
+            video_id=video_id, language_code=language_code, is_generated=False
+        ).first()
+        or Transcript.query.filter_by(  # noqa
+            video_id=video_id, language_code="en-whisper"
+        ).first()
+    )
+
+
+def transcribe_video(video_id, local=True):
+    """
+    Transcribes the audio of a video with Whisper and stores the transcript.
+
+    This is the slow part of get_and_load_transcripts, run by the transcription workers.
+    It holds the video's whisper lock rather than its transcripts lock, so requests that
+    only need the captions don't wait for Whisper.
+
+    Args:
+        video_id (str): The ID of the YouTube video.
+        local (bool): Whether to use the local transcribe_whisper function or the remote one.
+
+    Raises:
+        JobFailed: If Whisper found no speech, so there is no transcript to store.
+    """
+    with single_flight(
+        f"whisper:{video_id}", timeout=current_app.config["TRANSCRIPTION_JOB_TIMEOUT"]
+    ):
+        if Transcript.query.filter_by(
+            video_id=video_id, language_code="en-whisper"
+        ).first():
+            return
+        with tempfile.TemporaryDirectory() as directory:
             audio_file = download_audio_from_youtube(
-                f"https://www.youtube.com/watch?v={video_id}"
+                f"https://www.youtube.com/watch?v={video_id}", directory
             )
             transcripts = (
                 transcribe_whisper_local(audio_file)
                 if local
                 else transcribe_audio_with_whisper(audio_file)
             )
-            os.remove(f"/app/{audio_file.split('/')[-1]}")
-            load_transcripts(video_id, transcripts)  # noqa
-            return get_and_load_transcripts(
-                video_id, language_code=language_code, local=local
-            )
+        load_transcripts(video_id, transcripts)  # noqa
+    if not Transcript.query.filter_by(
+        video_id=video_id, language_code="en-whisper"
+    ).first():
+        raise JobFailed(f"Whisper found no speech in {video_id}")
+
+
+def run_transcription_job(job):
+    """
+    Transcribes the video of a claimed transcription job, unless its transcript exists by now.
+
+    transcribe_video holds the video's whisper lock, so a job requeued while it still runs,
+    or a video being transcribed elsewhere meanwhile, isn't transcribed twice.
+
+    Args:
+        job (TranscriptionJob): The claimed job.
+    """
+    if find_transcript(job.video_id, job.language_code):
+        return
+    transcribe_video(job.video_id, local=job.local)
+
+
+def preferred_tracks(tracks, language_codes=("en",)):
+    """
+    Orders the caption tracks of a video by preference, leaving out other languages.
+
+    Manual tracks come before generated ones, and within each kind, tracks follow the
+    order of `language_codes`.
+
+    Args:
+        tracks (list): The transcript objects listed by YouTubeTranscriptApi.
+        language_codes (tuple of str): The wanted languages, most wanted first.
+
+    Returns:
+        list: The tracks in `language_codes`, most preferred first.
+    """
+    return [
+        track
+        for is_generated in (False, True)
+        for language_code in language_codes
+        for track in tracks
+        if track.is_generated == is_generated and track.language_code == language_code
+    ]
 
 
-def get_transcripts(video_id):
+def get_transcripts(video_id, language_codes=("en",), eager=False, max_workers=4):
     """
-    Fetches all available transcripts for a given YouTube video and returns them as a list of transcript objects.
+    Fetches the captions of a YouTube video and returns them as a list of transcript objects.
+
+    The tracks are listed first and only the preferred one is downloaded, falling back to the
+    next one in preference order if that fails. With `eager`, every other track is downloaded
+    as well, `max_workers` at a time.
 
     Args:
         video_id (str): The ID of the YouTube video.
+        language_codes (tuple of str): The wanted languages, most wanted first.
+        eager (bool): Whether to also fetch the tracks in other languages.
+        max_workers (int): The maximum number of tracks downloaded at the same time.
 
     Returns:
         transcripts (list): A list of transcript objects, each containing the language_code and is_generated attributes.
     """
-    # Get a list of available transcripts for the video
-    transcript_list = YouTubeTranscriptApi.list_transcripts(video_id)
+    # Listing the tracks is one request; each fetch() is another
+    tracks = list(YouTubeTranscriptApi.list_transcripts(video_id))
 
-    # Create a list of transcript objects
     transcripts = []
+    preferred = None
+    for track in preferred_tracks(tracks, language_codes):
+        if (captions := fetch_captions(track)) is not None:
+            transcripts.append(transcript_object(track, captions))
+            preferred = track
+            break
+
+    if eager:
+        others = [track for track in tracks if track is not preferred]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            transcripts += [
+                transcript_object(track, captions)
+                for track, captions in zip(others, executor.map(fetch_captions, others))
+                if captions is not None
+            ]
+    return transcripts
 
-    # Loop through the transcript_list and add each transcript object to the transcripts list
-    for transcript in transcript_list:
-        # Get the language code and is_generated attributes for the transcript
-        language_code = transcript.language_code
-        is_generated = transcript.is_generated
-
-        # Add the transcript object along with the language_code and is_generated attributes to the transcripts list
-        transcripts.append(
-            {
-                "transcript": transcript.fetch(),
-                "language_code": language_code,
-                "is_generated": is_generated,
-            }
-        )
 
-    # Return the list of transcripts
-    return transcripts
+def fetch_captions(track):
+    """
+    Downloads the captions of a track, logging rather than raising any failure.
+
+    Args:
+        track: The transcript object listed by YouTubeTranscriptApi.
+
+    Returns:
+        list of dict or None: The captions, or None if they couldn't be fetched.
+    """
+    try:
+        return track.fetch()
+    except Exception as e:  # noqa
+        logging.warning(f"Failed to fetch {track.language_code} captions: {e}")
+        return None
+
+
+def transcript_object(track, captions):
+    """
+    Builds the transcript object of a fetched caption track.
+
+    Args:
+        track: The transcript object listed by YouTubeTranscriptApi.
+        captions (list of dict): The fetched captions of the track.
+
+    Returns:
+        dict: The captions along with the track's language_code and is_generated attributes.
+    """
+    return {
+        "transcript": captions,
+        "language_code": track.language_code,
+        "is_generated": track.is_generated,
+    }
 
 
 def transcribe_audio_with_whisper(audio_file):
     """
     Transcribes the input audio file using the OpenAI Whisper ASR API.
 
+    Files over the API's upload limit are split into parts that are uploaded concurrently,
+    see transcribe_audio_file.
+
     Parameters:
     -----------
     audio_file : str
@@ -251,18 +550,11 @@ def transcribe_audio_with_whisper(audio_file):
     transcription : list of dict
         A list containing a single transcript object.
     """
-    with open(audio_file, "rb") as f:
-        audio_data = f.read()
-    # Create an in-memory file object from the audio data
-    audio_file = NamedBytesIO(audio_data, "audio.mp3")
-    # Send the audio file to the Whisper ASR API
-    response = openai.Audio.transcribe("whisper-1", audio_file)
-    # Extract the transcription from the response
-    transcription = response["text"].strip()
+    transcription = transcribe_audio_file(audio_file)
     return [
         {
-            "text": transcription,
-            "transcript": [{"text": transcription}],
+            "text": transcription["text"],
+            "transcript": transcription["segments"],
             "language_code": "en-whisper",
             "is_generated": False,
         }
@@ -273,24 +565,53 @@ def transcribe_whisper_local(audio_location):
     """
     Transcribes the input audio file using the local Whisper transcriber.
 
+    Without a GPU and with more than one WHISPER_WORKERS (by default, this process's share
+    of the cores, their number divided by TRANSCRIPTION_WORKERS), the audio is split at
+    silences and the pieces are transcribed in parallel on the CPU by transcribe_parallel.
+    With a GPU, the whole audio goes to the one model on it. With WHISPER_VAD
+    set, only the stretches of speech are transcribed and the timestamps are mapped back to the
+    original audio.
+
+    The file is decoded once, straight to 16 kHz mono samples, which are what Whisper uses.
+
     Parameters:
     -----------
-    audio_location : str
-        The location of the audio file to transcribe.
+    audio_location : str or numpy.ndarray
+        The location of the audio file to transcribe, or its 16 kHz mono samples.
 
     Returns:
     --------
     transcription : list of dict
         A list containing a single transcript object.
     """
-    transcribe_module = sys.modules["whisper.transcribe"]
-    transcribe_module.tqdm.tqdm = _CustomProgressBar
-    torch.cuda.is_available()
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    model = whisper.load_model("tiny", device=device)
-    transcription = whisper.transcribe(
-        model, audio_location, fp16=False, language="English", verbose=True
+    audio = (
+        whisper.load_audio(audio_location)
+        if isinstance(audio_location, str)
+        else audio_location
     )
+    if vad := current_app.config["WHISPER_VAD"]:
+        audio, speech_spans = skip_non_speech(audio)
+    # Each transcription worker process has its own pool, so they share the cores
+    workers = current_app.config["WHISPER_WORKERS"] or max(
+        1, (os.cpu_count() or 1) // current_app.config["TRANSCRIPTION_WORKERS"]
+    )
+    if workers > 1 and whisper_device() == "cpu":
+        transcription = transcribe_parallel(
+            audio,
+            size=current_app.config["WHISPER_MODEL_SIZE"],
+            quantize=current_app.config["WHISPER_QUANTIZE"],
+            workers=workers,
+            segment_seconds=current_app.config["WHISPER_SEGMENT_SECONDS"],
+        )
+    else:
+        transcribe_module = sys.modules["whisper.transcribe"]
+        transcribe_module.tqdm.tqdm = _CustomProgressBar
+        model = get_whisper_model()
+        transcription = whisper.transcribe(
+            model, audio, fp16=False, language="English", verbose=True
+        )
+    if vad:
+        transcription = restore_timestamps(transcription, speech_spans)
     return [
         {
             "text": transcription["text"],
@@ -301,35 +622,38 @@ def transcribe_whisper_local(audio_location):
     ]
 
 
-def download_audio_from_youtube(url, codec="mp3", quality="64"):
+def download_audio_from_youtube(url, directory, audio_format=AUDIO_FORMAT):
     """
-    Downloads the audio file of a YouTube video and returns its location.
+    Downloads the audio of a YouTube video as it is streamed, without re-encoding it, and returns its location.
+
+    Audio already in the audio cache isn't downloaded again, and new downloads are added to it.
 
     Parameters:
     -----------
     url : str
         The URL of the YouTube video.
-    codec : str, optional
-        The audio codec to use for the downloaded file. Default is 'mp3'.
-    quality : str, optional
-        The audio quality to use for the downloaded file. Default is '64'.
+    directory : str
+        The directory to download the audio file to, e.g. a temporary one.
+    audio_format : str, optional
+        The yt-dlp format selector. Default is AUDIO_FORMAT, a compact audio-only stream.
 
     Returns:
     --------
     audio_file : str
-        The location of the downloaded audio file.
+        The location of the downloaded audio file, or of its copy in the audio cache.
     """
+    audio_cache = get_audio_cache()
+    video_id = get_youtube_video_id(url)
+    if audio_cache and (cached := audio_cache.get(video_id, audio_format)):
+        return cached
+
     ydl_opts = {
-        "format": "bestaudio/best",
-        "outtmpl": "./%(id)s.%(ext)s",
-        "postprocessors": [
-            {
-                "key": "FFmpegExtractAudio",
-                "preferredcodec": codec,
-                "preferredquality": quality,
-            }
-        ],
+        "format": audio_format,
+        "outtmpl": os.path.join(directory, "%(id)s.%(ext)s"),
     }
     with youtube_dl.YoutubeDL(ydl_opts) as ydl:
-        _ = ydl.extract_info(url, download=True)
-    return f"./{get_youtube_video_id(url)}.{codec}"
+        info = ydl.extract_info(url, download=True)
+        audio_file = ydl.prepare_filename(info)
+    if audio_cache:
+        return audio_cache.put(video_id, audio_format, audio_file)
+    return audio_file
@@ -0,0 +1,443 @@
+"""Local Whisper models: loading, int8 quantization, speech detection, parallel transcription and benchmarks."""
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+import whisper
+from flask import current_app
+from whisper.audio import HOP_LENGTH, SAMPLE_RATE
+
+from riddle_me_this.registry import model_registry
+from riddle_me_this.user.models import StatCounter
+
+WHISPER_SIZES = ("tiny", "base", "small")
+
+
+def quantize_whisper(model):
+    """
+    Quantize the linear layers of a Whisper model to int8 for CPU inference.
+
+    Weights are stored as int8 and activations are quantized on the fly, which roughly
+    halves the decoding time on CPU for a small loss in accuracy. Whisper subclasses
+    nn.Linear only to cast weights to the activations' dtype, so its layers are turned
+    back into plain nn.Linear first for torch to recognize them.
+
+    Args:
+        model (whisper.model.Whisper): A Whisper model on the CPU.
+
+    Returns:
+        whisper.model.Whisper: The quantized model.
+    """
+    for module in model.modules():
+        if type(module) is whisper.model.Linear:
+            module.__class__ = torch.nn.Linear
+    return torch.quantization.quantize_dynamic(
+        model.eval(), {torch.nn.Linear}, dtype=torch.qint8
+    )
+
+
+def load_whisper_model(size="tiny", device="cpu", quantize=False):
+    """
+    Load a Whisper model, bypassing the model registry.
+
+    Args:
+        size (str, optional): The model size, e.g. "tiny", "base" or "small". Defaults to "tiny".
+        device (str, optional): The device to load the model on. Defaults to "cpu".
+        quantize (bool, optional): Whether to quantize the model to int8. Only applies on the
+        CPU. Defaults to False.
+
+    Returns:
+        whisper.model.Whisper: The loaded model.
+    """
+    model = whisper.load_model(size, device=device)
+    return quantize_whisper(model) if quantize and device == "cpu" else model
+
+
+def whisper_device():
+    """Return the device local Whisper models run on: the GPU when there is one, else the CPU."""
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def get_whisper_model(size=None, quantize=None):
+    """
+    Return this worker's Whisper model, loading it on first use.
+
+    Args:
+        size (str, optional): The model size. Defaults to the WHISPER_MODEL_SIZE setting.
+        quantize (bool, optional): Whether to use the int8 model on the CPU. Defaults to
+        the WHISPER_QUANTIZE setting.
+
+    Returns:
+        whisper.model.Whisper: The shared model.
+    """
+    size = size or current_app.config["WHISPER_MODEL_SIZE"]
+    if quantize is None:
+        quantize = current_app.config["WHISPER_QUANTIZE"]
+    device = whisper_device()
+    quantize = quantize and device == "cpu"
+    return model_registry.get(
+        f"whisper:{size}:{device}{':int8' if quantize else ''}",
+        lambda: load_whisper_model(size, device, quantize),
+    )
+
+
+def find_silences(audio, frame_seconds=0.03, threshold=0.1, min_silence_seconds=0.3):
+    """
+    Find the silent stretches of an audio signal.
+
+    A frame is silent when its RMS energy is below `threshold` times the median energy
+    of the louder half of the frames, which adapts to the loudness of the recording.
+
+    Args:
+        audio (numpy.ndarray): 16 kHz mono samples.
+        frame_seconds (float, optional): The length of the analysis frames. Defaults to 0.03.
+        threshold (float, optional): The relative energy below which a frame is silent.
+        Defaults to 0.1.
+        min_silence_seconds (float, optional): The minimum length of a silence. Defaults to 0.3.
+
+    Returns:
+        list of tuple: The start and end sample of each silence.
+    """
+    frame = int(frame_seconds * SAMPLE_RATE)
+    n_frames = len(audio) // frame
+    if not n_frames:
+        return []
+    frames = audio[: n_frames * frame].reshape(n_frames, frame)
+    energy = np.sqrt(np.mean(frames.astype(np.float32) ** 2, axis=1))
+    loud = np.median(energy[energy >= np.median(energy)])
+    silent = np.concatenate([[False], energy < threshold * loud, [False]])
+    edges = np.flatnonzero(np.diff(silent.astype(np.int8)))
+    min_frames = int(min_silence_seconds / frame_seconds)
+    return [
+        (start * frame, end * frame)
+        for start, end in zip(edges[::2], edges[1::2])
+        if end - start >= min_frames
+    ]
+
+
+def split_at_silences(audio, segment_seconds=300, search_seconds=30):
+    """
+    Split an audio signal into segments of about `segment_seconds`, cutting in silences.
+
+    Each cut is made in the middle of the silence closest to its target time, as long as one
+    lies within `search_seconds` of it, so that words are rarely cut in half.
+
+    Args:
+        audio (numpy.ndarray): 16 kHz mono samples.
+        segment_seconds (float, optional): The target length of a segment. Defaults to 300.
+        search_seconds (float, optional): How far from its target a cut may move. Defaults to 30.
+
+    Returns:
+        list of tuple: The start and end sample of each segment, covering the whole audio.
+    """
+    segment = int(segment_seconds * SAMPLE_RATE)
+    if len(audio) <= segment:
+        return [(0, len(audio))]
+    middles = np.array(
+        [(start + end) // 2 for start, end in find_silences(audio)], dtype=np.int64
+    )
+    search = int(search_seconds * SAMPLE_RATE)
+    cuts = [0]
+    while len(audio) - cuts[-1] > segment:
+        target = cuts[-1] + segment
+        nearby = middles[(middles > cuts[-1]) & (np.abs(middles - target) <= search)]
+        cuts.append(
+            int(nearby[np.argmin(np.abs(nearby - target))]) if len(nearby) else target
+        )
+    cuts.append(len(audio))
+    return list(zip(cuts[:-1], cuts[1:]))
+
+
+def shift_segments(segments, offset):
+    """
+    Move Whisper segments, and their words if any, later by `offset` samples.
+
+    Args:
+        segments (list of dict): The segments of a whisper.transcribe() result.
+        offset (int): The sample at which the transcribed audio started.
+
+    Returns:
+        list of dict: Copies of the segments with shifted start, end and seek.
+    """
+    seconds = offset / SAMPLE_RATE
+    shifted = []
+    for segment in segments:
+        segment = dict(
+            segment,
+            start=segment["start"] + seconds,
+            end=segment["end"] + seconds,
+            seek=segment.get("seek", 0) + offset // HOP_LENGTH,
+        )
+        if "words" in segment:
+            segment["words"] = [
+                dict(word, start=word["start"] + seconds, end=word["end"] + seconds)
+                for word in segment["words"]
+            ]
+        shifted.append(segment)
+    return shifted
+
+
+def stitch_transcriptions(results, offsets):
+    """
+    Combine the transcriptions of consecutive pieces of audio into one.
+
+    Args:
+        results (list of dict): The whisper.transcribe() result of each piece, in order.
+        offsets (list of int): The sample at which each piece starts in the full audio.
+
+    Returns:
+        dict: A result shaped like whisper.transcribe()'s, with renumbered segments whose
+        times are relative to the full audio.
+    """
+    segments = [
+        segment
+        for result, offset in zip(results, offsets)
+        for segment in shift_segments(result["segments"], offset)
+    ]
+    for i, segment in enumerate(segments):
+        segment["id"] = i
+    return {
+        "text": "".join(result["text"] for result in results),
+        "segments": segments,
+        "language": results[0].get("language") if results else None,
+    }
+
+
+def _load_silero_vad():
+    """Load the Silero voice activity detector and return it with its get_speech_timestamps function."""
+    model, utils = torch.hub.load(
+        repo_or_dir="snakers4/silero-vad", model="silero_vad", trust_repo=True
+    )
+    return model, utils[0]
+
+
+def detect_speech(audio, min_silence_seconds=1.0, pad_seconds=0.2):
+    """
+    Find the stretches of an audio signal that contain speech, leaving out silence and music.
+
+    Args:
+        audio (numpy.ndarray): 16 kHz mono samples.
+        min_silence_seconds (float, optional): The shortest pause that splits two stretches of
+        speech. Defaults to 1.
+        pad_seconds (float, optional): The margin kept around each stretch of speech. Defaults to 0.2.
+
+    Returns:
+        list of tuple: The start and end sample of each stretch of speech, in order.
+    """
+    model, get_speech_timestamps = model_registry.get("silero_vad", _load_silero_vad)
+    timestamps = get_speech_timestamps(
+        torch.from_numpy(audio),
+        model,
+        sampling_rate=SAMPLE_RATE,
+        min_silence_duration_ms=int(min_silence_seconds * 1000),
+        speech_pad_ms=int(pad_seconds * 1000),
+    )
+    spans = []
+    for timestamp in timestamps:
+        if spans and timestamp["start"] <= spans[-1][1]:
+            spans[-1] = (spans[-1][0], max(spans[-1][1], timestamp["end"]))
+        else:
+            spans.append((timestamp["start"], timestamp["end"]))
+    return spans
+
+
+def skip_non_speech(audio):
+    """
+    Cut everything but speech out of an audio signal.
+
+    The skipped fraction is logged and added to the "vad.audio_ms" and "vad.skipped_ms"
+    counters, so the compute saved can be tracked across workers. If no speech is found at
+    all, the audio is kept whole rather than trusting the detector.
+
+    Args:
+        audio (numpy.ndarray): 16 kHz mono samples.
+
+    Returns:
+        tuple: The speech-only audio, and the start and end sample of each stretch of speech
+        in the original audio, to pass to restore_timestamps().
+    """
+    spans = detect_speech(audio) or [(0, len(audio))]
+    speech = np.concatenate([audio[start:end] for start, end in spans])
+    skipped = len(audio) - len(speech)
+    logging.info(
+        f"VAD skipped {skipped / SAMPLE_RATE:.0f}s of {len(audio) / SAMPLE_RATE:.0f}s "
+        f"({skipped / max(len(audio), 1):.1%})"
+    )
+    StatCounter.increment("vad.audio_ms", len(audio) * 1000 // SAMPLE_RATE)
+    StatCounter.increment("vad.skipped_ms", skipped * 1000 // SAMPLE_RATE)
+    return speech, spans
+
+
+def to_original_time(seconds, spans, end=False):
+    """
+    Map times in speech-only audio back to the audio it was cut from.
+
+    Args:
+        seconds (array-like): Times in the speech-only audio.
+        spans (list of tuple): The start and end sample of each stretch of speech.
+        end (bool, optional): Whether the times end something, so that a time on the border of
+        two stretches maps to the end of the first rather than the start of the second.
+        Defaults to False.
+
+    Returns:
+        numpy.ndarray: The times in the original audio.
+    """
+    spans = np.asarray(spans, dtype=np.int64)
+    lengths = spans[:, 1] - spans[:, 0]
+    speech_starts = np.cumsum(lengths) - lengths
+    samples = np.asarray(seconds, dtype=np.float64) * SAMPLE_RATE
+    spans_before = np.searchsorted(
+        speech_starts, samples, side="left" if end else "right"
+    )
+    k = np.clip(spans_before - 1, 0, len(spans) - 1)
+    return (spans[k, 0] + samples - speech_starts[k]) / SAMPLE_RATE
+
+
+def restore_timestamps(transcription, spans):
+    """
+    Map the segment and word times of a transcription of speech-only audio back to the original audio.
+
+    Args:
+        transcription (dict): A whisper.transcribe() result for the audio from skip_non_speech().
+        spans (list of tuple): The stretches of speech returned with that audio.
+
+    Returns:
+        dict: The transcription with times in the original audio.
+    """
+    segments = []
+    for segment in transcription["segments"]:
+        segment = dict(
+            segment,
+            start=float(to_original_time(segment["start"], spans)),
+            end=float(to_original_time(segment["end"], spans, end=True)),
+        )
+        if "words" in segment:
+            segment["words"] = [
+                dict(
+                    word,
+                    start=float(to_original_time(word["start"], spans)),
+                    end=float(to_original_time(word["end"], spans, end=True)),
+                )
+                for word in segment["words"]
+            ]
+        segments.append(segment)
+    return dict(transcription, segments=segments)
+
+
+def _init_transcription_process(n_threads):
+    """Limit each pool process to its share of the cores."""
+    torch.set_num_threads(n_threads)
+
+
+def _transcribe_segment(audio, size, quantize):
+    """Transcribe a piece of audio in a pool process, loading the model on first use."""
+    model = model_registry.get(
+        f"whisper:{size}:cpu{':int8' if quantize else ''}",
+        lambda: load_whisper_model(size, "cpu", quantize),
+    )
+    return whisper.transcribe(model, audio, fp16=False, language="English")
+
+
+_pools = {}
+
+
+def _get_pool(workers):
+    """Return the process pool of the given size, started on first use and kept for later calls."""
+    if workers not in _pools:
+        _pools[workers] = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_transcription_process,
+            initargs=(max(1, (os.cpu_count() or 1) // workers),),
+        )
+    return _pools[workers]
+
+
+def transcribe_parallel(
+    audio, size="tiny", quantize=False, workers=None, segment_seconds=300
+):
+    """
+    Transcribe audio by splitting it at silences and transcribing the pieces in parallel.
+
+    The pieces are transcribed on the CPU by a pool of `workers` processes that is kept for
+    later calls, each holding its own copy of the model and using its share of the cores.
+    Audio with fewer pieces than processes leaves the others idle rather than starting a
+    smaller pool.
+
+    Args:
+        audio (numpy.ndarray): 16 kHz mono samples, e.g. from whisper.load_audio().
+        size (str, optional): The model size. Defaults to "tiny".
+        quantize (bool, optional): Whether to use the int8 model. Defaults to False.
+        workers (int, optional): The number of processes. Defaults to the number of cores.
+        segment_seconds (float, optional): The target length of a piece. Defaults to 300.
+
+    Returns:
+        dict: A result shaped like whisper.transcribe()'s for the whole audio.
+    """
+    workers = workers or os.cpu_count() or 1
+    pieces = split_at_silences(audio, segment_seconds)
+    if workers == 1 or len(pieces) == 1:
+        results = [_transcribe_segment(audio, size, quantize)]
+        return stitch_transcriptions(results, [0])
+
+    futures = [
+        _get_pool(workers).submit(_transcribe_segment, audio[start:end], size, quantize)
+        for start, end in pieces
+    ]
+    results = [future.result() for future in futures]
+    logging.info(
+        f"Transcribed {len(pieces)} pieces on {min(workers, len(pieces))} processes"
+    )
+    return stitch_transcriptions(results, [start for start, _ in pieces])
+
+
+def benchmark_whisper(audio_location, sizes=WHISPER_SIZES, quantize=(False, True)):
+    """
+    Measure the speed of each Whisper model size on the CPU, with and without quantization.
+
+    The real-time factor is the transcription time divided by the audio duration, so
+    anything below 1 transcribes faster than the audio plays.
+
+    Args:
+        audio_location (str): The audio file to transcribe.
+        sizes (tuple, optional): The model sizes to benchmark. Defaults to WHISPER_SIZES.
+        quantize (tuple, optional): The quantization settings to benchmark. Defaults to
+        both.
+
+    Returns:
+        list of dict: The size, quantization, load time, transcription time, real-time factor
+        and transcribed text of each run.
+    """
+    audio = whisper.load_audio(audio_location)
+    duration = len(audio) / SAMPLE_RATE
+    results = []
+    for size in sizes:
+        for int8 in quantize:
+            start = time.perf_counter()
+            model = load_whisper_model(size, "cpu", int8)
+            load_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            transcription = whisper.transcribe(
+                model, audio, fp16=False, language="English"
+            )
+            seconds = time.perf_counter() - start
+            results.append(
+                {
+                    "size": size,
+                    "quantized": int8,
+                    "load_seconds": load_seconds,
+                    "seconds": seconds,
+                    "real_time_factor": seconds / duration if duration else 0.0,
+                    "text": transcription["text"].strip(),
+                }
+            )
+            logging.info(
+                f"whisper {size}{' int8' if int8 else ''}: "
+                f"RTF {results[-1]['real_time_factor']:.3f}"
+            )
+    return results
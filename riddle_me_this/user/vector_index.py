@@ -0,0 +1,525 @@
+"""Approximate nearest-neighbour index over the chunks of every stored transcript."""
+import copy
+import fcntl
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+from flask import current_app
+
+from riddle_me_this.user.models import TranscriptChunk
+
+
+def normalize_rows(vectors):
+    """
+    Scale each row of a matrix to unit length, leaving all-zero rows as they are.
+
+    Args:
+        vectors (array-like): A vector or a matrix with one vector per row.
+
+    Returns:
+        numpy.ndarray: A float32 matrix of unit-length rows.
+    """
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def top_k_similar(query_vectors, matrix, k=1, normalized=False):
+    """
+    Find the k rows of a matrix with the highest cosine similarity to each query vector.
+
+    All queries are scored with a single matrix product, and the top k are selected with
+    argpartition, so only the k winners of each query are ever sorted.
+
+    Args:
+        query_vectors (array-like): A query vector or a matrix with one query per row.
+        matrix (array-like): The vectors to search, one per row, e.g. from chunk_matrix.
+        k (int, optional): The number of results per query. Defaults to 1.
+        normalized (bool, optional): Whether the rows of matrix already have unit length.
+        Defaults to False.
+
+    Returns:
+        tuple: The indices into matrix and their similarities, both of shape
+        (number of queries, k) and sorted from most to least similar.
+    """
+    queries = normalize_rows(query_vectors)
+    matrix = (
+        np.asarray(matrix, dtype=np.float32) if normalized else normalize_rows(matrix)
+    )
+    k = min(k, matrix.shape[0])
+
+    scores = queries @ matrix.T
+    if k < matrix.shape[0]:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.tile(np.arange(matrix.shape[0]), (len(queries), 1))
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1, kind="stable")
+    return (
+        np.take_along_axis(candidates, order, axis=1),
+        np.take_along_axis(candidate_scores, order, axis=1),
+    )
+
+
+class IVFIndex:
+    """
+    An inverted file (IVF) index of unit-length vectors searched by cosine similarity.
+
+    The vectors are clustered with spherical k-means and each one is stored in the list
+    of its nearest centroid. A search only scans the lists of the `n_probe` centroids
+    closest to the query, so its cost grows with roughly the square root of the index size.
+    Until the index is trained it is searched exhaustively. Adding and removing vectors
+    never retrains it: call train() when needs_training says the lists are out of date.
+
+    Attributes:
+        vectors (numpy.ndarray): The normalized vectors, one per row.
+        ids (numpy.ndarray): The id of each vector, e.g. a TranscriptChunk id.
+        centroids (numpy.ndarray or None): The list centroids, or None while untrained.
+        assignments (numpy.ndarray): The list of each vector.
+        lists (list): The row numbers of the vectors in each list.
+        trained_size (int): The number of vectors the centroids were trained on.
+        applied_segments (frozenset): The names of the change segments folded into the index.
+    """
+
+    def __init__(self, dim=0, n_probe=8, min_train_size=1024):
+        """
+        Initialize an empty IVFIndex.
+
+        Args:
+            dim (int, optional): The dimension of the vectors. Defaults to 0, which
+            takes the dimension from the first vectors added.
+            n_probe (int, optional): The number of lists scanned per query. Defaults to 8.
+            min_train_size (int, optional): The number of vectors needed before the
+            index is clustered. Defaults to 1024.
+        """
+        self.n_probe = n_probe
+        self.min_train_size = min_train_size
+        self.vectors = np.zeros((0, dim), dtype=np.float32)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.centroids = None
+        self.assignments = np.zeros(0, dtype=np.int32)
+        self.lists = [np.zeros(0, dtype=np.int64)]
+        self.trained_size = 0
+        self.applied_segments = frozenset()
+
+    def __len__(self):
+        """Return the number of vectors in the index."""
+        return len(self.ids)
+
+    @property
+    def needs_training(self):
+        """Whether the index has reached `min_train_size` vectors or grown fourfold since its training."""
+        return len(self) >= max(self.min_train_size, 4 * self.trained_size)
+
+    def copy(self):
+        """
+        Return a shallow copy of the index.
+
+        add() and remove() replace the arrays instead of changing them in place, so the
+        copy can be changed while other threads search the original.
+        """
+        index = copy.copy(self)
+        index.lists = list(self.lists)
+        return index
+
+    def add(self, ids, vectors):
+        """
+        Add vectors to the index, skipping ids that are already present.
+
+        New vectors join the list of their nearest centroid.
+
+        Args:
+            ids (array-like): The id of each vector.
+            vectors (array-like): The vectors to add, one per row.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = normalize_rows(vectors)
+        new = ~np.isin(ids, self.ids)
+        ids, vectors = ids[new], vectors[new]
+        if not len(ids):
+            return
+
+        if not len(self.vectors):
+            self.vectors = self.vectors.reshape(0, vectors.shape[1])
+        start = len(self.ids)
+        self.vectors = np.vstack([self.vectors, vectors])
+        self.ids = np.concatenate([self.ids, ids])
+
+        assignments = self._assign(vectors)
+        self.assignments = np.concatenate([self.assignments, assignments])
+        rows = np.arange(start, len(self), dtype=np.int64)
+        for list_id in np.unique(assignments):
+            self.lists[list_id] = np.concatenate(
+                [self.lists[list_id], rows[assignments == list_id]]
+            )
+
+    def remove(self, ids):
+        """
+        Remove vectors from the index, ignoring ids that aren't present.
+
+        Args:
+            ids (array-like): The ids of the vectors to remove.
+        """
+        kept = ~np.isin(self.ids, np.asarray(ids, dtype=np.int64))
+        if kept.all():
+            return
+        self.vectors = self.vectors[kept]
+        self.ids = self.ids[kept]
+        self.assignments = self.assignments[kept]
+        self._build_lists()
+
+    def train(self, n_iter=10, seed=0):
+        """
+        Cluster the vectors with spherical k-means and rebuild the lists.
+
+        Args:
+            n_iter (int, optional): The number of k-means iterations. Defaults to 10.
+            seed (int, optional): The seed used to pick the initial centroids. Defaults to 0.
+        """
+        n_lists = max(1, int(np.sqrt(len(self))))
+        rng = np.random.default_rng(seed)
+        self.centroids = self.vectors[rng.choice(len(self), n_lists, replace=False)]
+        for _ in range(n_iter):
+            assignments = self._assign(self.vectors)
+            order = np.argsort(assignments, kind="stable")
+            counts = np.bincount(assignments, minlength=n_lists)
+            starts = np.cumsum(counts) - counts
+            # Lists that ended up empty keep their old centroid
+            sums = self.centroids.copy()
+            sums[counts > 0] = np.add.reduceat(
+                self.vectors[order], starts[counts > 0], axis=0
+            )
+            self.centroids = normalize_rows(sums)
+        self.assignments = self._assign(self.vectors)
+        self.trained_size = len(self)
+        self._build_lists()
+
+    def _assign(self, vectors, block_size=65536):
+        """Return the nearest list of each vector, scoring blocks of rows at a time."""
+        assignments = np.zeros(len(vectors), dtype=np.int32)
+        if self.centroids is None:
+            return assignments
+        for start in range(0, len(vectors), block_size):
+            block = slice(start, start + block_size)
+            assignments[block] = np.argmax(vectors[block] @ self.centroids.T, axis=1)
+        return assignments
+
+    def _build_lists(self):
+        """Rebuild the per-list row numbers from the assignments."""
+        n_lists = 1 if self.centroids is None else len(self.centroids)
+        order = np.argsort(self.assignments, kind="stable")
+        counts = np.bincount(self.assignments, minlength=n_lists)
+        self.lists = np.split(order.astype(np.int64), np.cumsum(counts)[:-1])
+
+    def search(self, query_vector, k=10, n_probe=None):
+        """
+        Find the approximate k nearest vectors to a query.
+
+        Args:
+            query_vector (array-like): The query vector.
+            k (int, optional): The number of results. Defaults to 10.
+            n_probe (int, optional): The number of lists to scan. Defaults to the
+            index's `n_probe`.
+
+        Returns:
+            tuple: The ids of the results and their cosine similarities, from most to
+            least similar.
+        """
+        if not len(self):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        query = normalize_rows(query_vector)
+        if self.centroids is None:
+            candidates = self.lists[0]
+        else:
+            probed, _ = top_k_similar(
+                query, self.centroids, k=n_probe or self.n_probe, normalized=True
+            )
+            candidates = np.concatenate([self.lists[i] for i in probed[0]])
+        indices, scores = top_k_similar(
+            query, self.vectors[candidates], k=k, normalized=True
+        )
+        return self.ids[candidates[indices[0]]], scores[0]
+
+    def save(self, path):
+        """
+        Atomically write the index to a .npz file.
+
+        Args:
+            path (str): The file to write.
+        """
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                vectors=self.vectors,
+                ids=self.ids,
+                centroids=(
+                    np.zeros((0, self.vectors.shape[1]), dtype=np.float32)
+                    if self.centroids is None
+                    else self.centroids
+                ),
+                assignments=self.assignments,
+                params=np.array(
+                    [self.n_probe, self.min_train_size, self.trained_size],
+                    dtype=np.int64,
+                ),
+                applied_segments=np.array(sorted(self.applied_segments), dtype=str),
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read an index written by save().
+
+        Args:
+            path (str): The file to read.
+
+        Returns:
+            IVFIndex: The loaded index.
+        """
+        with np.load(path) as data:
+            n_probe, min_train_size, trained_size = data["params"].tolist()
+            index = cls(n_probe=n_probe, min_train_size=min_train_size)
+            index.vectors = data["vectors"]
+            index.ids = data["ids"]
+            index.centroids = data["centroids"] if len(data["centroids"]) else None
+            index.assignments = data["assignments"]
+            index.trained_size = trained_size
+            if "applied_segments" in data:
+                index.applied_segments = frozenset(data["applied_segments"].tolist())
+        index._build_lists()
+        return index
+
+
+# The saved index is a base file, rewritten only by compact_chunk_index and
+# rebuild_chunk_index, and a directory of small append-only segment files, each adding
+# or deleting a few chunks. Loading videos only writes segments, so it never rewrites the
+# base or retrains the index, and workers only reload the base after a compaction.
+_loaded = {"path": None, "mtime": None, "index": None}
+_loaded_lock = threading.Lock()
+
+
+@contextmanager
+def _index_lock(path, shared=False, suffix="lock"):
+    """
+    Hold a lock on the index file across worker processes.
+
+    Segments are written under a shared lock, so loads don't wait for each other, and the
+    base file is rewritten under an exclusive one. Segments are named under the exclusive
+    "segments.lock" lock.
+    """
+    with open(f"{path}.{suffix}", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _index_path():
+    """Return the configured index path, creating its directory if needed."""
+    path = current_app.config["VECTOR_INDEX_PATH"]
+    os.makedirs(_segment_dir(path), exist_ok=True)
+    return path
+
+
+def _segment_dir(path):
+    """Return the directory of the index's segment files."""
+    return f"{os.path.abspath(path)}.segments"
+
+
+def _segments(path, applied=frozenset()):
+    """Return the names of the segment files not in `applied`, oldest first."""
+    return sorted(
+        name
+        for name in os.listdir(_segment_dir(path))
+        if name.endswith(".npz") and name not in applied
+    )
+
+
+def _write_segment(path, ids=(), vectors=None, deleted=()):
+    """Atomically write a segment file adding and deleting chunks."""
+    ids = np.asarray(ids, dtype=np.int64)
+    with _index_lock(path, shared=True):
+        tmp_path = os.path.join(_segment_dir(path), f"{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                ids=ids,
+                vectors=np.zeros((0, 0), dtype=np.float32)
+                if vectors is None
+                else vectors,
+                deleted=np.asarray(deleted, dtype=np.int64),
+            )
+        # Segments are named once written, one at a time, so names sort in the order the
+        # segments appeared
+        with _index_lock(path, suffix="segments.lock"):
+            latest = max(_segments(path), default="0")
+            number = max(time.time_ns(), int(latest.split("-")[0]) + 1)
+            name = f"{number:020d}-{uuid.uuid4().hex}.npz"
+            os.replace(tmp_path, os.path.join(_segment_dir(path), name))
+
+
+def _apply_segments(index, path, names):
+    """
+    Return a copy of an index with segment files applied, or the index itself if there are none.
+
+    Raises:
+        FileNotFoundError: If a compaction removed a segment in the meantime.
+    """
+    if not names:
+        return index
+    deleted, ids, vectors = [], [], []
+    for name in names:
+        with np.load(os.path.join(_segment_dir(path), name)) as segment:
+            if len(segment["deleted"]):
+                # A deletion also applies to the chunks added by earlier segments
+                kept = [~np.isin(added, segment["deleted"]) for added in ids]
+                ids = [added[k] for added, k in zip(ids, kept)]
+                vectors = [added[k] for added, k in zip(vectors, kept)]
+                deleted.append(segment["deleted"])
+            if len(segment["ids"]):
+                ids.append(segment["ids"])
+                vectors.append(segment["vectors"])
+    index = index.copy()
+    if deleted:
+        index.remove(np.concatenate(deleted))
+    if ids:
+        index.add(np.concatenate(ids), np.vstack(vectors))
+    index.applied_segments = index.applied_segments.union(names)
+    return index
+
+
+def _save(index, path):
+    """Save the base file and remove the segment files folded into it."""
+    # Forget the segments removed by earlier saves
+    index.applied_segments = index.applied_segments.intersection(_segments(path))
+    index.save(path)
+    for name in index.applied_segments:
+        os.remove(os.path.join(_segment_dir(path), name))
+
+
+def _chunk_vectors(chunks):
+    """Return the ids and embeddings of the given chunks."""
+    chunks = [chunk for chunk in chunks if chunk.embedding]
+    if not chunks:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, 0), dtype=np.float32)
+    return (
+        np.array([chunk.id for chunk in chunks], dtype=np.int64),
+        np.vstack([chunk.vector for chunk in chunks]),
+    )
+
+
+def rebuild_chunk_index(batch_size=10000):
+    """
+    Build the index from every chunk in the database, train it and save it.
+
+    Returns:
+        IVFIndex: The rebuilt index.
+    """
+    path = _index_path()
+    with _index_lock(path):
+        # Every segment written so far describes chunks the database already has
+        segments = _segments(path)
+        index = IVFIndex()
+        query = TranscriptChunk.query.order_by(TranscriptChunk.id)
+        for offset in range(0, query.count(), batch_size):
+            ids, vectors = _chunk_vectors(query.offset(offset).limit(batch_size).all())
+            if len(ids):
+                index.add(ids, vectors)
+        if index.needs_training:
+            index.train()
+        index.applied_segments = frozenset(segments)
+        _save(index, path)
+    logging.info(f"Rebuilt the chunk index with {len(index)} chunks")
+    return index
+
+
+def compact_chunk_index(min_segments=1):
+    """
+    Fold the segment files into the base file, retraining the index if it needs it.
+
+    Run it from the transcription worker or the chunk-index command, never in a request.
+
+    Args:
+        min_segments (int, optional): The number of segments below which nothing is done.
+        Defaults to 1.
+
+    Returns:
+        IVFIndex or None: The compacted index, or None if there were too few segments.
+    """
+    path = _index_path()
+    if not os.path.exists(path):
+        return rebuild_chunk_index()
+    if len(_segments(path)) < min_segments:
+        return None
+    with _index_lock(path):
+        index = IVFIndex.load(path)
+        index = _apply_segments(
+            index, path, _segments(path, applied=index.applied_segments)
+        )
+        if index.needs_training:
+            index.train()
+        _save(index, path)
+    logging.info(f"Compacted the chunk index with {len(index)} chunks")
+    return index
+
+
+def get_chunk_index():
+    """
+    Return this worker's copy of the chunk index, with the segments written since it was loaded.
+
+    The base file is only reloaded after a compaction. The index is built from the database
+    the first time it is needed.
+
+    Returns:
+        IVFIndex: The chunk index.
+    """
+    path = _index_path()
+    if not os.path.exists(path):
+        rebuild_chunk_index()
+    with _loaded_lock:
+        for _ in range(3):
+            mtime = os.path.getmtime(path)
+            if _loaded["path"] != path or _loaded["mtime"] != mtime:
+                _loaded.update(path=path, mtime=mtime, index=IVFIndex.load(path))
+            index = _loaded["index"]
+            try:
+                # Apply every segment not applied yet, not only those named after the
+                # last one applied: a directory listing may miss a segment being renamed
+                names = _segments(path, applied=index.applied_segments)
+                _loaded["index"] = _apply_segments(index, path, names)
+                break
+            except FileNotFoundError:
+                # A compaction folded the segments into a new base file: reload it
+                _loaded["mtime"] = None
+        return _loaded["index"]
+
+
+def add_chunks_to_index(chunks):
+    """
+    Add newly stored chunks to the saved index, as a new segment.
+
+    Args:
+        chunks (list): The TranscriptChunk objects to add.
+    """
+    ids, vectors = _chunk_vectors(chunks)
+    if len(ids):
+        _write_segment(_index_path(), ids=ids, vectors=vectors)
+
+
+def remove_chunks_from_index(chunk_ids):
+    """
+    Remove deleted chunks from the saved index, as a new segment.
+
+    Args:
+        chunk_ids (list of int): The ids of the deleted chunks.
+    """
+    if len(chunk_ids):
+        _write_segment(_index_path(), deleted=chunk_ids)
@@ -7,6 +7,8 @@ import os
 import pandas as pd
 from flask import (
     Blueprint,
+    Response,
+    current_app,
     flash,
     jsonify,
     redirect,
@@ -14,10 +16,14 @@ from flask import (
     render_template_string,
     request,
     session,
+    stream_with_context,
     url_for,
 )
 from flask_login import login_required
 
+from riddle_me_this.locks import LockTimeout
+from riddle_me_this.user.jobs import TranscriptionPending
+from riddle_me_this.user.models import TranscriptionJob
 from riddle_me_this.user.services import *  # noqa
 from riddle_me_this.user.visualizations import *  # noqa
 
@@ -28,6 +34,7 @@ logging.basicConfig(
 )
 
 blueprint = Blueprint("user", __name__, url_prefix="/users", static_folder="../static")
+VIDEO_BUSY = "The video is still being loaded, please try again shortly."
 
 
 @blueprint.route("/")
@@ -92,7 +99,7 @@ def video_details():
         logging.info("POST request received")
         try:
             query = request.form["input_text"]
-            answer = get_response(text, query)  # noqa
+            answer = get_response(get_and_load_transcripts(video_id), query)  # noqa
         except Exception as e:  # noqa
             logging.error(e)
         try:
@@ -152,6 +159,223 @@ def video_details():
     )
 
 
+def server_sent_event(data, event=None):
+    """
+    Format data as a Server-Sent Event.
+
+    Args:
+        data (dict): The payload of the event, sent as JSON.
+        event (str, optional): The event type. Defaults to None, a plain message.
+
+    Returns:
+        str: The event in the text/event-stream format.
+    """
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+@blueprint.route("/video_details/answer_stream/")
+@login_required
+def answer_stream():
+    """
+    Stream the answer to a question about the submitted video as Server-Sent Events.
+
+    Every outcome is sent as events, since an EventSource can't read other responses: a
+    missing video or question is a single "error" event, and a transcript that is still
+    being produced is a single "pending" event with the state of its transcription job.
+
+    Query parameters:
+        input_text (str): The question.
+
+    Returns:
+        A text/event-stream response of answer tokens, ended by a "done" or "error" event.
+    """
+
+    def events():
+        if not (video_id := session.get("id_submitted")):
+            yield server_sent_event({"error": "No video submitted."}, event="error")
+            return
+        if not (query := request.args.get("input_text", "").strip()):
+            yield server_sent_event({"error": "No question given."}, event="error")
+            return
+        try:
+            transcript = get_and_load_transcripts(video_id)  # noqa
+            for token in stream_response(transcript, query):  # noqa
+                yield server_sent_event({"token": token})
+            yield server_sent_event({}, event="done")
+        except TranscriptionPending as e:
+            yield server_sent_event(e.job.to_dict(), event="pending")
+        except LockTimeout as e:
+            logging.warning(e)
+            yield server_sent_event({"error": VIDEO_BUSY}, event="error")
+        except Exception as e:  # noqa
+            logging.error(e)
+            yield server_sent_event(
+                {"error": "Failed to generate an answer."}, event="error"
+            )
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def batch_request_error(video_id, questions):
+    """
+    Check the video and questions of a batch answer request.
+
+    Args:
+        video_id (str): The YouTube video ID.
+        questions (list of str): The questions.
+
+    Returns:
+        str or None: What is wrong with the request, or None if it is valid.
+    """
+    if not video_id:
+        return "No video submitted."
+    if not isinstance(video_id, str) or not YOUTUBE_VIDEO_ID.match(video_id):  # noqa
+        return "Invalid video ID."
+    if not isinstance(questions, list) or not questions:
+        return "questions must be a list of non-empty strings."
+    if not all(isinstance(q, str) and q.strip() for q in questions):
+        return "questions must be a list of non-empty strings."
+    if len(questions) > (max_questions := current_app.config["QA_BATCH_MAX_QUESTIONS"]):
+        return f"At most {max_questions} questions per request."
+    return None
+
+
+@blueprint.route("/video_details/answers/", methods=["POST"])
+@login_required
+def batch_answers():
+    """
+    Answer a list of questions about one video.
+
+    JSON body:
+        questions (list of str): The questions, at most QA_BATCH_MAX_QUESTIONS of them.
+        video_id (str, optional): The YouTube video ID. Defaults to the submitted video.
+
+    Returns:
+        A JSON object with the video ID and each question with its answer, in the given order.
+        An invalid request is a 400 and a video YouTube doesn't know a 404, and while the
+        transcript is being produced the transcription job is returned with status 202.
+    """
+    payload = request.get_json(silent=True) or {}
+    video_id = payload.get("video_id") or session.get("id_submitted")
+    questions = payload.get("questions")
+    if error := batch_request_error(video_id, questions):
+        return jsonify({"error": error}), 400
+
+    try:
+        get_video_info(video_id)  # noqa
+    except ValueError:
+        return jsonify({"video_id": video_id, "error": "No such video."}), 404
+    except Exception as e:  # noqa
+        logging.error(e)
+        return jsonify({"video_id": video_id, "error": "Failed to answer."}), 500
+
+    try:
+        answers = get_responses(  # noqa
+            get_and_load_transcripts(video_id),  # noqa
+            [q.strip() for q in questions],
+            max_concurrency=current_app.config["QA_BATCH_CONCURRENCY"],
+        )
+    except (TranscriptionPending, LockTimeout):
+        raise
+    except Exception as e:  # noqa
+        logging.error(e)
+        return jsonify({"video_id": video_id, "error": "Failed to answer."}), 500
+    return jsonify(
+        {
+            "video_id": video_id,
+            "answers": [
+                {"question": question, "answer": answer}
+                for question, answer in zip(questions, answers)
+            ],
+        }
+    )
+
+
+@blueprint.errorhandler(TranscriptionPending)
+def transcription_pending(error):
+    """
+    Report the progress of the transcription that a request is waiting for.
+
+    Args:
+        error (TranscriptionPending): The error carrying the transcription job.
+
+    Returns:
+        The processing page for the video details page, or the job's state as JSON
+        with status 202 for API requests.
+    """
+    if request.endpoint == "user.video_details":
+        return render_template("users/video_processing.html", job=error.job)
+    return jsonify(error.job.to_dict()), 202
+
+
+@blueprint.errorhandler(LockTimeout)
+def video_busy(error):
+    """
+    Ask the client to come back later when another request has been loading the video for too long.
+
+    Args:
+        error (LockTimeout): The error naming the lock.
+
+    Returns:
+        The 503 error page for the video details page, or the error as JSON with status 503
+        for API requests, with a Retry-After header.
+    """
+    logging.warning(error)
+    headers = {"Retry-After": "30"}
+    if request.endpoint == "user.video_details":
+        return render_template("503.html"), 503, headers
+    return jsonify({"error": VIDEO_BUSY}), 503, headers
+
+
+@blueprint.route("/transcription_jobs/<int:job_id>/")
+@login_required
+def transcription_job(job_id):
+    """
+    Report the state of a transcription job.
+
+    Args:
+        job_id (int): The ID of the job.
+
+    Returns:
+        A JSON object with the job's status, attempts and error, if any.
+    """
+    if not (job := TranscriptionJob.get_by_id(job_id)):
+        return jsonify({"error": "No such job."}), 404
+    return jsonify(job.to_dict())
+
+
+@blueprint.route("/search/")
+@login_required
+def search():
+    """
+    Search the transcripts of every stored video.
+
+    Query parameters:
+        q (str): The text to search for.
+        limit (int): The maximum number of videos to return. Defaults to 10.
+
+    Returns:
+        A JSON object with the query and the best-matching videos and passages.
+    """
+    query = request.args.get("q", "").strip()
+    limit = request.args.get("limit", 10, type=int)
+    results = []
+    if query:
+        try:
+            results = search_transcripts(  # noqa
+                query, max_videos=max(1, min(limit, 50))
+            )
+        except Exception as e:  # noqa
+            logging.error(e)
+            return jsonify({"query": query, "error": "Search failed."}), 500
+    return jsonify({"query": query, "results": results})
+
+
 def seconds_to_youtube_time(seconds):
     """
     Convert seconds to YouTube timestamp format.
@@ -10,6 +10,8 @@ from sklearn.cluster import KMeans
 from sklearn.metrics import silhouette_score
 from spacy.cli import download
 
+from riddle_me_this.registry import model_registry
+
 
 def download_stanza_pipeline(lang):
     """
@@ -30,6 +32,19 @@ def download_stanza_pipeline(lang):
     return nlp
 
 
+def get_stanza_pipeline(lang="en"):
+    """
+    Return the process-wide Stanza pipeline for a given language.
+
+    Args:
+        lang (str, optional): The language of the pipeline. Defaults to "en".
+
+    Returns:
+        stanza.Pipeline: The shared pipeline.
+    """
+    return model_registry.get(f"stanza:{lang}", lambda: download_stanza_pipeline(lang))
+
+
 def visualize_and_save(G, important_entities=None, file_name="graph.html"):  # noqa
     """
     Visualize a clustered graph and save it to a file.
@@ -84,7 +99,7 @@ class CoOccurrenceVisualizer:
         Args:
             lang (str, optional): The language of the text. Defaults to "en".
         """
-        self.nlp = download_stanza_pipeline(lang)
+        self.nlp = get_stanza_pipeline(lang)
 
     def perform_ner(self, text):
         """
@@ -185,6 +200,19 @@ def download_en_core_web_(model="en_core_web_sm"):
     return nlp
 
 
+def get_en_core_web_(model="en_core_web_sm"):
+    """
+    Return the process-wide English core web pipeline for Spacy.
+
+    Args:
+    model (str, optional): The name of the Spacy model. Defaults to "en_core_web_sm".
+
+    Returns:
+        spacy.language.Language: The shared Spacy pipeline.
+    """
+    return model_registry.get(f"spacy:{model}", lambda: download_en_core_web_(model))
+
+
 class EntityClusterVisualizer:
     """
     A class for visualizing clusters of named entities in a text.
@@ -214,8 +242,8 @@ class EntityClusterVisualizer:
         Returns:
             tuple: A tuple containing the downloaded Stanza and Spacy pipelines.
         """
-        nlp_stanza = download_stanza_pipeline("en")
-        nlp_spacy = download_en_core_web_()
+        nlp_stanza = get_stanza_pipeline(lang)
+        nlp_spacy = get_en_core_web_()
         return nlp_stanza, nlp_spacy
 
     def perform_ner(self, text):
@@ -0,0 +1,207 @@
+"""Transcription with the OpenAI Whisper API, for audio of any length."""
+import csv
+import math
+import os
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from flask import current_app
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from whisper.audio import SAMPLE_RATE
+
+from riddle_me_this.user.transcription import stitch_transcriptions
+
+
+def audio_duration(path):
+    """
+    Return the duration of an audio file in seconds, as reported by ffprobe.
+
+    Args:
+        path (str): The location of the audio file.
+
+    Returns:
+        float: The duration of the audio.
+    """
+    output = subprocess.run(
+        [
+            "ffprobe",
+            "-v",
+            "error",
+            "-show_entries",
+            "format=duration",
+            "-of",
+            "csv=p=0",
+            path,
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return float(output.strip())
+
+
+def split_audio_file(path, directory, max_bytes, max_attempts=3):
+    """
+    Split an audio file into parts of at most `max_bytes`, without re-encoding it.
+
+    The parts are cut by ffmpeg at packet boundaries, so they are aimed 10% below the
+    budget; if one is still too big, the file is split again into more parts.
+
+    Args:
+        path (str): The location of the audio file.
+        directory (str): The directory the parts are written to.
+        max_bytes (int): The maximum size of a part.
+        max_attempts (int, optional): How many times to split before giving up. Defaults to 3.
+
+    Returns:
+        list of tuple: The location of each part and the second it starts at, in order.
+
+    Raises:
+        ValueError: If a part is still bigger than `max_bytes` after `max_attempts` splits.
+    """
+    size = os.path.getsize(path)
+    if size <= max_bytes:
+        return [(path, 0.0)]
+    extension = os.path.splitext(path)[1]
+    duration = audio_duration(path)
+    n_parts = math.ceil(size / (0.9 * max_bytes))
+    for attempt in range(max_attempts):
+        part_directory = os.path.join(directory, str(attempt))
+        os.makedirs(part_directory)
+        list_path = os.path.join(part_directory, "parts.csv")
+        command = ["ffmpeg", "-nostdin", "-v", "error", "-i", path]
+        command += ["-map", "0:a", "-c", "copy"]
+        command += ["-f", "segment", "-segment_time", f"{duration / n_parts:.3f}"]
+        command += ["-segment_list", list_path, "-segment_list_type", "csv"]
+        command += ["-reset_timestamps", "1"]
+        command.append(os.path.join(part_directory, f"part%04d{extension}"))
+        subprocess.run(command, check=True)
+        with open(list_path, newline="") as f:
+            parts = [
+                (os.path.join(part_directory, name), float(start))
+                for name, start, _ in csv.reader(f)
+            ]
+        if all(os.path.getsize(part) <= max_bytes for part, _ in parts):
+            return parts
+        n_parts *= 2
+    raise ValueError(f"Could not split {path} into parts of at most {max_bytes} bytes")
+
+
+def make_session(pool_size):
+    """
+    Build an HTTP session whose connections are reused across uploads.
+
+    Uploads rejected for rate limiting or by a server error are retried with backoff, and so
+    are connections that fail before anything is sent. An upload whose response times out
+    isn't retried, since the API may still transcribe, and bill, the first one.
+
+    Args:
+        pool_size (int): The number of connections kept open to the API.
+
+    Returns:
+        requests.Session: The session.
+    """
+    retry = Retry(
+        total=3,
+        connect=3,
+        read=0,
+        other=0,
+        status=3,
+        backoff_factor=1,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=None,
+    )
+    adapter = HTTPAdapter(pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def transcribe_part(session, path, api_base, api_key, model="whisper-1", timeout=600):
+    """
+    Upload one audio file to the transcription endpoint.
+
+    requests builds the multipart body in memory, which split_audio_file keeps under
+    WHISPER_API_MAX_BYTES.
+
+    Args:
+        session (requests.Session): The session to upload with.
+        path (str): The location of the audio file.
+        api_base (str): The base URL of the API, e.g. "https://api.openai.com/v1".
+        api_key (str): The API key.
+        model (str, optional): The transcription model. Defaults to "whisper-1".
+        timeout (float, optional): The seconds to wait for the response. Defaults to 600.
+
+    Returns:
+        dict: The verbose JSON transcription, with its text and timed segments.
+    """
+    with open(path, "rb") as f:
+        response = session.post(
+            f"{api_base.rstrip('/')}/audio/transcriptions",
+            headers={"Authorization": f"Bearer {api_key}"},
+            data={"model": model, "response_format": "verbose_json"},
+            files={"file": (os.path.basename(path), f)},
+            timeout=timeout,
+        )
+    response.raise_for_status()
+    return response.json()
+
+
+def transcribe_parts(paths, api_base, api_key, concurrency=4):
+    """
+    Upload audio files to the transcription endpoint, at most `concurrency` at a time.
+
+    Args:
+        paths (list of str): The locations of the audio files.
+        api_base (str): The base URL of the API.
+        api_key (str): The API key.
+        concurrency (int, optional): The maximum number of uploads in flight. Defaults to 4.
+
+    Returns:
+        list of dict: The transcription of each file, in order.
+    """
+    with make_session(concurrency) as session, ThreadPoolExecutor(
+        max_workers=concurrency
+    ) as executor:
+        return list(
+            executor.map(
+                lambda path: transcribe_part(session, path, api_base, api_key), paths
+            )
+        )
+
+
+def transcribe_audio_file(path):
+    """
+    Transcribe an audio file of any size with the Whisper API.
+
+    The file is split into parts under the WHISPER_API_MAX_BYTES upload limit, which are
+    uploaded WHISPER_API_CONCURRENCY at a time, and their segments are moved to their
+    place in the full audio.
+
+    Args:
+        path (str): The location of the audio file.
+
+    Returns:
+        dict: A result shaped like whisper.transcribe()'s.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        parts = split_audio_file(
+            path, directory, current_app.config["WHISPER_API_MAX_BYTES"]
+        )
+        results = transcribe_parts(
+            [part for part, _ in parts],
+            current_app.config["WHISPER_API_BASE"],
+            os.getenv("OPENAI_API_KEY"),
+            concurrency=current_app.config["WHISPER_API_CONCURRENCY"],
+        )
+    # The API strips the text of each part, so put back the space between them
+    results = [dict(result, text=f" {result['text'].strip()}") for result in results]
+    transcription = stitch_transcriptions(
+        results, [int(start * SAMPLE_RATE) for _, start in parts]
+    )
+    transcription["text"] = transcription["text"].strip()
+    return transcription
@@ -0,0 +1,121 @@
+"""YouTube Data API clients sharing one discovery document and one pool of connections per process."""
+import functools
+import json
+import os
+import queue
+
+import httplib2
+from flask import current_app
+from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build_from_document
+
+DISCOVERY_URL = "https://www.googleapis.com/discovery/v1/apis/{api}/{version}/rest"
+
+
+class HttpPool:
+    """
+    A pool of httplib2.Http objects that can be used as one.
+
+    httplib2.Http isn't thread safe, so each request borrows an idle Http, or a new one if
+    none is idle, and returns it afterwards. Their connections stay open between requests,
+    so API calls from the same worker don't pay for a new TLS handshake each time.
+
+    Attributes:
+        timeout (float): The socket timeout of the pooled Http objects.
+    """
+
+    def __init__(self, timeout=60):
+        """
+        Initialize an empty HttpPool.
+
+        Args:
+            timeout (float, optional): The socket timeout in seconds. Defaults to 60.
+        """
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+
+    def request(self, *args, **kwargs):
+        """Make a request with an idle Http object, taking the arguments of httplib2.Http.request."""
+        try:
+            http = self._idle.get_nowait()
+        except queue.Empty:
+            http = httplib2.Http(timeout=self.timeout)
+        try:
+            return http.request(*args, **kwargs)
+        finally:
+            self._idle.put(http)
+
+    def close(self):
+        """Close the connections of the idle Http objects."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+http_pool = HttpPool()
+
+
+@functools.lru_cache(maxsize=None)
+def get_discovery_document(api="youtube", version="v3"):
+    """
+    Return the parsed discovery document of an API, read at most once per process.
+
+    The document bundled with googleapiclient is used when there is one. Otherwise it
+    is downloaded once into DISCOVERY_CACHE_DIR and read from there afterwards.
+
+    Args:
+        api (str, optional): The name of the API. Defaults to "youtube".
+        version (str, optional): The version of the API. Defaults to "v3".
+
+    Returns:
+        dict: The discovery document.
+    """
+    document = discovery_cache.get_static_doc(api, version)
+    if document is None:
+        directory = current_app.config["DISCOVERY_CACHE_DIR"]
+        path = os.path.join(directory, f"{api}.{version}.json")
+        if os.path.exists(path):
+            with open(path) as f:
+                document = f.read()
+        else:
+            response, content = http_pool.request(
+                DISCOVERY_URL.format(api=api, version=version)
+            )
+            if response.status != 200:
+                raise RuntimeError(
+                    f"Failed to fetch the {api} {version} discovery document"
+                )
+            document = content.decode("utf-8")
+            os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(document)
+            os.replace(tmp_path, path)
+    return json.loads(document)
+
+
+def build_youtube_service(access_token=None, api_key=None):
+    """
+    Build a YouTube Data API client acting with an access token or an API key.
+
+    Building from the cached discovery document takes no network call, and the client's
+    requests go through the process's connection pool: only the credentials are new.
+
+    Args:
+        access_token (str, optional): The Google access token of a user.
+        api_key (str, optional): An API key, for public data when no user is signed in.
+
+    Returns:
+        googleapiclient.discovery.Resource: The YouTube client.
+    """
+    if access_token:
+        http = AuthorizedHttp(Credentials(access_token), http=http_pool)
+    else:
+        http = http_pool
+    return build_from_document(
+        get_discovery_document("youtube", "v3"), http=http, developerKey=api_key
+    )
@@ -1,4 +1,7 @@
 """Settings module for test app."""
+import os
+import tempfile
+
 ENV = "development"
 TESTING = True
 SQLALCHEMY_DATABASE_URI = "sqlite://"
@@ -10,3 +13,33 @@ DEBUG_TB_ENABLED = False
 CACHE_TYPE = "simple"  # Can be "memcached", "redis", etc.
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 WTF_CSRF_ENABLED = False  # Allows form testing
+ANSWER_CACHE_MAX_ENTRIES = 3
+ANSWER_CACHE_TTL = 60
+SEMANTIC_CACHE_THRESHOLD = 0.9
+SEMANTIC_CACHE_MIN_TERM_OVERLAP = 0.0
+VECTOR_INDEX_PATH = os.path.join(tempfile.mkdtemp(), "chunk_index.npz")
+VECTOR_INDEX_COMPACT_SEGMENTS = 2
+QA_BATCH_MAX_QUESTIONS = 5
+QA_BATCH_CONCURRENCY = 2
+WHISPER_MODEL_SIZE = "tiny"
+WHISPER_QUANTIZE = False
+TRANSCRIPTION_MAX_ATTEMPTS = 2
+TRANSCRIPTION_RETRY_DELAY = 30
+TRANSCRIPTION_JOB_TIMEOUT = 60
+TRANSCRIPTION_WORKERS = 1
+WHISPER_WORKERS = 1
+WHISPER_SEGMENT_SECONDS = 300
+WHISPER_VAD = False
+LOCK_DIR = os.path.join(tempfile.mkdtemp(), "locks")
+SINGLE_FLIGHT_TIMEOUT = 5
+AUDIO_CACHE_DIR = os.path.join(tempfile.mkdtemp(), "audio_cache")
+AUDIO_CACHE_MAX_BYTES = 100
+WHISPER_API_BASE = "http://localhost/v1"
+WHISPER_API_MAX_BYTES = 24 * 2**20
+WHISPER_API_CONCURRENCY = 2
+GOOGLE_TOKEN_URL = "http://localhost/token"
+GOOGLE_TOKEN_REFRESH_MARGIN = 300
+DISCOVERY_CACHE_DIR = os.path.join(tempfile.mkdtemp(), "discovery")
+TRANSCRIPT_EAGER_LANGUAGES = False
+TRANSCRIPT_FETCH_WORKERS = 2
+YOUTUBE_API_KEY = None
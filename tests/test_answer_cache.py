@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""Answer cache unit tests."""
+import datetime as dt
+
+import pytest
+
+from riddle_me_this.user.answer_cache import (
+    AnswerCache,
+    get_answer_cache,
+    normalize_question,
+    term_overlap,
+)
+from riddle_me_this.user.models import (
+    CachedAnswer,
+    SemanticCacheHit,
+    StatCounter,
+    Transcript,
+)
+from riddle_me_this.user.vector_index import normalize_rows
+
+PARAMS = {"model_name": "text-davinci-003", "temperature": 0.9, "max_tokens": 256}
+
+
+def test_normalize_question():
+    """Case, whitespace and trailing punctuation don't matter."""
+    assert normalize_question("  Who is   the Speaker?? ") == "who is the speaker"
+
+
+def test_term_overlap():
+    """Questions are compared by their content terms only."""
+    assert term_overlap("Who is the speaker?", "the speaker is who") == 1.0
+    assert term_overlap("Who is the speaker?", "Who is the host?") == 0.0
+    assert term_overlap("Speaker and host?", "Who is the host?") == 0.5
+    assert term_overlap("Who is it?", "What is it?") == 1.0
+
+
+PARAPHRASES = [
+    ("Who is the speaker?", "Who's the speaker"),
+    ("What is this video about?", "What's the video about?"),
+    (
+        "What does the speaker say about climate change?",
+        "What does the speaker think about climate change?",
+    ),
+    (
+        "How does the speaker define machine learning?",
+        "How is machine learning defined by the speaker?",
+    ),
+]
+DIFFERENT_QUESTIONS = [
+    ("Who is the speaker?", "When was the video recorded?"),
+    ("What is this video about?", "How many people were in the audience?"),
+    (
+        "Which programming languages are mentioned?",
+        "What did the speaker eat for breakfast?",
+    ),
+]
+
+
+def test_semantic_threshold_is_calibrated(app):
+    """The configured threshold matches paraphrases and tells different questions apart."""
+    pytest.importorskip("en_core_web_md")
+    from riddle_me_this.user.data_loading import embed_texts
+
+    def similarity(pair):
+        first, second = normalize_rows(embed_texts(list(pair)))
+        return float(first @ second)
+
+    threshold = app.config["SEMANTIC_CACHE_THRESHOLD"]
+    assert min(map(similarity, PARAPHRASES)) >= threshold
+    assert max(map(similarity, DIFFERENT_QUESTIONS)) < threshold
+
+
+@pytest.mark.usefixtures("db")
+class TestAnswerCache:
+    """AnswerCache tests."""
+
+    @pytest.fixture
+    def transcript(self):
+        """A stored transcript to ask questions about."""
+        return Transcript.create(video_id="abc", text="some text")
+
+    def test_hit_and_miss(self, transcript):
+        """Only the same transcript, question, context and parameters hit."""
+        cache = get_answer_cache()
+        assert cache.get(transcript.id, "Who?", "ctx", PARAMS) is None
+        cache.set(transcript.id, "Who?", "ctx", PARAMS, "Guido")
+
+        assert cache.get(transcript.id, "who", "ctx", PARAMS) == "Guido"
+        assert cache.get(transcript.id, "who", "other ctx", PARAMS) is None
+        cold = {**PARAMS, "temperature": 0}
+        assert cache.get(transcript.id, "who", "ctx", cold) is None
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"], stats["size"]) == (1, 3, 1)
+
+    def test_ttl(self, transcript):
+        """Expired entries are misses."""
+        cache = AnswerCache(ttl=60)
+        cache.set(transcript.id, "q", "ctx", PARAMS, "a")
+        entry = CachedAnswer.query.one()
+        entry.update(created_at=dt.datetime.utcnow() - dt.timedelta(seconds=61))
+        assert cache.get(transcript.id, "q", "ctx", PARAMS) is None
+        assert CachedAnswer.query.count() == 0
+
+    def test_lru_eviction(self, transcript):
+        """The least recently used entries are evicted above the size cap."""
+        cache = AnswerCache(max_entries=2)
+        cache.set(transcript.id, "first", "ctx", PARAMS, "1")
+        cache.set(transcript.id, "second", "ctx", PARAMS, "2")
+        for entry, minutes in zip(CachedAnswer.query.order_by(CachedAnswer.id), (2, 1)):
+            entry.update(
+                last_used_at=dt.datetime.utcnow() - dt.timedelta(minutes=minutes)
+            )
+        assert cache.get(transcript.id, "first", "ctx", PARAMS) == "1"
+        cache.set(transcript.id, "third", "ctx", PARAMS, "3")
+
+        assert cache.get(transcript.id, "second", "ctx", PARAMS) is None
+        assert cache.get(transcript.id, "first", "ctx", PARAMS) == "1"
+        assert StatCounter.values("answer_cache.")["answer_cache.evictions"] == 1
+
+    def test_semantic_hit_is_audited(self, transcript):
+        """A reworded question reuses a cached answer, and the hit is audited."""
+        cache = AnswerCache(similarity_threshold=0.9)
+        cache.set(transcript.id, "Who is the speaker?", "ctx", PARAMS, "Guido", [1, 0])
+
+        assert cache.get_similar(transcript.id, "Who's talking?", [1, 0.1], PARAMS)
+        assert cache.get_similar(transcript.id, "Speaker?", [0, 1], PARAMS) is None
+        assert cache.get_similar(transcript.id, "Who's the speaker", [1, 0], {}) is None
+
+        (hit,) = SemanticCacheHit.query.all()
+        assert hit.question == "Who's talking?"
+        assert hit.matched_question == "Who is the speaker?"
+        assert hit.similarity > 0.99
+        stats = cache.stats()
+        assert (stats["semantic_hits"], stats["semantic_misses"]) == (1, 2)
+
+    def test_min_term_overlap(self, transcript):
+        """With a term overlap set, only questions sharing enough content terms match."""
+        cache = AnswerCache(similarity_threshold=0.9, min_term_overlap=0.5)
+        cache.set(transcript.id, "Who is the speaker?", "ctx", PARAMS, "Guido", [1, 0])
+
+        assert cache.get_similar(transcript.id, "the speaker is who", [1, 0], PARAMS)
+        assert (
+            cache.get_similar(transcript.id, "Who is the host?", [1, 0], PARAMS) is None
+        )
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""Audio cache unit tests."""
+import os
+import time
+
+import pytest
+
+from riddle_me_this.user.audio_cache import get_audio_cache
+
+
+@pytest.mark.usefixtures("db")
+class TestAudioCache:
+    """AudioCache tests."""
+
+    @pytest.fixture
+    def cache(self, tmp_path):
+        """An empty audio cache with no eviction grace period."""
+        cache = get_audio_cache()
+        cache.directory = str(tmp_path / "cache")
+        cache.grace_seconds = 0
+        return cache
+
+    @staticmethod
+    def download(tmp_path, name, size=40):
+        """Write a fake downloaded audio file."""
+        path = tmp_path / name
+        path.write_bytes(b"x" * size)
+        return str(path)
+
+    def test_hit_and_miss(self, cache, tmp_path):
+        """Only the same video and format hit, and the file keeps its extension."""
+        assert cache.get("abc", "bestaudio") is None
+        path = cache.put("abc", "bestaudio", self.download(tmp_path, "abc.webm"))
+        assert path.endswith(".webm") and os.path.exists(path)
+        assert not os.path.exists(tmp_path / "abc.webm")
+
+        assert cache.get("abc", "bestaudio") == path
+        assert cache.get("abc", "worstaudio") is None
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"], stats["files"]) == (1, 2, 1)
+        assert stats["hit_rate"] == pytest.approx(1 / 3)
+
+    def test_lru_eviction(self, cache, tmp_path):
+        """The least recently used files go once the byte budget is exceeded."""
+        first = cache.put("a", "f", self.download(tmp_path, "a.m4a"))
+        second = cache.put("b", "f", self.download(tmp_path, "b.m4a"))
+        old = time.time() - 60
+        os.utime(first, (old, old))
+        os.utime(second, (old - 1, old - 1))
+        cache.get("a", "f")
+
+        cache.put("c", "f", self.download(tmp_path, "c.m4a"))
+        assert cache.get("b", "f") is None
+        assert cache.get("a", "f") and cache.get("c", "f")
+        stats = cache.stats()
+        assert (stats["evictions"], stats["bytes"]) == (1, 80)
+
+    def test_grace_period(self, cache, tmp_path):
+        """Recently used files are kept even over budget."""
+        cache.grace_seconds = 600
+        for name in "abc":
+            cache.put(name, "f", self.download(tmp_path, f"{name}.m4a"))
+        assert cache.stats()["files"] == 3
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""Data loading unit tests."""
+import re
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from riddle_me_this.registry import model_registry
+from riddle_me_this.user import data_loading
+from riddle_me_this.user.data_loading import iter_chunks, pack_context, split_text
+from riddle_me_this.user.models import Transcript, TranscriptChunk
+
+
+class TestIterChunks:
+    """iter_chunks tests."""
+
+    def test_split_text_without_overlap(self):
+        """Chunks hold at most chunks_size words, with no empty trailing chunk."""
+        text = " ".join(str(i) for i in range(10))
+        assert split_text(text, chunks_size=5) == ["0 1 2 3 4", "5 6 7 8 9"]
+        assert split_text(text, chunks_size=4) == ["0 1 2 3", "4 5 6 7", "8 9"]
+        assert split_text("   ", chunks_size=4) == []
+
+    def test_overlap_and_offsets(self):
+        """Overlapping chunks share words and point back into the original text."""
+        text = "a  bb\nccc d e"
+        chunks = list(iter_chunks(text, chunks_size=3, overlap=1))
+        assert [chunk.text for chunk in chunks] == ["a bb ccc", "ccc d e"]
+        first, second = chunks
+        assert text[first.start_char : first.end_char] == "a  bb\nccc"  # noqa: E203
+        assert text[second.start_char : second.end_char] == "ccc d e"  # noqa: E203
+
+    def test_invalid_overlap(self):
+        """Overlap must leave room for new words in every chunk."""
+        with pytest.raises(ValueError):
+            list(iter_chunks("a b c", chunks_size=2, overlap=2))
+
+
+def test_top_k_order_matches_full_sort():
+    """The top k of the mixed scores come in the order of a stable full sort."""
+    scores = np.random.default_rng(0).random(200).astype(np.float32)
+    scores[[3, 50, 120]] = 2.0
+    full = np.argsort(-scores, kind="stable")
+    assert data_loading._top_k_order(scores, 8).tolist() == full[:8].tolist()
+    assert data_loading._top_k_order(scores, 500).tolist() == full.tolist()
+    assert data_loading._top_k_order(scores).tolist() == full.tolist()
+
+
+class WordEncoding:
+    """A stand-in tokenizer that counts one token per word."""
+
+    @staticmethod
+    def encode(text):
+        """Split text into words."""
+        return text.split()
+
+    @staticmethod
+    def decode(tokens):
+        """Join words back into text."""
+        return " ".join(tokens)
+
+
+class TestPackContext:
+    """pack_context tests."""
+
+    text = " ".join(f"w{i}" for i in range(30))
+
+    def chunks(self, spans):
+        """Make chunks covering the given ranges of words of the text."""
+        words = list(re.finditer(r"\S+", self.text))
+        chunks = [
+            TranscriptChunk(
+                text=" ".join(word.group() for word in words[start:end]),
+                start_char=words[start].start(),
+                end_char=words[end - 1].end(),
+            )
+            for start, end in spans
+        ]
+        return Transcript(text=self.text), chunks
+
+    def test_keeps_transcript_order_and_dedupes_overlap(self):
+        """Overlapping chunks are merged and passages follow the transcript."""
+        transcript, chunks = self.chunks([(20, 25), (0, 5), (3, 8)])
+        context = pack_context(transcript, chunks, 100, WordEncoding())
+        assert context == ("w0 w1 w2 w3 w4 w5 w6 w7\n...\nw20 w21 w22 w23 w24")
+
+    def test_respects_budget(self):
+        """Chunks that don't fit are skipped for later ones that do."""
+        transcript, chunks = self.chunks([(0, 5), (10, 20), (25, 27)])
+        context = pack_context(transcript, chunks, 10, WordEncoding())
+        assert context == "w0 w1 w2 w3 w4\n...\nw25 w26"
+
+    def test_truncates_oversized_first_chunk(self):
+        """A first chunk larger than the budget is cut to fit."""
+        transcript, chunks = self.chunks([(0, 20)])
+        assert pack_context(transcript, chunks, 3, WordEncoding()) == "w0 w1 w2"
+
+
+class FakeLLM:
+    """A stand-in language model that echoes the question and records its concurrency."""
+
+    model_name = "fake"
+    temperature = 0.9
+    max_tokens = 16
+    lock = threading.Lock()
+    running = 0
+    max_running = 0
+
+    def __init__(self, **kwargs):
+        """Accept the OpenAI constructor's arguments."""
+
+    @staticmethod
+    def modelname_to_contextsize(model_name):
+        """Return a small context size."""
+        return 1000
+
+    def __call__(self, prompt):
+        """Answer with the last line of the prompt."""
+        with self.lock:
+            FakeLLM.running += 1
+            FakeLLM.max_running = max(FakeLLM.max_running, FakeLLM.running)
+        time.sleep(0.02)
+        with self.lock:
+            FakeLLM.running -= 1
+        if "fail" in prompt:
+            raise RuntimeError("model error")
+        return prompt.strip().splitlines()[-1]
+
+
+@pytest.mark.usefixtures("db")
+class TestGetResponses:
+    """get_responses tests."""
+
+    @pytest.fixture
+    def transcript(self, monkeypatch):
+        """A transcript whose questions are embedded and ranked without spaCy."""
+        transcript = Transcript.create(video_id="abc", text="w0 w1 w2")
+        chunk = TranscriptChunk(text="w0 w1 w2", start_char=0, end_char=8)
+        embedded = []
+
+        def embed_texts(texts):
+            embedded.append(list(texts))
+            return np.eye(len(texts), 8, dtype=np.float32)
+
+        monkeypatch.setattr(data_loading, "OpenAI", FakeLLM)
+        monkeypatch.setattr(data_loading, "embed_texts", embed_texts)
+        monkeypatch.setattr(
+            data_loading,
+            "rank_chunks_batch",
+            lambda transcript, phrases, **kwargs: [([chunk], [1.0])] * len(phrases),
+        )
+        monkeypatch.setattr(
+            data_loading, "get_token_encoding", lambda model_name: WordEncoding()
+        )
+        transcript.embedded = embedded
+        return transcript
+
+    def test_answers_in_order_with_bounded_concurrency(self, transcript):
+        """Questions are embedded in one pass and answered in order, two at a time."""
+        FakeLLM.max_running = 0
+        questions = [f"question {i}" for i in range(6)]
+        answers = data_loading.get_responses(transcript, questions, max_concurrency=2)
+        assert all(
+            answer.endswith(f"{question}?")
+            for question, answer in zip(questions, answers)
+        )
+        assert transcript.embedded == [questions]
+        assert FakeLLM.max_running == 2
+
+    def test_failures_and_cache(self, transcript):
+        """A failed call gives None and answered questions are cached."""
+        assert data_loading.get_responses(transcript, ["ok?", "fail?"])[1] is None
+        assert data_loading.get_answer_cache().stats()["size"] == 1
+
+
+class TestAddPunctuationBatch:
+    """add_punctuation_batch tests."""
+
+    @pytest.fixture
+    def windows(self):
+        """Register a fake silero_te that capitalizes and ends each window."""
+        windows = []
+
+        def apply_te(text, lan):
+            windows.append(text)
+            return f"{text[0].upper()}{text[1:]}[UNK]."
+
+        model_registry.get("silero_te", lambda: apply_te)
+        yield windows
+        model_registry.unload("silero_te")
+
+    def test_windows_are_bounded_and_joined_in_order(self, windows):
+        """Every text is split into bounded windows and reassembled in order."""
+        texts = [" ".join(f"w{i}" for i in range(7)), "short one", ""]
+        punctuated = data_loading.add_punctuation_batch(
+            texts, window_words=3, max_workers=3
+        )
+        assert punctuated == ["W0 w1 w2. W3 w4 w5. W6.", "Short one.", ""]
+        assert sorted(len(window.split()) for window in windows) == [1, 2, 3, 3]
+
+    def test_continued_sentence_is_not_capitalized(self, windows, monkeypatch):
+        """A window continuing an unfinished sentence keeps its first letter lowercase."""
+        monkeypatch.setattr(
+            data_loading, "_punctuate_window", lambda apply_te, window: window.title()
+        )
+        assert data_loading.add_punctuation_batch(["a b c d"], window_words=2) == [
+            "A B c D"
+        ]
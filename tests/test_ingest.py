@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""Bulk ingestion unit tests."""
+import time
+
+import pytest
+
+from riddle_me_this.user import ingest, services
+from riddle_me_this.user.models import Transcript, TranscriptionJob
+
+from .test_services import FakeYoutube
+
+
+class FakePlaylistItems:
+    """Stands in for the YouTube client's playlistItems, serving 120 videos 50 per page."""
+
+    def __init__(self):
+        """Start without calls."""
+        self.pages = 0
+        self.start = None
+
+    def playlistItems(self):
+        """Return the playlistItems resource."""
+        return self
+
+    def list(self, part, playlistId, maxResults):
+        """Request the first page."""
+        self.start = 0
+        return self
+
+    def list_next(self, request, response):
+        """Request the next page, if there is one."""
+        self.start += 50
+        return self if self.start < 120 else None
+
+    def execute(self):
+        """Return the requested page."""
+        self.pages += 1
+        return {
+            "items": [
+                {"contentDetails": {"videoId": f"v{i}"}}
+                for i in range(self.start, min(self.start + 50, 120))
+            ]
+        }
+
+
+def test_rate_limiter_spaces_calls():
+    """Calls are spaced by the limiter's interval, and unlimited without a rate."""
+    limiter = ingest.RateLimiter(50)
+    started = time.monotonic()
+    for _ in range(5):
+        limiter.wait()
+    assert time.monotonic() - started >= 0.079
+    assert ingest.RateLimiter(0).interval == 0
+
+
+def test_read_video_ids_and_playlist_links():
+    """Video IDs are read from IDs or links, and playlist IDs from links."""
+    lines = ["dQw4w9WgXcQ\n", "\n", "# a comment\n", "https://youtu.be/9bZkp7q19f0\n"]
+    assert list(ingest.read_video_ids(lines)) == ["dQw4w9WgXcQ", "9bZkp7q19f0"]
+    link = "https://www.youtube.com/playlist?list=PL123"
+    assert ingest.playlist_id_from(link) == "PL123"
+    assert ingest.playlist_id_from("PL123") == "PL123"
+
+
+def test_playlist_video_ids_pages_through_the_playlist():
+    """Every page of the playlist is listed, one call per 50 videos."""
+    youtube = FakePlaylistItems()
+    limiter = ingest.RateLimiter()
+    video_ids = list(ingest.playlist_video_ids(youtube, "PL123", limiter))
+    assert video_ids == [f"v{i}" for i in range(120)]
+    assert youtube.pages == 3
+
+
+@pytest.mark.usefixtures("db")
+class TestIngestion:
+    """Ingestion tests."""
+
+    @pytest.fixture
+    def youtube(self, monkeypatch):
+        """Fake the YouTube client, captions for even videos and loading transcripts."""
+        youtube = FakeYoutube()
+        monkeypatch.setattr(services, "get_youtube_service", lambda: youtube)
+        monkeypatch.setattr(
+            services,
+            "get_transcripts",
+            lambda video_id, language_codes: (
+                [{"language_code": "en", "is_generated": False}]
+                if int(video_id[1:]) % 2 == 0
+                else []
+            ),
+        )
+
+        def load_transcripts(video_id, transcripts):
+            for transcript in transcripts:
+                Transcript.create(video_id=video_id, text="text", **transcript)
+
+        monkeypatch.setattr(ingest, "load_transcripts", load_transcripts)
+        return youtube
+
+    def test_run_and_resume(self, youtube):
+        """Videos are ingested once, and a second run skips them."""
+        # The in-memory test database has a single connection, which can't be shared
+        reports = []
+        run = ingest.Ingestion(workers=1, report=lambda *report: reports.append(report))
+        video_ids = [f"v{i}" for i in range(60)] + ["private", "v0"]
+        summary = run.run(video_ids)
+        assert summary["videos"] == 61
+        assert summary["captions"] == 30
+        assert summary["queued"] == 30
+        assert summary["not found"] == 1
+        assert [len(call) for call in youtube.calls] == [50, 11]
+        assert TranscriptionJob.query.count() == 30
+        assert sorted(done for done, *_ in reports) == list(range(1, 62))
+
+        summary = ingest.Ingestion(workers=1, transcribe="none").run(video_ids)
+        assert summary["already loaded"] == 30
+        assert summary["no captions"] == 30
+        assert len(youtube.calls) == 3
+
+    def test_failed_metadata_fails_its_videos(self, youtube, monkeypatch):
+        """A batch whose metadata can't be fetched counts its videos as failed."""
+
+        def get_videos_info(video_ids):
+            raise RuntimeError("quota exceeded")
+
+        monkeypatch.setattr(services, "get_videos_info", get_videos_info)
+        assert ingest.Ingestion(workers=1).run(["v0", "v1"])["failed"] == 2
+
+    def test_invalid_transcribe_mode(self):
+        """Only the known transcription modes are accepted."""
+        with pytest.raises(ValueError):
+            ingest.Ingestion(transcribe="sometimes")
+
+
+def test_ingest_command_needs_an_api_key(app):
+    """Without YOUTUBE_API_KEY, the command explains what is missing."""
+    result = app.test_cli_runner().invoke(args=["ingest", "--channel", "UC123"])
+    assert result.exit_code == 1
+    assert "YOUTUBE_API_KEY" in result.output
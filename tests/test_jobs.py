@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""Transcription job queue unit tests."""
+import datetime as dt
+
+import pytest
+
+from riddle_me_this.locks import LockTimeout, single_flight
+from riddle_me_this.user import services
+from riddle_me_this.user.jobs import (
+    JobFailed,
+    claim_next_job,
+    enqueue_transcription,
+    requeue_stale_jobs,
+    retry_failed_jobs,
+    run_job,
+    run_worker,
+)
+from riddle_me_this.user.models import Transcript, TranscriptionJob
+
+
+def fail(job):
+    """A handler that always fails."""
+    raise RuntimeError("no audio")
+
+
+@pytest.mark.usefixtures("db")
+class TestTranscriptionJobs:
+    """Transcription job queue tests."""
+
+    def test_enqueue_reuses_active_job(self):
+        """A video has one active job until it is done."""
+        job = enqueue_transcription("abc")
+        assert enqueue_transcription("abc") is job
+        job.update(status=TranscriptionJob.DONE)
+        assert enqueue_transcription("abc") is not job
+
+    def test_claim_is_exclusive(self):
+        """A claimed job is running and can't be claimed again."""
+        job = enqueue_transcription("abc")
+        claimed = claim_next_job("worker-1")
+        assert claimed.id == job.id
+        assert (claimed.status, claimed.attempts, claimed.worker) == (
+            TranscriptionJob.RUNNING,
+            1,
+            "worker-1",
+        )
+        assert claim_next_job("worker-2") is None
+
+    def test_retries_with_backoff_then_fails(self):
+        """A failing job is retried later until it runs out of attempts."""
+        enqueue_transcription("abc")
+        job = claim_next_job("worker")
+        assert not run_job(job, fail)
+        assert job.status == TranscriptionJob.QUEUED
+        assert job.available_at > dt.datetime.utcnow()
+        assert claim_next_job("worker") is None
+
+        job.update(available_at=dt.datetime.utcnow())
+        run_job(claim_next_job("worker"), fail)
+        assert job.status == TranscriptionJob.FAILED
+        assert "no audio" in job.error
+        assert enqueue_transcription("abc") is job
+
+    def test_stale_jobs_are_requeued(self):
+        """Jobs of a crashed worker go back to the queue."""
+        enqueue_transcription("abc")
+        job = claim_next_job("worker")
+        job.update(started_at=dt.datetime.utcnow() - dt.timedelta(hours=1))
+        assert requeue_stale_jobs() == 1
+        assert job.status == TranscriptionJob.QUEUED
+
+    def test_burst_worker(self):
+        """A burst worker runs every ready job and returns."""
+        for video_id in ("a", "b"):
+            enqueue_transcription(video_id)
+        handled = []
+
+        def on_idle():
+            handled.append("idle")
+            raise RuntimeError("maintenance failed")
+
+        processed = run_worker(
+            lambda job: handled.append(job.video_id), burst=True, on_idle=on_idle
+        )
+        assert processed == 2
+        assert handled == ["a", "b", "idle"]
+        assert {job.status for job in TranscriptionJob.query} == {TranscriptionJob.DONE}
+
+    def test_empty_transcription_fails_for_good(self, monkeypatch):
+        """A video without speech fails its job at once, and isn't queued again."""
+        monkeypatch.setattr(
+            services,
+            "download_audio_from_youtube",
+            lambda url, directory: f"{directory}/audio.webm",
+        )
+        monkeypatch.setattr(
+            services,
+            "transcribe_whisper_local",
+            lambda audio_file: [
+                {
+                    "transcript": [{"text": "  "}],
+                    "language_code": "en-whisper",
+                    "is_generated": False,
+                }
+            ],
+        )
+        job = enqueue_transcription("abc")
+        assert not run_job(
+            claim_next_job("worker"),
+            lambda job: services.transcribe_video(job.video_id),
+        )
+        assert (job.status, job.attempts) == (TranscriptionJob.FAILED, 1)
+        assert enqueue_transcription("abc") == job
+
+    def test_retry_failed_jobs(self):
+        """Failed jobs are queued again with all their attempts."""
+        for video_id in ("a", "b"):
+            enqueue_transcription(video_id)
+            run_job(claim_next_job("worker"), self.give_up)
+        assert retry_failed_jobs("a") == 1
+        assert retry_failed_jobs() == 1
+        job = claim_next_job("worker")
+        assert (job.video_id, job.attempts, job.error) == ("a", 1, "no speech")
+
+    @staticmethod
+    def give_up(job):
+        """A handler that fails for good."""
+        raise JobFailed("no speech")
+
+    def test_requeued_job_is_left_to_its_new_worker(self):
+        """A worker whose job was requeued while it ran doesn't record its outcome."""
+        enqueue_transcription("abc")
+
+        def outlived(job):
+            job.update(started_at=dt.datetime.utcnow() - dt.timedelta(hours=1))
+            requeue_stale_jobs()
+            assert claim_next_job("other").id == job.id
+
+        job = claim_next_job("worker")
+        run_job(job, outlived)
+        assert (job.status, job.worker) == (TranscriptionJob.RUNNING, "other")
+
+    def test_transcription_job_holds_only_the_whisper_lock(self, monkeypatch):
+        """The job transcribes under the video's whisper lock, unless a transcript exists by now."""
+        transcribed = []
+
+        def transcribe_whisper_local(audio_file):
+            video_id = audio_file.split("/")[-2]
+            with pytest.raises(LockTimeout):
+                with single_flight(f"whisper:{video_id}", timeout=0):
+                    pass
+            with single_flight(f"transcripts:{video_id}", timeout=0):
+                pass
+            transcribed.append(video_id)
+            return [
+                {
+                    "transcript": [{"text": "Hello"}],
+                    "language_code": "en-whisper",
+                    "is_generated": False,
+                }
+            ]
+
+        monkeypatch.setattr(
+            services,
+            "download_audio_from_youtube",
+            lambda url, directory: f"{directory}/{url[-3:]}/audio.webm",
+        )
+        monkeypatch.setattr(
+            services, "transcribe_whisper_local", transcribe_whisper_local
+        )
+        for video_id in ("abc", "def"):
+            enqueue_transcription(video_id)
+        Transcript.create(video_id="def", text="text", language_code="en")
+        assert run_worker(services.run_transcription_job, burst=True) == 2
+        assert transcribed == ["abc"]
+
+    def test_request_during_a_job_is_pending(self, monkeypatch):
+        """A request for a video being transcribed is told so at once, not made to wait."""
+        monkeypatch.setattr(
+            services,
+            "get_transcripts",
+            lambda *args, **kwargs: pytest.fail("captions fetched again"),
+        )
+        enqueue_transcription("abc")
+
+        def handler(job):
+            with single_flight("whisper:abc"):
+                with pytest.raises(services.TranscriptionPending) as pending:
+                    services.get_and_load_transcripts("abc")
+                assert pending.value.job.id == job.id
+
+        assert run_job(claim_next_job("worker"), handler)
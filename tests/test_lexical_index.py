@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Lexical index unit tests."""
+import pytest
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.attributes import set_committed_value
+
+from riddle_me_this.user import data_loading
+from riddle_me_this.user.lexical_index import bm25_scores, index_chunks, tokenize
+from riddle_me_this.user.models import ChunkPosting, Transcript, TranscriptChunk
+
+
+def test_tokenize():
+    """Terms are lowercased and stop words are dropped."""
+    assert tokenize("Who is the SPEAKER? It's Guido van Rossum.") == [
+        "speaker",
+        "guido",
+        "van",
+        "rossum",
+    ]
+
+
+@pytest.mark.usefixtures("db")
+class TestBM25:
+    """BM25 scoring tests."""
+
+    @staticmethod
+    def make_chunks(texts):
+        """Store and index one chunk per text."""
+        transcript = Transcript.create(video_id="abc", text=" ".join(texts))
+        chunks = [
+            TranscriptChunk.create(transcript_id=transcript.id, chunk_index=i, text=t)
+            for i, t in enumerate(texts)
+        ]
+        index_chunks(chunks)
+        return chunks
+
+    def test_postings(self):
+        """Each distinct term of a chunk gets one posting with its frequency."""
+        (chunk,) = self.make_chunks(["python python snakes"])
+        postings = {p.term: p.term_frequency for p in ChunkPosting.query.all()}
+        assert postings == {"python": 2, "snakes": 1}
+        assert chunk.n_terms == 3
+
+    def test_rare_terms_rank_first(self):
+        """Chunks with rare query terms outrank chunks with common ones."""
+        chunks = self.make_chunks(
+            [
+                "talk about python and code",
+                "more talk about code",
+                "talk with Rossum about code",
+            ]
+        )
+        scores = bm25_scores("Rossum talk")
+        assert max(scores, key=scores.get) == chunks[2].id
+
+    def test_restricted_to_chunk_ids(self):
+        """Only the requested chunks are scored."""
+        chunks = self.make_chunks(["alpha beta", "alpha gamma"])
+        assert set(bm25_scores("alpha", [chunks[1].id])) == {chunks[1].id}
+        assert bm25_scores("the of and") == {}
+
+    def test_lazy_indexing_happens_once(self, db):
+        """Chunks stored before the index are indexed once, even by a caller with stale chunks."""
+        transcript = Transcript.create(video_id="abc", text="python snakes")
+        chunk = TranscriptChunk.create(
+            transcript_id=transcript.id, chunk_index=0, text="python snakes"
+        )
+        data_loading._index_transcript_chunks(transcript)
+        # What a worker that loaded the chunk before it was indexed still sees
+        set_committed_value(chunk, "n_terms", None)
+        data_loading._index_transcript_chunks(transcript)
+        assert ChunkPosting.query.count() == 2
+        assert db.session.query(TranscriptChunk.n_terms).scalar() == 2
+
+        with pytest.raises(IntegrityError):
+            ChunkPosting.create(term="python", chunk_id=chunk.id, term_frequency=1)
+        db.session.rollback()
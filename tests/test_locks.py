@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""Single-flight lock unit tests."""
+import threading
+import time
+
+import pytest
+
+from riddle_me_this.locks import LockTimeout, single_flight
+
+
+def test_single_flight_runs_one_caller_at_a_time(app):
+    """Callers of the same key take turns and each sees the first one's result."""
+    results = []
+    running = []
+    overlaps = []
+
+    def work():
+        with app.app_context(), single_flight("video:abc", poll_interval=0.01):
+            running.append(1)
+            overlaps.append(len(running) > 1)
+            if not results:
+                time.sleep(0.05)
+                results.append("transcript")
+            running.pop()
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ["transcript"]
+    assert overlaps == [False] * 4
+
+
+def test_single_flight_timeout(app):
+    """A caller gives up when the lock is held for too long."""
+    with single_flight("video:abc"):
+        with pytest.raises(LockTimeout):
+            with single_flight("video:abc", timeout=0.05, poll_interval=0.01):
+                pass
+        with single_flight("video:other", timeout=0.05):
+            pass
@@ -2,9 +2,11 @@
 """Model unit tests."""
 import datetime as dt
 
+import numpy as np
 import pytest
+from sqlalchemy.exc import IntegrityError
 
-from riddle_me_this.user.models import Role, User
+from riddle_me_this.user.models import Role, Transcript, TranscriptChunk, User
 
 from .factories import UserFactory
 
@@ -74,3 +76,32 @@ class TestUser:
         """Check __repr__ output for User."""
         user = User(username="foo", email="foo@bar.com")
         assert user.__repr__() == "<User('foo')>"
+
+
+@pytest.mark.usefixtures("db")
+class TestTranscriptChunk:
+    """TranscriptChunk tests."""
+
+    def test_vector_round_trip(self):
+        """Embeddings are stored as float32 blobs and read back as vectors."""
+        transcript = Transcript.create(video_id="abc", text="hello world")
+        chunk = TranscriptChunk.create(
+            transcript_id=transcript.id,
+            chunk_index=0,
+            text="hello world",
+            vector=[0.5, -1.0, 2.0],
+        )
+        assert len(chunk.embedding) == 3 * 4
+        assert chunk.vector.dtype == np.float32
+        assert chunk.vector.tolist() == [0.5, -1.0, 2.0]
+        assert transcript.chunks == [chunk]
+
+    def test_chunk_index_is_unique_per_transcript(self, db):
+        """A transcript can't store the same chunk twice."""
+        transcript = Transcript.create(video_id="abc", text="hello world")
+        TranscriptChunk.create(transcript_id=transcript.id, chunk_index=0, text="hello")
+        with pytest.raises(IntegrityError):
+            TranscriptChunk.create(
+                transcript_id=transcript.id, chunk_index=0, text="hello"
+            )
+        db.session.rollback()
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""Google token unit tests, against a local stand-in for the token endpoint."""
+import json
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from flask import session
+
+from riddle_me_this.app import create_app
+from riddle_me_this.oauth import get_google_token
+
+
+class FakeTokenHandler(BaseHTTPRequestHandler):
+    """Grants a numbered access token for any refresh token but "revoked"."""
+
+    protocol_version = "HTTP/1.1"
+    requests = []
+    lock = threading.Lock()
+
+    def do_POST(self):
+        """Answer a refresh after a short delay, recording the client's port."""
+        body = self.rfile.read(int(self.headers["Content-Length"])).decode()
+        refresh_token = urllib.parse.parse_qs(body)["refresh_token"][0]
+        with self.lock:
+            self.requests.append(self.client_address[1])
+            number = len(self.requests)
+        time.sleep(0.1)
+        if refresh_token == "revoked":
+            status, payload = 400, {"error": "invalid_grant"}
+        else:
+            status, payload = 200, {
+                "access_token": f"access{number}",
+                "expires_in": 3600,
+            }
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        """Keep the test output quiet."""
+
+
+@pytest.fixture
+def token_server(app, tmp_path):
+    """Point the app at a fake token endpoint on a free local port, with no stored tokens."""
+    FakeTokenHandler.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeTokenHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    app.config["GOOGLE_TOKEN_URL"] = f"http://127.0.0.1:{server.server_port}/token"
+    app.config["LOCK_DIR"] = str(tmp_path)
+    yield FakeTokenHandler.requests
+    server.shutdown()
+    server.server_close()
+
+
+def get_token(app, refresh_token="refresh", expires_in=-1):
+    """Call get_google_token in a request whose session holds the given tokens."""
+    with app.test_request_context():
+        session["google_token"] = ("old", "")
+        session["google_refresh_token"] = refresh_token
+        session["google_token_expires_at"] = time.time() + expires_in
+        return get_google_token(), dict(session)
+
+
+class TestGetGoogleToken:
+    """get_google_token tests."""
+
+    def test_unexpired_token_is_reused(self, app, token_server):
+        """A token that isn't about to expire is returned without a refresh."""
+        assert get_token(app, expires_in=3600)[0] == ("old", "")
+        assert token_server == []
+
+    def test_expired_token_is_refreshed_once(self, app, token_server):
+        """An expired token is refreshed, and the new one is stored with its expiry."""
+        token, stored = get_token(app)
+        assert token == ("access1", "")
+        assert stored["google_token_expires_at"] > time.time() + 3000
+        assert get_token(app)[0] == ("access1", "")
+        assert len(token_server) == 1
+
+    def test_one_refresh_in_flight_per_user(self, app, token_server):
+        """Concurrent requests of the same user share a single refresh."""
+        tokens = []
+        threads = [
+            threading.Thread(target=lambda: tokens.append(get_token(app)[0]))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert tokens == [("access1", "")] * 4
+        assert len(token_server) == 1
+
+    def test_refreshed_token_is_shared_across_apps(self, app, token_server):
+        """Another worker process, with its own app and cache, reuses the refreshed token."""
+        other = create_app("tests.settings")
+        other.config.update(
+            GOOGLE_TOKEN_URL=app.config["GOOGLE_TOKEN_URL"],
+            LOCK_DIR=app.config["LOCK_DIR"],
+        )
+        assert get_token(app)[0] == ("access1", "")
+        assert get_token(other)[0] == ("access1", "")
+        assert len(token_server) == 1
+
+    def test_refresh_connection_is_reused(self, app, token_server):
+        """Refreshes for different users go over the same pooled connection."""
+        get_token(app, refresh_token="first")
+        get_token(app, refresh_token="second")
+        assert len(token_server) == 2
+        assert token_server[0] == token_server[1]
+
+    def test_revoked_refresh_token_logs_out(self, app, token_server):
+        """A failed refresh removes the tokens from the session."""
+        token, stored = get_token(app, refresh_token="revoked")
+        assert token == (None, None)
+        assert "google_token" not in stored
+
+    def test_token_file_holds_no_refresh_token(self, app, token_server, tmp_path):
+        """Only the access token and its expiry are shared, and expired files are removed."""
+        expired = tmp_path / "google_token_expired.json"
+        expired.write_text(json.dumps({"access_token": "x", "expires_at": 0}))
+        get_token(app)
+        (path,) = tmp_path.glob("google_token_*.json")
+        assert set(json.loads(path.read_text())) == {"access_token", "expires_at"}
+        assert path.stat().st_mode & 0o777 == 0o600
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""Model registry unit tests."""
+import threading
+
+from riddle_me_this.registry import ModelRegistry
+
+
+class TestModelRegistry:
+    """ModelRegistry tests."""
+
+    def test_loads_once(self):
+        """Loader runs once and the same instance is returned afterwards."""
+        registry = ModelRegistry()
+        calls = []
+
+        def loader():
+            calls.append(1)
+            return object()
+
+        first = registry.get("model", loader)
+        second = registry.get("model", loader)
+        assert first is second
+        assert len(calls) == 1
+        assert registry.stats()["model"]["hits"] == 1
+
+    def test_concurrent_get_loads_once(self):
+        """Concurrent callers share a single load."""
+        registry = ModelRegistry()
+        calls = []
+        release = threading.Event()
+
+        def loader():
+            calls.append(1)
+            release.wait(1)
+            return object()
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(registry.get("m", loader)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join()
+        assert len(calls) == 1
+        assert len({id(result) for result in results}) == 1
+
+    def test_stats_and_unload(self):
+        """Stats report load time and memory, unload forces a reload."""
+        registry = ModelRegistry()
+        registry.get("model", lambda: "a")
+        stats = registry.stats()["model"]
+        assert stats["load_seconds"] >= 0
+        assert stats["rss_bytes"] >= 0
+        registry.unload("model")
+        assert "model" not in registry.stats()
+        assert registry.get("model", lambda: "b") == "b"
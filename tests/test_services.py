@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""User services unit tests."""
+import os
+import threading
+import time
+
+import pytest
+
+from riddle_me_this.user import services
+from riddle_me_this.user.models import Transcript, Video
+
+
+def video_item(video_id):
+    """Build a videos().list item as the YouTube Data API returns it."""
+    return {
+        "id": video_id,
+        "snippet": {
+            "publishedAt": "2023-01-01T00:00:00Z",
+            "channelId": "channel",
+            "title": f"Video {video_id}",
+            "description": "",
+            "channelTitle": "Channel",
+            "categoryId": "27",
+            "thumbnails": {},
+        },
+        "contentDetails": {"definition": "hd", "licensedContent": True},
+        "status": {
+            "uploadStatus": "processed",
+            "privacyStatus": "public",
+            "license": "youtube",
+            "publicStatsViewable": True,
+            "madeForKids": False,
+        },
+        "statistics": {"viewCount": "10", "favoriteCount": "0"},
+    }
+
+
+class FakeYoutube:
+    """Stands in for the YouTube client, knowing every ID but "private"."""
+
+    def __init__(self):
+        """Start without calls."""
+        self.calls = []
+
+    def videos(self):
+        """Return the videos resource."""
+        return self
+
+    def list(self, part, id):
+        """Record a list call, which takes no maxResults along with id."""
+        self.calls.append(id.split(","))
+        self.ids = [video_id for video_id in id.split(",") if video_id != "private"]
+        return self
+
+    def execute(self):
+        """Return the items of the last list call."""
+        return {"items": [video_item(video_id) for video_id in self.ids]}
+
+
+@pytest.mark.usefixtures("db")
+class TestGetVideosInfo:
+    """get_videos_info tests."""
+
+    @pytest.fixture
+    def youtube(self, monkeypatch):
+        """Use a fake YouTube client."""
+        youtube = FakeYoutube()
+        monkeypatch.setattr(services, "get_youtube_service", lambda: youtube)
+        return youtube
+
+    def test_fetches_missing_videos_fifty_at_a_time(self, youtube):
+        """Stored videos are skipped and the rest are fetched in batches of 50."""
+        services.load_video_info({"items": [video_item("v3")]})
+        video_ids = [f"v{i}" for i in range(120)] + ["private", "v0"]
+        videos = services.get_videos_info(video_ids)
+        assert [video.video_id for video in videos] == [f"v{i}" for i in range(120)]
+        assert [len(call) for call in youtube.calls] == [50, 50, 20]
+        assert "v3" not in sum(youtube.calls, [])
+        assert Video.query.count() == 120
+        assert videos[1].statistics_like_count is None
+
+        assert services.get_videos_info(["v5", "v7"])[1].video_id == "v7"
+        assert len(youtube.calls) == 3
+
+    def test_video_stored_during_the_insert_is_kept_once(self, youtube, monkeypatch):
+        """A video another process stores after the check for stored videos isn't stored twice."""
+        stored_videos = services.stored_videos
+        checks = []
+
+        def stale_checks(video_ids):
+            checks.append(video_ids)
+            return {} if len(checks) <= 2 else stored_videos(video_ids)
+
+        execute = youtube.execute
+
+        def execute_while_stored():
+            services.load_video_info({"items": [video_item("v1")]})
+            return execute()
+
+        monkeypatch.setattr(services, "stored_videos", stale_checks)
+        monkeypatch.setattr(youtube, "execute", execute_while_stored)
+        videos = services.get_videos_info(["v0", "v1"])
+        assert [video.video_id for video in videos] == ["v0", "v1"]
+        assert Video.query.filter_by(video_id="v1").count() == 1
+        assert len(checks) == 3
+
+    def test_get_video_info(self, youtube):
+        """A single video is fetched once, and an unknown one is an error."""
+        assert services.get_video_info("v1").snippet_title == "Video v1"
+        assert services.get_video_info("v1").video_id == "v1"
+        assert youtube.calls == [["v1"]]
+        with pytest.raises(ValueError):
+            services.get_video_info("private")
+
+
+class FakeTrack:
+    """Stands in for a caption track listed by YouTubeTranscriptApi."""
+
+    lock = threading.Lock()
+    running = 0
+    max_running = 0
+
+    def __init__(self, language_code, is_generated, fails=False):
+        """Describe the track."""
+        self.language_code = language_code
+        self.is_generated = is_generated
+        self.fails = fails
+        self.fetched = False
+
+    def fetch(self):
+        """Return the captions of the track, counting the fetches in flight."""
+        cls = type(self)
+        with cls.lock:
+            cls.running += 1
+            cls.max_running = max(cls.max_running, cls.running)
+        time.sleep(0.02)
+        with cls.lock:
+            cls.running -= 1
+        self.fetched = True
+        if self.fails:
+            raise RuntimeError("No captions")
+        return [{"text": self.language_code, "start": 0.0, "duration": 1.0}]
+
+
+class TestGetTranscripts:
+    """get_transcripts tests."""
+
+    @pytest.fixture
+    def tracks(self, monkeypatch):
+        """Serve a manual and a generated English track among many translations."""
+        tracks = [FakeTrack(f"l{i}", True) for i in range(8)]
+        tracks[3:3] = [FakeTrack("en", True), FakeTrack("en", False)]
+        monkeypatch.setattr(
+            services.YouTubeTranscriptApi,
+            "list_transcripts",
+            staticmethod(lambda video_id: iter(tracks)),
+            raising=False,
+        )
+        FakeTrack.max_running = 0
+        return tracks
+
+    def test_fetches_only_the_preferred_track(self, tracks):
+        """The manual English track is the only one downloaded."""
+        transcripts = services.get_transcripts("video")
+        assert [(t["language_code"], t["is_generated"]) for t in transcripts] == [
+            ("en", False)
+        ]
+        assert [track for track in tracks if track.fetched] == [tracks[4]]
+
+    def test_falls_back_in_priority_order(self, tracks):
+        """The generated track is used when the manual one can't be fetched."""
+        tracks[4].fails = True
+        transcripts = services.get_transcripts("video")
+        assert [(t["language_code"], t["is_generated"]) for t in transcripts] == [
+            ("en", True)
+        ]
+        assert services.get_transcripts("video", language_codes=("de",)) == []
+
+    def test_eager_fetch_is_bounded(self, tracks):
+        """Eagerly, every track is downloaded, at most max_workers at a time, skipping failures."""
+        tracks[0].fails = True
+        transcripts = services.get_transcripts("video", eager=True, max_workers=3)
+        assert transcripts[0]["language_code"] == "en"
+        assert not transcripts[0]["is_generated"]
+        assert len(transcripts) == len(tracks) - 1
+        assert FakeTrack.max_running == 3
+
+
+class FakeYoutubeDL:
+    """Writes a small audio file where the output template says, recording its options."""
+
+    options = []
+
+    def __init__(self, options):
+        """Record the options."""
+        self.options.append(options)
+        self.template = options["outtmpl"]
+
+    def __enter__(self):
+        """Use as a context manager, like YoutubeDL."""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Nothing to close."""
+
+    def extract_info(self, url, download=False):
+        """Write the audio of the video and return its info."""
+        info = {"id": url[-11:], "ext": "webm"}
+        with open(self.prepare_filename(info), "wb") as f:
+            f.write(b"audio")
+        return info
+
+    def prepare_filename(self, info):
+        """Fill the output template with the video's info."""
+        return self.template % info
+
+
+@pytest.mark.usefixtures("db")
+class TestDownloadAudio:
+    """Audio download tests."""
+
+    url = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+
+    @pytest.fixture(autouse=True)
+    def youtube_dl(self, app, monkeypatch):
+        """Download with a fake YoutubeDL, without the audio cache."""
+        FakeYoutubeDL.options = []
+        monkeypatch.setattr(services.youtube_dl, "YoutubeDL", FakeYoutubeDL)
+        monkeypatch.setitem(app.config, "AUDIO_CACHE_MAX_BYTES", 0)
+
+    def test_downloads_audio_only_into_the_directory(self, tmp_path):
+        """Only an audio stream is downloaded, as it is, into the given directory."""
+        audio_file = services.download_audio_from_youtube(self.url, str(tmp_path))
+        assert audio_file == str(tmp_path / "dQw4w9WgXcQ.webm")
+        assert open(audio_file, "rb").read() == b"audio"
+        (options,) = FakeYoutubeDL.options
+        assert options["format"] == services.AUDIO_FORMAT
+        assert options["format"].startswith("bestaudio")
+        assert "postprocessors" not in options
+
+    @pytest.mark.parametrize("fails", [False, True])
+    def test_transcribe_video_removes_the_download(self, monkeypatch, fails):
+        """The downloaded audio is gone once transcribe_video exits, even if it raises."""
+        audio_files = []
+
+        def transcribe_whisper_local(audio_file):
+            assert os.path.exists(audio_file)
+            audio_files.append(audio_file)
+            if fails:
+                raise RuntimeError("Whisper failed")
+            return [
+                {
+                    "transcript": [{"text": "Hello"}],
+                    "language_code": "en-whisper",
+                    "is_generated": False,
+                }
+            ]
+
+        monkeypatch.setattr(
+            services, "transcribe_whisper_local", transcribe_whisper_local
+        )
+        monkeypatch.setattr(
+            services,
+            "load_transcripts",
+            lambda video_id, transcripts: Transcript.create(
+                video_id=video_id, text="Hello", language_code="en-whisper"
+            ),
+        )
+        if fails:
+            with pytest.raises(RuntimeError):
+                services.transcribe_video("dQw4w9WgXcQ")
+        else:
+            services.transcribe_video("dQw4w9WgXcQ")
+        (audio_file,) = audio_files
+        assert not os.path.exists(audio_file)
+        assert not os.path.exists(os.path.dirname(audio_file))
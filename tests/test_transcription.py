@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""Local Whisper model unit tests."""
+from concurrent.futures import Future
+
+import numpy as np
+import torch
+import whisper
+from whisper.audio import SAMPLE_RATE
+
+from riddle_me_this.registry import model_registry
+from riddle_me_this.user import services, transcription
+from riddle_me_this.user.models import StatCounter
+from riddle_me_this.user.transcription import (
+    find_silences,
+    get_whisper_model,
+    quantize_whisper,
+    restore_timestamps,
+    skip_non_speech,
+    split_at_silences,
+    stitch_transcriptions,
+)
+
+DIMS = whisper.model.ModelDimensions(
+    n_mels=80,
+    n_audio_ctx=16,
+    n_audio_state=32,
+    n_audio_head=2,
+    n_audio_layer=1,
+    n_vocab=64,
+    n_text_ctx=8,
+    n_text_state=32,
+    n_text_head=2,
+    n_text_layer=1,
+)
+
+
+def test_quantize_whisper():
+    """Every linear layer becomes a dynamic int8 layer and the model still runs."""
+    torch.manual_seed(0)
+    model = whisper.model.Whisper(DIMS).eval()
+    with torch.no_grad():
+        # Some of Whisper's weights start out uninitialized
+        for parameter in model.parameters():
+            parameter.normal_(std=0.1)
+    mel = torch.randn(1, DIMS.n_mels, 2 * DIMS.n_audio_ctx)
+    tokens = torch.tensor([[1, 2, 3]])
+    with torch.no_grad():
+        expected = model(mel, tokens)
+        quantized = quantize_whisper(model)
+        logits = quantized(mel, tokens)
+
+    layers = [type(module) for module in quantized.modules()]
+    assert torch.ao.nn.quantized.dynamic.Linear in layers
+    assert torch.nn.Linear not in layers
+    assert whisper.model.Linear not in layers
+    assert logits.shape == expected.shape
+    assert torch.allclose(logits, expected, atol=0.5)
+
+
+def test_get_whisper_model_is_cached_per_setting(app, monkeypatch):
+    """The configured model is loaded once per size and quantization."""
+    loads = []
+    monkeypatch.setattr(torch.cuda, "is_available", lambda: False)
+    monkeypatch.setattr(
+        transcription,
+        "load_whisper_model",
+        lambda size, device, quantize: loads.append((size, device, quantize)) or size,
+    )
+    app.config.update(WHISPER_MODEL_SIZE="base", WHISPER_QUANTIZE=True)
+    try:
+        assert get_whisper_model() == "base"
+        assert get_whisper_model() == "base"
+        assert get_whisper_model(size="tiny", quantize=False) == "tiny"
+        assert loads == [("base", "cpu", True), ("tiny", "cpu", False)]
+        assert "whisper:base:cpu:int8" in model_registry.stats()
+    finally:
+        model_registry.unload("whisper:base:cpu:int8")
+        model_registry.unload("whisper:tiny:cpu")
+
+
+def tone(seconds, amplitude=0.5):
+    """A 440 Hz tone at 16 kHz."""
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    return (amplitude * np.sin(2 * np.pi * 440 * t)).astype(np.float32)
+
+
+def test_find_silences():
+    """Quiet stretches between speech are found at the right place."""
+    audio = np.concatenate([tone(1), np.zeros(SAMPLE_RATE, np.float32), tone(1)])
+    [(start, end)] = find_silences(audio)
+    assert abs(start - SAMPLE_RATE) < 0.05 * SAMPLE_RATE
+    assert abs(end - 2 * SAMPLE_RATE) < 0.05 * SAMPLE_RATE
+
+
+def test_split_at_silences():
+    """Cuts move to the nearest silence and the pieces cover the audio."""
+    silence = np.zeros(SAMPLE_RATE, np.float32)
+    audio = np.concatenate([tone(8), silence, tone(12), silence, tone(5)])
+    pieces = split_at_silences(audio, segment_seconds=10, search_seconds=3)
+    assert pieces[0][0] == 0 and pieces[-1][1] == len(audio)
+    assert all(end == start for (_, end), (start, _) in zip(pieces, pieces[1:]))
+    assert abs(pieces[0][1] / SAMPLE_RATE - 8.5) < 0.1
+    assert abs(pieces[1][1] / SAMPLE_RATE - 21.5) < 0.1
+
+
+def test_stitch_transcriptions():
+    """Segment times are shifted by their piece's offset and renumbered."""
+    results = [
+        {"text": " Hello.", "segments": [{"id": 0, "start": 0.0, "end": 2.0}]},
+        {"text": " World.", "segments": [{"id": 0, "start": 1.0, "end": 3.0}]},
+    ]
+    stitched = stitch_transcriptions(results, [0, 10 * SAMPLE_RATE])
+    assert stitched["text"] == " Hello. World."
+    assert [(s["id"], s["start"], s["end"]) for s in stitched["segments"]] == [
+        (0, 0.0, 2.0),
+        (1, 11.0, 13.0),
+    ]
+
+
+def test_skip_non_speech_and_restore_timestamps(app, db, monkeypatch):
+    """Only speech is kept, and times map back to the original audio."""
+    audio = np.concatenate([np.zeros(10 * SAMPLE_RATE, np.float32), tone(5)] * 2)
+    spans = [(10 * SAMPLE_RATE, 15 * SAMPLE_RATE), (25 * SAMPLE_RATE, 30 * SAMPLE_RATE)]
+    monkeypatch.setattr(transcription, "detect_speech", lambda audio: spans)
+
+    speech, speech_spans = skip_non_speech(audio)
+    assert len(speech) == 10 * SAMPLE_RATE
+    assert StatCounter.values("vad.") == {
+        "vad.audio_ms": 30000,
+        "vad.skipped_ms": 20000,
+    }
+
+    result = restore_timestamps(
+        {
+            "text": " a b",
+            "segments": [
+                {"start": 1.0, "end": 5.0, "words": [{"start": 1.0, "end": 2.0}]},
+                {"start": 5.0, "end": 7.0},
+            ],
+        },
+        speech_spans,
+    )
+    [first, second] = result["segments"]
+    assert (first["start"], first["end"]) == (11.0, 15.0)
+    assert (first["words"][0]["start"], first["words"][0]["end"]) == (11.0, 12.0)
+    assert (second["start"], second["end"]) == (25.0, 27.0)
+
+
+def test_transcribe_parallel_keeps_one_pool_per_size(monkeypatch):
+    """Audio with fewer pieces than workers uses the configured pool, not a smaller one."""
+    pools = []
+
+    class FakePool:
+        """Runs submitted calls at once."""
+
+        def submit(self, fn, *args):
+            """Run a call, returning a finished future."""
+            future = Future()
+            future.set_result(fn(*args))
+            return future
+
+    def get_pool(workers):
+        pools.append(workers)
+        return FakePool()
+
+    monkeypatch.setattr(transcription, "_get_pool", get_pool)
+    monkeypatch.setattr(
+        transcription,
+        "_transcribe_segment",
+        lambda audio, size, quantize: {"text": "x", "segments": [], "language": "en"},
+    )
+    for n_pieces in (2, 3):
+        monkeypatch.setattr(
+            transcription,
+            "split_at_silences",
+            lambda audio, seconds, n=n_pieces: [(i, i + 1) for i in range(n)],
+        )
+        result = transcription.transcribe_parallel(np.zeros(10), workers=8)
+        assert result["text"] == "x" * n_pieces
+    assert set(pools) == {8}
+
+
+def test_only_cpu_transcription_is_parallel(app, monkeypatch):
+    """The pieces go to the process pool on the CPU, but a GPU transcribes the whole audio."""
+    used = []
+    result = {"text": "x", "segments": []}
+    monkeypatch.setitem(app.config, "WHISPER_WORKERS", 4)
+    monkeypatch.setitem(app.config, "WHISPER_VAD", False)
+    monkeypatch.setattr(
+        services,
+        "transcribe_parallel",
+        lambda audio, **kwargs: used.append(("parallel", kwargs["workers"])) or result,
+    )
+    monkeypatch.setattr(services, "get_whisper_model", lambda: "model")
+    monkeypatch.setattr(
+        services.whisper,
+        "transcribe",
+        lambda model, audio, **kwargs: used.append(model) or result,
+    )
+    for device in ("cpu", "cuda"):
+        monkeypatch.setattr(services, "whisper_device", lambda device=device: device)
+        [transcript] = services.transcribe_whisper_local(np.zeros(10, np.float32))
+        assert transcript["text"] == "x"
+    assert used == [("parallel", 4), "model"]
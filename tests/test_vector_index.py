@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""Vector index unit tests."""
+import os
+
+import numpy as np
+import pytest
+
+from riddle_me_this.user import vector_index
+from riddle_me_this.user.models import Transcript, TranscriptChunk
+from riddle_me_this.user.vector_index import IVFIndex, normalize_rows, top_k_similar
+
+
+class TestTopKSimilar:
+    """top_k_similar tests."""
+
+    def test_matches_full_sort(self):
+        """Top-k indices agree with a full sort of the cosine similarities."""
+        rng = np.random.default_rng(0)
+        matrix = rng.standard_normal((500, 16)).astype(np.float32)
+        queries = rng.standard_normal((3, 16)).astype(np.float32)
+        indices, scores = top_k_similar(queries, matrix, k=5)
+
+        expected_scores = normalize_rows(queries) @ normalize_rows(matrix).T
+        expected = np.argsort(-expected_scores, axis=1)[:, :5]
+        assert indices.shape == (3, 5)
+        assert (indices == expected).all()
+        assert np.allclose(scores, np.sort(expected_scores, axis=1)[:, ::-1][:, :5])
+
+    def test_k_larger_than_matrix(self):
+        """Asking for more rows than exist returns every row, sorted."""
+        matrix = np.array([[1, 0], [0, 1], [1, 1]], dtype=np.float32)
+        indices, _ = top_k_similar([1, 0.1], matrix, k=10)
+        assert indices.tolist() == [[0, 2, 1]]
+
+    def test_zero_vectors(self):
+        """Zero vectors score zero instead of dividing by zero."""
+        matrix = np.array([[0, 0], [0, 1]], dtype=np.float32)
+        indices, scores = top_k_similar([0, 1], matrix, k=2)
+        assert indices.tolist() == [[1, 0]]
+        assert scores.tolist() == [[1.0, 0.0]]
+
+
+class TestIVFIndex:
+    """IVFIndex tests."""
+
+    @staticmethod
+    def clustered_vectors(n, dim=16, n_clusters=20, seed=0):
+        """Make vectors scattered around a few random directions."""
+        rng = np.random.default_rng(seed)
+        centers = rng.standard_normal((n_clusters, dim))
+        labels = rng.integers(n_clusters, size=n)
+        return (centers[labels] + 0.1 * rng.standard_normal((n, dim))).astype(
+            np.float32
+        )
+
+    def test_exhaustive_until_trained(self):
+        """Small indexes are searched exhaustively and return exact results."""
+        vectors = self.clustered_vectors(100)
+        index = IVFIndex(min_train_size=1000)
+        index.add(np.arange(100) + 1000, vectors)
+        assert index.centroids is None
+        ids, scores = index.search(vectors[7], k=3)
+        assert ids[0] == 1007
+        assert np.isclose(scores[0], 1.0)
+
+    def test_recall_after_training(self):
+        """A trained index finds nearly all exact nearest neighbours."""
+        vectors = self.clustered_vectors(4000)
+        index = IVFIndex(n_probe=8, min_train_size=1000)
+        for ids in np.array_split(np.arange(4000), 8):
+            index.add(ids, vectors[ids])
+        assert index.centroids is None and index.needs_training
+        index.train()
+        assert not index.needs_training
+        assert sum(len(rows) for rows in index.lists) == 4000
+
+        queries = self.clustered_vectors(50, seed=1)
+        exact, _ = top_k_similar(queries, vectors, k=10)
+        hits = sum(
+            len(set(index.search(query, k=10)[0]) & set(expected))
+            for query, expected in zip(queries, exact)
+        )
+        assert hits / exact.size > 0.9
+
+    def test_add_skips_known_ids(self):
+        """Adding the same ids twice keeps a single copy."""
+        index = IVFIndex()
+        index.add([1, 2], [[1, 0], [0, 1]])
+        index.add([2, 3], [[0, 1], [1, 1]])
+        assert index.ids.tolist() == [1, 2, 3]
+
+    def test_remove(self):
+        """Removed vectors are no longer found, in trained and untrained indexes."""
+        vectors = self.clustered_vectors(1200)
+        index = IVFIndex(min_train_size=1000)
+        index.add(np.arange(1200), vectors)
+        index.remove([7, 5000])
+        assert len(index) == 1199
+        assert 7 not in index.search(vectors[7], k=5)[0]
+
+        index.train()
+        index.remove([8])
+        assert sum(len(rows) for rows in index.lists) == 1198
+        assert 8 not in index.search(vectors[8], k=5)[0]
+        assert index.search(vectors[9], k=1)[0][0] == 9
+
+    def test_save_and_load(self, tmp_path):
+        """A saved index loads with the same contents and results."""
+        vectors = self.clustered_vectors(1500)
+        index = IVFIndex(min_train_size=1000)
+        index.add(np.arange(1500), vectors)
+        index.train()
+        path = str(tmp_path / "index.npz")
+        index.save(path)
+
+        loaded = IVFIndex.load(path)
+        assert loaded.trained_size == index.trained_size
+        assert loaded.trained_size == 1500
+        assert np.array_equal(loaded.ids, index.ids)
+        assert np.array_equal(loaded.search(vectors[3])[0], index.search(vectors[3])[0])
+
+
+@pytest.mark.usefixtures("db")
+class TestChunkIndexStorage:
+    """Tests of the saved chunk index and its segments."""
+
+    @pytest.fixture
+    def index_path(self, app, tmp_path, monkeypatch):
+        """Save the index to a fresh path, with nothing loaded yet."""
+        path = str(tmp_path / "index.npz")
+        monkeypatch.setitem(app.config, "VECTOR_INDEX_PATH", path)
+        monkeypatch.setattr(vector_index, "_loaded", dict(vector_index._loaded))
+        return path
+
+    @staticmethod
+    def store_chunks(vectors):
+        """Store a transcript with one chunk per vector."""
+        transcript = Transcript.create(video_id="abc", text="text")
+        return [
+            TranscriptChunk.create(
+                transcript_id=transcript.id, chunk_index=i, text="text", vector=vector
+            )
+            for i, vector in enumerate(vectors)
+        ]
+
+    def test_loads_append_segments_until_compacted(self, index_path):
+        """Added and removed chunks are seen by readers before the base is rewritten."""
+        first = self.store_chunks(np.eye(3, 4))
+        index = vector_index.get_chunk_index()
+        assert sorted(index.ids.tolist()) == [chunk.id for chunk in first]
+        mtime = os.path.getmtime(index_path)
+
+        chunk = TranscriptChunk.create(
+            transcript_id=first[0].transcript_id,
+            chunk_index=3,
+            text="x",
+            vector=[0, 0, 0, 1],
+        )
+        vector_index.add_chunks_to_index([chunk])
+        vector_index.remove_chunks_from_index([first[0].id])
+        index = vector_index.get_chunk_index()
+        assert vector_index.get_chunk_index() is index
+        assert index.search([0, 0, 0, 1], k=1)[0].tolist() == [chunk.id]
+        assert first[0].id not in index.ids
+        assert os.path.getmtime(index_path) == mtime
+
+        assert vector_index.compact_chunk_index(min_segments=3) is None
+        compacted = vector_index.compact_chunk_index()
+        assert sorted(compacted.ids.tolist()) == sorted(index.ids.tolist())
+        assert not os.listdir(f"{index_path}.segments")
+        assert vector_index.get_chunk_index().ids.tolist() == compacted.ids.tolist()
+
+    def test_deleted_then_reused_id(self, index_path):
+        """A chunk id added again after its deletion is kept."""
+        vector_index.get_chunk_index()
+        (chunk,) = self.store_chunks([[1, 0]])
+        vector_index.add_chunks_to_index([chunk])
+        vector_index.remove_chunks_from_index([chunk.id])
+        vector_index.add_chunks_to_index(
+            [TranscriptChunk(id=chunk.id, text="text", vector=[0, 1])]
+        )
+        index = vector_index.get_chunk_index()
+        assert index.search([0, 1], k=1)[0].tolist() == [chunk.id]
+        assert vector_index.compact_chunk_index().ids.tolist() == [chunk.id]
+
+    def test_segment_appearing_late_is_applied(self, index_path):
+        """A segment that sorts before one already applied is still applied."""
+        vector_index.get_chunk_index()
+        first, second = self.store_chunks([[1, 0], [0, 1]])
+        vector_index.add_chunks_to_index([second])
+        assert second.id in vector_index.get_chunk_index().ids
+        vector_index.add_chunks_to_index([first])
+        # Give the new segment a name that sorts before the one applied already
+        segment_dir = f"{index_path}.segments"
+        newest = max(os.listdir(segment_dir))
+        os.rename(
+            os.path.join(segment_dir, newest), os.path.join(segment_dir, f"0-{newest}")
+        )
+        assert first.id in vector_index.get_chunk_index().ids
+        assert not vector_index._segments(
+            index_path, applied=vector_index.get_chunk_index().applied_segments
+        )
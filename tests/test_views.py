@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""User view tests."""
+import json
+
+import numpy as np
+import pytest
+
+from riddle_me_this.locks import LockTimeout
+from riddle_me_this.user import services, vector_index, views
+from riddle_me_this.user.jobs import TranscriptionPending
+from riddle_me_this.user.models import (
+    Transcript,
+    TranscriptChunk,
+    TranscriptionJob,
+    Video,
+)
+
+
+@pytest.fixture
+def client(app, user):
+    """A test client signed in as the user."""
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["_user_id"] = str(user.id)
+        session["_fresh"] = True
+    return client
+
+
+class TestSearch:
+    """Transcript search view tests."""
+
+    @pytest.fixture
+    def chunks(self, app, tmp_path, monkeypatch):
+        """Store and index a chunk of two videos, embedding text by its first letter."""
+        monkeypatch.setitem(
+            app.config, "VECTOR_INDEX_PATH", str(tmp_path / "index.npz")
+        )
+        monkeypatch.setattr(vector_index, "_loaded", dict(vector_index._loaded))
+        monkeypatch.setattr(
+            services,
+            "embed_texts",
+            lambda texts: np.array(
+                [[text[0] == "a", text[0] == "b"] for text in texts], dtype=np.float32
+            ),
+        )
+        Video.create(video_id="video_a", snippet_title="About a")
+        chunks = []
+        for video_id, text in (("video_a", "a passage"), ("video_b", "b passage")):
+            transcript = Transcript.create(video_id=video_id, text=text)
+            chunks.append(
+                TranscriptChunk.create(
+                    transcript_id=transcript.id,
+                    chunk_index=0,
+                    text=text,
+                    start_char=0,
+                    end_char=len(text),
+                    vector=services.embed_texts([text])[0],
+                )
+            )
+        vector_index.add_chunks_to_index(chunks)
+        return chunks
+
+    def test_finds_the_closest_video(self, client, chunks):
+        """The video whose chunk is closest to the query comes first, with its passage."""
+        response = client.get("/users/search/?q=about+a&limit=1")
+        assert response.status_code == 200
+        (result,) = response.json["results"]
+        assert result["video_id"] == "video_a"
+        assert result["title"] == "About a"
+        assert result["passages"][0]["text"] == "a passage"
+
+    def test_empty_query(self, client, chunks):
+        """Without a query, nothing is searched."""
+        response = client.get("/users/search/?q=")
+        assert response.json == {"query": "", "results": []}
+
+
+def read_events(response):
+    """Parse a text/event-stream body into (event, data) pairs."""
+    assert response.mimetype == "text/event-stream"
+    events = []
+    for block in response.get_data(as_text=True).strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields.get("event", "message"), json.loads(fields["data"])))
+    return events
+
+
+class TestAnswerStream:
+    """Streamed answer view tests."""
+
+    url = "/users/video_details/answer_stream/?input_text=Who%3F"
+
+    @pytest.fixture
+    def submitted(self, client, monkeypatch):
+        """Submit a video whose transcript is stored, answering with a fake model."""
+        with client.session_transaction() as session:
+            session["id_submitted"] = "dQw4w9WgXcQ"
+        monkeypatch.setattr(views, "get_and_load_transcripts", lambda video_id: "text")
+
+        def stream_response(transcript, query):
+            if query == "fail":
+                yield "partial"
+                raise RuntimeError("model error")
+            yield from ("Guido ", "van ", "Rossum")
+
+        monkeypatch.setattr(views, "stream_response", stream_response)
+        return client
+
+    def test_streams_tokens_then_done(self, submitted):
+        """Each token is a message, and a done event ends the answer."""
+        events = read_events(submitted.get(self.url))
+        assert events == [
+            ("message", {"token": "Guido "}),
+            ("message", {"token": "van "}),
+            ("message", {"token": "Rossum"}),
+            ("done", {}),
+        ]
+
+    def test_model_error(self, submitted):
+        """A failure while streaming ends the answer with an error event."""
+        response = submitted.get(self.url.replace("Who%3F", "fail"))
+        assert response.status_code == 200
+        assert read_events(response)[-1] == (
+            "error",
+            {"error": "Failed to generate an answer."},
+        )
+
+    def test_invalid_requests_are_error_events(self, client, submitted):
+        """A missing question or video is an error event the page can show."""
+        events = read_events(client.get("/users/video_details/answer_stream/"))
+        assert events == [("error", {"error": "No question given."})]
+        with client.session_transaction() as session:
+            session.pop("id_submitted")
+        events = read_events(client.get(self.url))
+        assert events == [("error", {"error": "No video submitted."})]
+
+    def test_pending_transcription(self, submitted, monkeypatch):
+        """A transcript still being produced is a pending event with its job."""
+        job = TranscriptionJob.create(video_id="dQw4w9WgXcQ")
+
+        def get_and_load_transcripts(video_id):
+            raise TranscriptionPending(job)
+
+        monkeypatch.setattr(views, "get_and_load_transcripts", get_and_load_transcripts)
+        ((event, data),) = read_events(submitted.get(self.url))
+        assert (event, data["id"], data["status"]) == ("pending", job.id, "queued")
+
+    def test_video_busy(self, submitted, monkeypatch):
+        """A video another request has been loading for too long is an error event."""
+
+        def get_and_load_transcripts(video_id):
+            raise LockTimeout("Timed out waiting for transcripts:dQw4w9WgXcQ")
+
+        monkeypatch.setattr(views, "get_and_load_transcripts", get_and_load_transcripts)
+        assert read_events(submitted.get(self.url)) == [
+            ("error", {"error": views.VIDEO_BUSY})
+        ]
+
+
+class TestBatchAnswers:
+    """Batch answer view tests."""
+
+    url = "/users/video_details/answers/"
+
+    @pytest.fixture
+    def answering(self, client, monkeypatch):
+        """Know one video, answering every question by echoing it."""
+
+        def get_video_info(video_id):
+            if video_id != "dQw4w9WgXcQ":
+                raise ValueError("Video not found.")
+
+        monkeypatch.setattr(views, "get_video_info", get_video_info)
+        monkeypatch.setattr(views, "get_and_load_transcripts", lambda video_id: "text")
+        monkeypatch.setattr(
+            views,
+            "get_responses",
+            lambda transcript, questions, max_concurrency: [
+                q.upper() for q in questions
+            ],
+        )
+        return client
+
+    def test_answers_in_order(self, answering):
+        """Each question comes back with its answer."""
+        response = answering.post(
+            self.url, json={"video_id": "dQw4w9WgXcQ", "questions": ["who", "where"]}
+        )
+        assert response.status_code == 200
+        assert response.json["answers"] == [
+            {"question": "who", "answer": "WHO"},
+            {"question": "where", "answer": "WHERE"},
+        ]
+
+    @pytest.mark.parametrize(
+        "payload",
+        [
+            {"questions": ["who"]},
+            {"video_id": "not a video id", "questions": ["who"]},
+            {"video_id": ["dQw4w9WgXcQ"], "questions": ["who"]},
+            {"video_id": "dQw4w9WgXcQ", "questions": []},
+            {"video_id": "dQw4w9WgXcQ", "questions": ["who", " "]},
+            {"video_id": "dQw4w9WgXcQ", "questions": ["q"] * 6},
+        ],
+    )
+    def test_invalid_requests(self, answering, payload):
+        """Missing or malformed video IDs and questions are rejected."""
+        assert answering.post(self.url, json=payload).status_code == 400
+
+    def test_unknown_video(self, answering):
+        """A well-formed ID of a video YouTube doesn't know is a 404."""
+        response = answering.post(
+            self.url, json={"video_id": "aaaaaaaaaaa", "questions": ["who"]}
+        )
+        assert response.status_code == 404
+
+    def test_pending_transcription(self, answering, monkeypatch):
+        """A transcript still being produced returns its job with a 202."""
+        job = TranscriptionJob.create(video_id="dQw4w9WgXcQ")
+
+        def get_and_load_transcripts(video_id):
+            raise TranscriptionPending(job)
+
+        monkeypatch.setattr(views, "get_and_load_transcripts", get_and_load_transcripts)
+        response = answering.post(
+            self.url, json={"video_id": "dQw4w9WgXcQ", "questions": ["who"]}
+        )
+        assert response.status_code == 202
+        assert response.json["id"] == job.id
+
+    def test_video_busy(self, answering, monkeypatch):
+        """A video another request has been loading for too long is a 503 to retry."""
+
+        def get_and_load_transcripts(video_id):
+            raise LockTimeout("Timed out waiting for transcripts:dQw4w9WgXcQ")
+
+        monkeypatch.setattr(views, "get_and_load_transcripts", get_and_load_transcripts)
+        response = answering.post(
+            self.url, json={"video_id": "dQw4w9WgXcQ", "questions": ["who"]}
+        )
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "30"
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""Whisper API unit tests, against a local stand-in for the transcription endpoint."""
+import json
+import re
+import shutil
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+import requests
+
+from riddle_me_this.user import whisper_api
+
+
+class FakeTranscriptionHandler(BaseHTTPRequestHandler):
+    """Answers each upload with one segment holding the name of the uploaded file."""
+
+    running = 0
+    max_running = 0
+    requests = 0
+    delay = 0.05
+    unavailable = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        """Transcribe an upload after a short delay, counting the uploads in flight."""
+        cls = type(self)
+        with cls.lock:
+            cls.running += 1
+            cls.max_running = max(cls.max_running, cls.running)
+            cls.requests += 1
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep(cls.delay)
+        with cls.lock:
+            cls.running -= 1
+            unavailable, cls.unavailable = cls.unavailable > 0, cls.unavailable - 1
+        if unavailable:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        authorized = self.headers["Authorization"] == "Bearer key"
+        if self.path != "/v1/audio/transcriptions" or not authorized:
+            self.send_response(401)
+            self.end_headers()
+            return
+        name = re.search(rb'filename="([^"]+)"', body).group(1).decode()
+        payload = json.dumps(
+            {
+                "text": name,
+                "language": "english",
+                "segments": [{"id": 0, "start": 1.0, "end": 2.0, "text": name}],
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        """Keep the test output quiet."""
+
+
+@pytest.fixture
+def api_base():
+    """Serve the fake transcription endpoint on a free local port."""
+    FakeTranscriptionHandler.max_running = 0
+    FakeTranscriptionHandler.requests = 0
+    FakeTranscriptionHandler.delay = 0.05
+    FakeTranscriptionHandler.unavailable = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeTranscriptionHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/v1"
+    server.shutdown()
+    server.server_close()
+
+
+def test_parts_are_uploaded_in_order_with_bounded_concurrency(api_base, tmp_path):
+    """Every part is transcribed, in order, with at most `concurrency` uploads in flight."""
+    paths = []
+    for i in range(5):
+        path = tmp_path / f"part{i}.webm"
+        path.write_bytes(b"\0" * 1000)
+        paths.append(str(path))
+    results = whisper_api.transcribe_parts(paths, api_base, "key", concurrency=2)
+    assert [result["text"] for result in results] == [f"part{i}.webm" for i in range(5)]
+    assert FakeTranscriptionHandler.max_running == 2
+
+
+def test_only_rejected_uploads_are_retried(api_base, tmp_path):
+    """A 503 is retried, but an upload whose response timed out isn't sent twice."""
+    path = tmp_path / "part0.webm"
+    path.write_bytes(b"\0" * 1000)
+    FakeTranscriptionHandler.unavailable = 1
+    with whisper_api.make_session(1) as session:
+        result = whisper_api.transcribe_part(session, str(path), api_base, "key")
+        assert result["text"] == "part0.webm"
+        assert FakeTranscriptionHandler.requests == 2
+
+        FakeTranscriptionHandler.delay = 0.5
+        with pytest.raises(requests.RequestException):
+            whisper_api.transcribe_part(
+                session, str(path), api_base, "key", timeout=0.1
+            )
+        time.sleep(0.5)
+        assert FakeTranscriptionHandler.requests == 3
+
+
+def test_segments_are_moved_to_their_part(app, api_base, tmp_path, monkeypatch):
+    """The segments of each part are shifted by the part's start time."""
+    app.config["WHISPER_API_BASE"] = api_base
+    monkeypatch.setenv("OPENAI_API_KEY", "key")
+    paths = []
+    for i in range(3):
+        path = tmp_path / f"part{i}.webm"
+        path.write_bytes(b"\0")
+        paths.append((str(path), 60.0 * i))
+    monkeypatch.setattr(
+        whisper_api, "split_audio_file", lambda path, directory, max_bytes: paths
+    )
+    transcription = whisper_api.transcribe_audio_file("audio.webm")
+    assert transcription["text"] == "part0.webm part1.webm part2.webm"
+    assert [segment["start"] for segment in transcription["segments"]] == [
+        1.0,
+        61.0,
+        121.0,
+    ]
+    assert [segment["id"] for segment in transcription["segments"]] == [0, 1, 2]
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="needs ffmpeg")
+def test_split_audio_file_respects_the_byte_budget(tmp_path):
+    """A file over the budget is split into contiguous parts under it."""
+    path = str(tmp_path / "audio.wav")
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(16000)
+        f.writeframes(np.zeros(16000 * 10, dtype=np.int16).tobytes())
+    assert whisper_api.split_audio_file(path, str(tmp_path), 10**6) == [(path, 0.0)]
+
+    parts = whisper_api.split_audio_file(path, str(tmp_path), 100000)
+    assert len(parts) > 1
+    assert parts[0][1] == 0.0
+    assert all(
+        start < next_start for (_, start), (_, next_start) in zip(parts, parts[1:])
+    )
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""YouTube client unit tests."""
+import json
+import threading
+
+import httplib2
+import pytest
+
+from riddle_me_this.user import youtube_client
+
+
+class FakeHttp:
+    """Stands in for httplib2.Http, answering every request with an empty item list."""
+
+    instances = []
+    requests = []
+    delay = None
+
+    def __init__(self, timeout=None):
+        """Record the new instance."""
+        self.instances.append(self)
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        """Record the request, waiting for `delay` if it is set."""
+        self.requests.append((uri, headers))
+        if self.delay:
+            self.delay.wait(1)
+        return httplib2.Response({"status": 200}), b'{"items": []}'
+
+
+@pytest.fixture
+def fake_http(monkeypatch):
+    """Use FakeHttp in a fresh connection pool."""
+    FakeHttp.instances, FakeHttp.requests, FakeHttp.delay = [], [], None
+    monkeypatch.setattr(httplib2, "Http", FakeHttp)
+    monkeypatch.setattr(youtube_client, "http_pool", youtube_client.HttpPool())
+    return FakeHttp
+
+
+@pytest.fixture
+def discovery_cache(monkeypatch):
+    """Count the reads of the bundled discovery documents, with an empty lru cache."""
+    reads = []
+    get_static_doc = youtube_client.discovery_cache.get_static_doc
+
+    def counted(api, version):
+        reads.append((api, version))
+        return get_static_doc(api, version)
+
+    monkeypatch.setattr(youtube_client.discovery_cache, "get_static_doc", counted)
+    youtube_client.get_discovery_document.cache_clear()
+    yield reads
+    youtube_client.get_discovery_document.cache_clear()
+
+
+class TestHttpPool:
+    """HttpPool tests."""
+
+    def test_sequential_requests_share_a_connection(self, fake_http):
+        """An idle Http object is reused by the next request."""
+        for _ in range(3):
+            youtube_client.http_pool.request("https://example.com")
+        assert len(fake_http.instances) == 1
+
+    def test_concurrent_requests_use_their_own(self, fake_http):
+        """Requests in flight at the same time never share an Http object."""
+        fake_http.delay = threading.Event()
+        threads = [
+            threading.Thread(
+                target=youtube_client.http_pool.request, args=("https://example.com",)
+            )
+            for _ in range(2)
+        ]
+        for thread in threads:
+            thread.start()
+        while len(fake_http.requests) < 2:
+            pass
+        fake_http.delay.set()
+        for thread in threads:
+            thread.join()
+        assert len(fake_http.instances) == 2
+
+
+class TestYoutubeService:
+    """build_youtube_service tests."""
+
+    def test_one_api_call_per_lookup(self, app, fake_http, discovery_cache):
+        """Clients are built from one parsed document and only call the API itself."""
+        for token in ("first", "second"):
+            youtube = youtube_client.build_youtube_service(token)
+            assert youtube.videos().list(part="snippet", id="x").execute() == {
+                "items": []
+            }
+        assert discovery_cache == [("youtube", "v3")]
+        assert [headers["authorization"] for _, headers in fake_http.requests] == [
+            "Bearer first",
+            "Bearer second",
+        ]
+        assert len(fake_http.instances) == 1
+
+    def test_discovery_document_is_cached_on_disk(
+        self, app, fake_http, discovery_cache, monkeypatch, tmp_path
+    ):
+        """Without a bundled document, it is downloaded once and then read from disk."""
+        app.config["DISCOVERY_CACHE_DIR"] = str(tmp_path)
+        monkeypatch.setattr(
+            youtube_client.discovery_cache, "get_static_doc", lambda api, version: None
+        )
+        with app.app_context():
+            assert youtube_client.get_discovery_document("fake", "v1") == {"items": []}
+            youtube_client.get_discovery_document.cache_clear()
+            assert youtube_client.get_discovery_document("fake", "v1") == {"items": []}
+        assert len(fake_http.requests) == 1
+        assert json.loads((tmp_path / "fake.v1.json").read_text()) == {"items": []}